@@ -0,0 +1,41 @@
+"""create ai_model_health_checks table
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 模型连接测试结果（时间序列）
+    op.create_table(
+        'ai_model_health_checks',
+        sa.Column('id', sa.String(36), primary_key=True),
+        sa.Column('model_id', sa.String(36), sa.ForeignKey('ai_models.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('checked_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column('success', sa.Boolean(), nullable=False),
+        sa.Column('latency_ms', sa.Float(), nullable=True),
+        sa.Column('error_class', sa.String(100), nullable=True),
+        sa.Column('message', sa.Text(), nullable=True),
+    )
+    op.create_index(
+        'ix_ai_model_health_checks_model_id_checked_at',
+        'ai_model_health_checks',
+        ['model_id', 'checked_at'],
+    )
+    op.create_index('ix_ai_model_health_checks_checked_at', 'ai_model_health_checks', ['checked_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ai_model_health_checks_checked_at', table_name='ai_model_health_checks')
+    op.drop_index('ix_ai_model_health_checks_model_id_checked_at', table_name='ai_model_health_checks')
+    op.drop_table('ai_model_health_checks')
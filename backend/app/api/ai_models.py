@@ -1,9 +1,11 @@
 """AI模型管理API"""
 
+import asyncio
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.models.ai_model import ModelProvider, ModelType
 from app.schemas.ai_model import (
@@ -12,6 +14,8 @@ from app.schemas.ai_model import (
     AIModelResponse,
     AIModelListResponse,
     AIModelTestResult,
+    AIModelBulkTestResponse,
+    AIModelLatencyHistoryResponse,
     DefaultModelsResponse,
 )
 from app.services.ai_model_service import AIModelService
@@ -61,6 +65,130 @@ async def get_default_models(db: Session = Depends(get_db)):
     )
 
 
+@router.get("/cache/stats")
+async def get_response_cache_stats():
+    """获取LLM响应缓存命中统计"""
+    from app.services.ai.response_cache import get_response_cache
+
+    return {
+        "enabled": settings.LLM_CACHE_ENABLED,
+        **await get_response_cache().stats(),
+    }
+
+
+@router.get("/rate-limits/stats")
+async def get_rate_limit_stats(db: Session = Depends(get_db)):
+    """获取已配置限流的模型的限流状态
+
+    令牌桶余量为所有进程共享的值，计数器为当前 API 进程的值。
+    """
+    from app.services.ai.rate_limit import get_rate_limiter
+
+    models = AIModelService.list_models(db, is_enabled=True)
+    result = []
+    for model in models:
+        config = model.extra_config or {}
+        if not (config.get("rpm") or config.get("tpm") or config.get("max_concurrency")):
+            continue
+        limiter = get_rate_limiter(
+            model.id, config.get("rpm"), config.get("tpm"), config.get("max_concurrency")
+        )
+        result.append({"model_name": model.name, **await limiter.stats()})
+    return {"items": result}
+
+
+@router.get("/resilience/stats")
+async def get_resilience_stats():
+    """获取当前 API 进程中各模型的重试/对冲计数和延迟分位数"""
+    from app.services.ai.resilience import get_policy_stats
+
+    return {"items": get_policy_stats()}
+
+
+@router.get("/routing/stats")
+async def get_routing_stats():
+    """获取当前 API 进程中各模型的路由延迟、错误率和熔断状态"""
+    from app.services.ai.model_router import get_router_stats
+
+    return {
+        "enabled": settings.MODEL_ROUTING_ENABLED,
+        "items": get_router_stats(),
+    }
+
+
+@router.get("/prompt-context/stats")
+async def get_prompt_context_stats():
+    """获取当前 API 进程中各步骤提示词上下文的 token 数和节省量"""
+    from app.services.pipeline.prompt_context import get_prompt_context_stats
+
+    return {"items": get_prompt_context_stats()}
+
+
+@router.get("/image-cache/stats")
+async def get_image_cache_stats():
+    """获取图像结果缓存统计"""
+    from app.services.ai.image_cache import get_image_cache
+
+    cache = get_image_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(cache.stats)}
+
+
+@router.post("/image-cache/evict")
+async def evict_image_cache():
+    """立即按保留时间和大小上限淘汰图像缓存"""
+    from app.services.ai.image_cache import get_image_cache
+
+    cache = get_image_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(cache.evict)}
+
+
+@router.post("/test-all", response_model=AIModelBulkTestResponse)
+async def test_all_models(
+    model_type: Optional[ModelType] = None,
+    timeout: Optional[float] = Query(None, gt=0, le=300),
+    db: Session = Depends(get_db),
+):
+    """并发测试所有启用的模型连接，结果写入延迟历史
+
+    Args:
+        model_type: 只测试指定类型
+        timeout: 所有测试共用的超时（秒），默认 MODEL_TEST_TIMEOUT
+    """
+    timeout = timeout or settings.MODEL_TEST_TIMEOUT
+    items = await AIModelService.test_all(db, model_type=model_type, timeout=timeout)
+    return AIModelBulkTestResponse(
+        items=items,
+        timeout=timeout,
+        total=len(items),
+        failed=sum(1 for item in items if not item.success),
+    )
+
+
+@router.get("/health-checks/history", response_model=AIModelLatencyHistoryResponse)
+async def get_health_check_history(
+    model_id: Optional[str] = None,
+    hours: int = Query(24, ge=1, le=24 * 30),
+    bucket_minutes: int = Query(60, ge=1, le=24 * 60),
+    db: Session = Depends(get_db),
+):
+    """获取各模型连接测试的 p50/p95 延迟历史
+
+    Args:
+        model_id: 只查询指定模型
+        hours: 查询最近多少小时
+        bucket_minutes: 每个时间段的分钟数
+    """
+    return AIModelLatencyHistoryResponse(
+        items=AIModelService.latency_history(db, model_id, hours, bucket_minutes),
+        hours=hours,
+        bucket_minutes=bucket_minutes,
+    )
+
+
 @router.get("/{model_id}", response_model=AIModelResponse)
 async def get_model(model_id: str, db: Session = Depends(get_db)):
     """获取模型详情"""
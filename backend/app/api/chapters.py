@@ -1,7 +1,8 @@
 """章节API"""
 
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
@@ -9,11 +10,19 @@ from app.core.security import get_current_user
 from app.models.user import User
 from app.models.project import Project
 from app.models.chapter import Chapter
+from app.models.story_outline import StoryOutline
+from app.core.sse import sse_response, stream_generation
 from app.schemas.chapter import ChapterCreate, ChapterUpdate, ChapterResponse
+from app.services.ai import AIAdapterFactory, BaseAIAdapter
+from app.services.pipeline.chapter_plan import ChapterPlanService
 
 router = APIRouter()
 
 
+class GenerateChaptersRequest(BaseModel):
+    target_chapters: int = 1
+
+
 def _get_project(project_id: str, user: User, db: Session) -> Project:
     project = db.query(Project).filter(
         Project.id == project_id, Project.owner_id == user.id
@@ -23,6 +32,14 @@ def _get_project(project_id: str, user: User, db: Session) -> Project:
     return project
 
 
+def _get_text_adapter(db: Session) -> Optional[BaseAIAdapter]:
+    """获取默认文本模型适配器，未配置时返回 None（使用环境变量配置）"""
+    try:
+        return AIAdapterFactory.get_text_adapter(db)
+    except ValueError:
+        return None
+
+
 @router.get("/{project_id}/chapters", response_model=List[ChapterResponse])
 async def list_chapters(
     project_id: str,
@@ -138,3 +155,38 @@ async def generate_chapters(
     _get_project(project_id, current_user, db)
     # TODO: 调用AI服务生成章节
     return {"status": "generating", "message": "AI章节生成功能待实现"}
+
+
+@router.post("/{project_id}/chapters/generate/stream")
+async def generate_chapters_stream(
+    project_id: str,
+    request: Optional[GenerateChaptersRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """AI流式生成章节规划（SSE）"""
+    project = _get_project(project_id, current_user, db)
+    request = request or GenerateChaptersRequest()
+    outline = db.query(StoryOutline).filter(StoryOutline.project_id == project_id).first()
+    if not outline:
+        raise HTTPException(status_code=400, detail="请先生成故事大纲")
+
+    story_outline = {
+        "synopsis_short": outline.synopsis_short or "",
+        "synopsis_mid": outline.synopsis_mid or "",
+        "key_beats": outline.key_beats or [],
+        "storylines": outline.storylines or [],
+    }
+    config = project.config or {}
+
+    service = ChapterPlanService(ai=_get_text_adapter(db))
+    chunks = service.plan_chapters_stream(
+        story_outline=story_outline,
+        panels_per_chapter=config.get("panels_per_chapter", 12),
+        target_chapters=request.target_chapters,
+    )
+    return sse_response(stream_generation(
+        chunks,
+        lambda text: service.parse_response(text, project_id),
+        discard=chunks.discard,
+    ))
@@ -1,12 +1,18 @@
 """导出API"""
 
-from typing import Literal
+from typing import List, Literal
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
+from app.core.pdf_stream import iter_pdf
+from app.core.security import get_current_user
+from app.models.user import User
+from app.models.project import Project
+from app.models.chapter import Chapter
+from app.services.pipeline.layout import list_chapter_pages
 
 router = APIRouter()
 
@@ -15,15 +21,46 @@ class ExportRequest(BaseModel):
     format: Literal["png", "jpg", "pdf", "psd"]
 
 
+def _get_project(project_id: str, user: User, db: Session) -> Project:
+    project = db.query(Project).filter(
+        Project.id == project_id, Project.owner_id == user.id
+    ).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="项目不存在")
+    return project
+
+
+def _pdf_response(page_paths: List[str], filename: str) -> StreamingResponse:
+    """逐页流式输出PDF，不在内存中生成整个文件"""
+    if not page_paths:
+        raise HTTPException(status_code=404, detail="没有已合成的页面")
+    return StreamingResponse(
+        iter_pdf(page_paths),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.post("/{project_id}/chapters/{chapter_id}/export")
 async def export_chapter(
     project_id: str,
     chapter_id: str,
     request: ExportRequest,
+    current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """导出章节"""
-    # TODO: 实现章节导出
+    _get_project(project_id, current_user, db)
+    chapter = db.query(Chapter).filter(
+        Chapter.id == chapter_id, Chapter.project_id == project_id
+    ).first()
+    if not chapter:
+        raise HTTPException(status_code=404, detail="章节不存在")
+
+    if request.format == "pdf":
+        return _pdf_response(list_chapter_pages(project_id, chapter_id), f"{chapter_id}.pdf")
+
+    # TODO: 实现其他格式的章节导出
     raise HTTPException(status_code=501, detail="Export not implemented yet")
 
 
@@ -31,8 +68,22 @@ async def export_chapter(
 async def export_project(
     project_id: str,
     request: ExportRequest,
+    current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """导出整个项目"""
-    # TODO: 实现项目导出
+    _get_project(project_id, current_user, db)
+
+    if request.format == "pdf":
+        chapters = db.query(Chapter).filter(
+            Chapter.project_id == project_id
+        ).order_by(Chapter.order).all()
+        page_paths = [
+            path
+            for chapter in chapters
+            for path in list_chapter_pages(project_id, chapter.id)
+        ]
+        return _pdf_response(page_paths, f"{project_id}.pdf")
+
+    # TODO: 实现其他格式的项目导出
     raise HTTPException(status_code=501, detail="Export not implemented yet")
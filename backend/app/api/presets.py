@@ -12,6 +12,7 @@ from app.models.preset import Preset
 from app.models.project import Project
 from app.models.story_bible import StoryBible, Character
 from app.schemas.preset import PresetCreate, PresetUpdate, PresetResponse, PresetListResponse
+from app.services.pipeline.panel_prompt import refresh_prompt_fragments
 
 router = APIRouter()
 
@@ -182,6 +183,7 @@ async def import_preset_to_project(
             reference_images=preset.data.get("reference_images", []),
             prompt_fragments=preset.data.get("prompt_fragments", []),
         )
+        refresh_prompt_fragments([char])
         db.add(char)
 
     elif preset.type == "world":
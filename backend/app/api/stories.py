@@ -1,6 +1,8 @@
 """故事大纲API"""
 
+from typing import Literal, Optional
 from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
@@ -8,11 +10,20 @@ from app.core.security import get_current_user
 from app.models.user import User
 from app.models.project import Project
 from app.models.story_outline import StoryOutline
+from app.models.story_bible import StoryBible
+from app.core.sse import sse_response, stream_generation
 from app.schemas.story import StoryOutlineResponse, StoryOutlineUpdate
+from app.services.ai import AIAdapterFactory, BaseAIAdapter
+from app.services.pipeline.story_expand import StoryExpandService
 
 router = APIRouter()
 
 
+class GenerateStoryRequest(BaseModel):
+    story_input: Optional[str] = None  # 不提供则使用项目简介
+    length: Literal["short", "mid", "long"] = "short"
+
+
 def _get_project(project_id: str, user: User, db: Session) -> Project:
     project = db.query(Project).filter(
         Project.id == project_id, Project.owner_id == user.id
@@ -22,6 +33,37 @@ def _get_project(project_id: str, user: User, db: Session) -> Project:
     return project
 
 
+def _get_text_adapter(db: Session) -> Optional[BaseAIAdapter]:
+    """获取默认文本模型适配器，未配置时返回 None（使用环境变量配置）"""
+    try:
+        return AIAdapterFactory.get_text_adapter(db)
+    except ValueError:
+        return None
+
+
+def _story_bible_context(project_id: str, db: Session) -> dict:
+    """读取项目的Story Bible作为扩写上下文"""
+    story_bible = db.query(StoryBible).filter(StoryBible.project_id == project_id).first()
+    if not story_bible:
+        return {}
+    return {
+        "characters": [
+            {
+                "id": c.id,
+                "name": c.name,
+                "appearance": c.appearance or {},
+                "personality": c.personality or "",
+                "motivation": c.motivation or "",
+                "relationships": c.relationships or [],
+            }
+            for c in story_bible.characters
+        ],
+        "world": story_bible.world or {},
+        "style_guide": story_bible.style_guide or {},
+        "continuity_rules": story_bible.continuity_rules or [],
+    }
+
+
 @router.get("/{project_id}/story/outline", response_model=StoryOutlineResponse)
 async def get_story_outline(
     project_id: str,
@@ -78,3 +120,30 @@ async def generate_story(
     _get_project(project_id, current_user, db)
     # TODO: 调用AI服务生成故事
     return {"status": "generating", "message": "AI故事生成功能待实现"}
+
+
+@router.post("/{project_id}/story/generate/stream")
+async def generate_story_stream(
+    project_id: str,
+    request: Optional[GenerateStoryRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """AI流式生成故事大纲（SSE）"""
+    project = _get_project(project_id, current_user, db)
+    request = request or GenerateStoryRequest()
+    story_input = request.story_input or project.description
+    if not story_input:
+        raise HTTPException(status_code=400, detail="缺少故事梗概")
+
+    service = StoryExpandService(ai=_get_text_adapter(db))
+    chunks = service.expand_stream(
+        story_input=story_input,
+        story_bible=_story_bible_context(project_id, db),
+        length=request.length,
+    )
+    return sse_response(stream_generation(
+        chunks,
+        lambda text: service.parse_response(text, project_id),
+        discard=chunks.discard,
+    ))
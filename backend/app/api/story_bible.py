@@ -1,6 +1,8 @@
 """Story Bible API"""
 
+from typing import Optional
 from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
@@ -8,11 +10,22 @@ from app.core.security import get_current_user
 from app.models.user import User
 from app.models.project import Project
 from app.models.story_bible import StoryBible, Character
+from app.core.sse import sse_response, stream_generation
 from app.schemas.story_bible import StoryBibleResponse, StoryBibleUpdate
+from app.services.ai import AIAdapterFactory, BaseAIAdapter
+from app.services.pipeline.story_bible import StoryBibleService
+from app.services.pipeline.panel_prompt import (
+    generated_fragments,
+    refresh_prompt_fragments,
+)
 
 router = APIRouter()
 
 
+class GenerateStoryBibleRequest(BaseModel):
+    story_input: Optional[str] = None  # 不提供则使用项目简介
+
+
 def _get_project(project_id: str, user: User, db: Session) -> Project:
     project = db.query(Project).filter(
         Project.id == project_id, Project.owner_id == user.id
@@ -22,6 +35,14 @@ def _get_project(project_id: str, user: User, db: Session) -> Project:
     return project
 
 
+def _get_text_adapter(db: Session) -> Optional[BaseAIAdapter]:
+    """获取默认文本模型适配器，未配置时返回 None（使用环境变量配置）"""
+    try:
+        return AIAdapterFactory.get_text_adapter(db)
+    except ValueError:
+        return None
+
+
 def _build_response(story_bible: StoryBible) -> StoryBibleResponse:
     """构建 StoryBible 响应"""
     characters = []
@@ -83,7 +104,9 @@ async def update_story_bible(
     # 处理角色更新
     if "characters" in update_data and update_data["characters"] is not None:
         # 删除旧角色，重建
+        generated = generated_fragments(story_bible.characters)
         db.query(Character).filter(Character.story_bible_id == story_bible.id).delete()
+        characters = []
         for char_data in update_data["characters"]:
             char = Character(
                 story_bible_id=story_bible.id,
@@ -97,6 +120,9 @@ async def update_story_bible(
                 prompt_fragments=char_data.get("prompt_fragments", []),
             )
             db.add(char)
+            characters.append(char)
+        # 出图提示词使用的角色描述片段，为空或随外貌修改而过期时重新生成
+        refresh_prompt_fragments(characters, generated)
         del update_data["characters"]
 
     # 处理其他字段
@@ -122,3 +148,27 @@ async def generate_story_bible(
     _get_project(project_id, current_user, db)
     # TODO: 调用AI服务生成Story Bible
     return {"status": "generating", "message": "AI世界观生成功能待实现"}
+
+
+@router.post("/{project_id}/story-bible/generate/stream")
+async def generate_story_bible_stream(
+    project_id: str,
+    request: Optional[GenerateStoryBibleRequest] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """AI流式生成Story Bible（SSE）"""
+    project = _get_project(project_id, current_user, db)
+    story_input = (request.story_input if request else None) or project.description
+    if not story_input:
+        raise HTTPException(status_code=400, detail="缺少故事梗概")
+
+    config = project.config or {}
+    service = StoryBibleService(ai=_get_text_adapter(db))
+    chunks = service.generate_stream(
+        story_input=story_input,
+        style=config.get("style", "manga"),
+        tone=config.get("tone", "comedy"),
+        max_characters=config.get("max_characters", 5),
+    )
+    return sse_response(stream_generation(chunks, service.parse_response, discard=chunks.discard))
@@ -1,6 +1,6 @@
 """分镜脚本API"""
 
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
 
@@ -9,7 +9,11 @@ from app.core.security import get_current_user
 from app.models.user import User
 from app.models.project import Project
 from app.models.chapter import Chapter, Scene, Panel
+from app.models.story_bible import StoryBible
+from app.core.sse import sse_response, stream_events
 from app.schemas.storyboard import StoryboardResponse, PanelUpdate, Scene as SceneSchema, Panel as PanelSchema
+from app.services.ai import AIAdapterFactory, BaseAIAdapter
+from app.services.pipeline.panel_script import PanelScriptService
 
 router = APIRouter()
 
@@ -23,6 +27,14 @@ def _get_project(project_id: str, user: User, db: Session) -> Project:
     return project
 
 
+def _get_text_adapter(db: Session) -> Optional[BaseAIAdapter]:
+    """获取默认文本模型适配器，未配置时返回 None（使用环境变量配置）"""
+    try:
+        return AIAdapterFactory.get_text_adapter(db)
+    except ValueError:
+        return None
+
+
 @router.get("/{project_id}/chapters/{chapter_id}/storyboard", response_model=StoryboardResponse)
 async def get_storyboard(
     project_id: str,
@@ -141,3 +153,53 @@ async def generate_storyboard(
     _get_project(project_id, current_user, db)
     # TODO: 调用AI服务生成分镜
     return {"status": "generating", "message": "AI分镜生成功能待实现"}
+
+
+@router.post("/{project_id}/chapters/{chapter_id}/storyboard/generate/stream")
+async def generate_storyboard_stream(
+    project_id: str,
+    chapter_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """AI流式生成分镜脚本（SSE）
+
+    每个分镜生成完毕立即推送 panel 事件，场景结束推送 scene 事件，
+    最后推送 storyboard（完整脚本）和 done；格式不合法的分镜推送 invalid。
+    """
+    _get_project(project_id, current_user, db)
+    chapter = db.query(Chapter).filter(
+        Chapter.id == chapter_id, Chapter.project_id == project_id
+    ).first()
+    if not chapter:
+        raise HTTPException(status_code=404, detail="章节不存在")
+    story_bible = db.query(StoryBible).filter(StoryBible.project_id == project_id).first()
+    if not story_bible:
+        raise HTTPException(status_code=400, detail="请先生成Story Bible")
+
+    chapter_info = {
+        "id": chapter.id,
+        "order": chapter.order,
+        "title": chapter.title,
+        "logline": chapter.logline or "",
+        "beats": chapter.beats or [],
+        "cliffhanger": chapter.cliffhanger or "",
+    }
+    characters = [
+        {
+            "id": c.id,
+            "name": c.name,
+            "appearance": c.appearance or {},
+            "personality": c.personality or "",
+        }
+        for c in story_bible.characters
+    ]
+
+    service = PanelScriptService(ai=_get_text_adapter(db))
+    events = service.stream_panels(
+        chapter_info=chapter_info,
+        characters=characters,
+        world=story_bible.world or {},
+        estimated_panels=chapter.estimated_panels or 12,
+    )
+    return sse_response(stream_events(events))
@@ -0,0 +1,171 @@
+"""二进制产物存储
+
+生成的图像只写入一次存储，之后在流水线、Celery 任务参数/结果中以引用传递：
+{"artifact_id", "location", "sha256", "mime_type", "size"}，只有几百字节，而不是数 MB 的 base64。
+文件按内容哈希存放在 {ARTIFACT_DIR}/<哈希前两位>/<哈希>.<扩展名>，相同内容只存一份；
+location 是相对存储根目录的路径，API 进程和 Celery worker 共享 DATA_DIR 即可互相读取。
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import threading
+import uuid
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, Optional, Union
+
+from app.core.config import settings
+
+
+# 文件头 -> (MIME 类型, 扩展名)
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"GIF8", "image/gif", "gif"),
+)
+_EXTENSIONS = {"png", "jpg", "gif", "webp", "bin"}
+
+
+def sniff_mime_type(data: bytes) -> tuple:
+    """按文件头识别 (MIME 类型, 扩展名)"""
+    for signature, mime_type, extension in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type, extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    return "application/octet-stream", "bin"
+
+
+def _location(digest: str, extension: str) -> str:
+    return os.path.join(digest[:2], f"{digest}.{extension}")
+
+
+class Artifact:
+    """存储中的一个产物"""
+
+    __slots__ = ("artifact_id", "location", "sha256", "mime_type", "size")
+
+    def __init__(self, artifact_id: str, location: str, sha256: str, mime_type: str, size: int):
+        self.artifact_id = artifact_id
+        self.location = location
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.size = size
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可 JSON 序列化的引用"""
+        return {
+            "artifact_id": self.artifact_id,
+            "location": self.location,
+            "sha256": self.sha256,
+            "mime_type": self.mime_type,
+            "size": self.size,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Artifact":
+        return cls(
+            artifact_id=data["artifact_id"],
+            location=data["location"],
+            sha256=data["sha256"],
+            mime_type=data.get("mime_type", "application/octet-stream"),
+            size=data.get("size", 0),
+        )
+
+
+def is_artifact(value: Any) -> bool:
+    """是否为产物引用（Artifact 或其 to_dict 结果）"""
+    return isinstance(value, Artifact) or (
+        isinstance(value, dict) and "location" in value and "sha256" in value
+    )
+
+
+class ArtifactStore:
+    """内容寻址的产物存储（本地目录）"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, artifact: Union[Artifact, Dict[str, Any]]) -> str:
+        """产物的文件路径
+
+        引用来自任务参数，不信任其中的 location：路径按 sha256 和扩展名重新生成，
+        不是合法的哈希或扩展名时抛出 ValueError，避免读取存储目录以外的文件。
+        """
+        if isinstance(artifact, Artifact):
+            digest, location = artifact.sha256, artifact.location
+        else:
+            digest, location = artifact["sha256"], artifact["location"]
+        extension = os.path.splitext(str(location))[1][1:]
+        if (
+            not isinstance(digest, str)
+            or len(digest) != 64
+            or any(c not in "0123456789abcdef" for c in digest)
+            or extension not in _EXTENSIONS
+        ):
+            raise ValueError(f"无效的产物引用: {location}")
+        return os.path.join(self.root, _location(digest, extension))
+
+    def put_bytes(self, data: bytes, mime_type: Optional[str] = None) -> Artifact:
+        """写入数据（同步），内容已存在时不重复写入"""
+        digest = hashlib.sha256(data).hexdigest()
+        sniffed, extension = sniff_mime_type(data)
+        location = _location(digest, extension)
+        path = os.path.join(self.root, location)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return Artifact(
+            artifact_id=str(uuid.uuid4()),
+            location=location,
+            sha256=digest,
+            mime_type=mime_type or sniffed,
+            size=len(data),
+        )
+
+    async def put(self, data: bytes, mime_type: Optional[str] = None) -> Artifact:
+        """写入数据"""
+        return await asyncio.to_thread(self.put_bytes, data, mime_type)
+
+    async def put_base64(self, image_base64: str) -> Artifact:
+        """解码 base64 图像并写入（解码和写入都在线程中执行）"""
+        return await asyncio.to_thread(
+            lambda: self.put_bytes(base64.b64decode(image_base64))
+        )
+
+    def open(self, artifact: Union[Artifact, Dict[str, Any]]) -> BinaryIO:
+        """以二进制方式打开产物"""
+        return open(self.path(artifact), "rb")
+
+    def read_bytes(self, artifact: Union[Artifact, Dict[str, Any]]) -> bytes:
+        with self.open(artifact) as f:
+            return f.read()
+
+
+_store: Optional[ArtifactStore] = None
+
+
+def get_artifact_store() -> ArtifactStore:
+    """获取进程内共享的产物存储"""
+    global _store
+    if _store is None:
+        _store = ArtifactStore(settings.ARTIFACT_DIR or os.path.join(settings.DATA_DIR, "artifacts"))
+    return _store
+
+
+def image_source(value: Union[str, Artifact, Dict[str, Any]]) -> Union[str, BinaryIO]:
+    """图像的可读来源：产物引用返回文件路径（按需打开），base64 返回内存文件"""
+    if is_artifact(value):
+        return get_artifact_store().path(value)
+    return BytesIO(base64.b64decode(value))
+
+
+def image_base64(value: Union[str, Artifact, Dict[str, Any]]) -> str:
+    """图像的 base64（用于需要 base64 的后端接口，如 img2img 的输入图）"""
+    if is_artifact(value):
+        return base64.b64encode(get_artifact_store().read_bytes(value)).decode("utf-8")
+    return value
@@ -1,6 +1,9 @@
 """Celery配置"""
 
+import asyncio
+
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 from app.core.config import settings
 
@@ -29,3 +32,15 @@ celery_app.conf.update(
     task_time_limit=3600,  # 1小时超时
     worker_prefetch_multiplier=1,
 )
+
+
+@worker_process_shutdown.connect
+def _close_async_resources(**kwargs):
+    """Worker进程退出时关闭共享HTTP连接池和ComfyUI事件监听"""
+    from app.core.http_client import close_http_clients
+    from app.services.ai.comfyui_ws import close_event_listeners
+
+    loop = asyncio.get_event_loop()
+    if not loop.is_closed():
+        loop.run_until_complete(close_event_listeners())
+        loop.run_until_complete(close_http_clients())
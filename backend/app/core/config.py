@@ -1,6 +1,6 @@
 """应用配置"""
 
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 
@@ -25,8 +25,68 @@ class Settings(BaseSettings):
     ANTHROPIC_API_KEY: str = ""
     SD_API_URL: str = "http://localhost:7860"
     COMFYUI_API_URL: str = "http://localhost:8188"
+    COMFYUI_WORKFLOW_DIR: str = ""  # 工作流模板目录，默认 {DATA_DIR}/workflows
+    COMFYUI_CHECKPOINT: str = ""  # 未配置模型时使用的 ComfyUI 模型文件名
     MIDJOURNEY_API_KEY: str = ""
     
+    # HTTP连接池配置 (SD/ComfyUI 等自建服务)
+    HTTP_POOL_MAX_CONNECTIONS: int = 100
+    HTTP_POOL_MAX_KEEPALIVE: int = 20
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_POOL_DEFAULT_TIMEOUT: float = 300.0
+    HTTP2_ENABLED: bool = False  # 需要安装 httpx[http2]
+    
+    # LLM响应缓存配置
+    LLM_CACHE_ENABLED: bool = False  # 也可通过模型 extra_config.response_cache 单独开启
+    LLM_CACHE_TTL: int = 60 * 60 * 24  # 1天
+    LLM_CACHE_LOCAL_MAX_ENTRIES: int = 256
+    LLM_CACHE_MAX_ENTRY_BYTES: int = 1024 * 1024  # 1MB
+    
+    # LLM请求重试与对冲配置（对冲通过模型 extra_config.hedge 开启）
+    LLM_MAX_RETRIES: int = 3  # 429/5xx/连接错误的重试次数，替代 SDK 内置重试
+    LLM_RETRY_BACKOFF: float = 1.0  # 首次退避时间（秒），之后指数增长
+    LLM_RETRY_BACKOFF_MAX: float = 30.0
+    LLM_HEDGE_MIN_DELAY: float = 5.0  # 对冲等待时间下限（秒）
+    
+    # 同类型模型间的路由与熔断（未指定模型ID时在所有启用的模型间按偏好和延迟路由）
+    MODEL_ROUTING_ENABLED: bool = True
+    MODEL_CIRCUIT_FAILURE_THRESHOLD: int = 3  # 连续失败次数达到后熔断
+    MODEL_CIRCUIT_OPEN_SECONDS: float = 30.0  # 首次熔断时间，试探失败后翻倍
+    MODEL_CIRCUIT_OPEN_MAX_SECONDS: float = 600.0
+    
+    # 模型连接测试
+    MODEL_TEST_TIMEOUT: float = 30.0  # 单个测试及批量测试共用的超时（秒）
+    MODEL_HEALTH_RETENTION_DAYS: int = 30  # 连接测试历史保留天数
+    
+    # 各步骤提示词上下文（故事圣经、大纲等）的 token 预算，超出时截断
+    PROMPT_CONTEXT_BUDGETS: Dict[str, int] = {
+        "story_expand": 6000,
+        "chapter_plan": 8000,
+        "panel_script": 6000,
+    }
+    
+    # 每个图像后端同时执行的请求数，可通过模型 extra_config.max_concurrency（后端池每项可单独配置）覆盖
+    IMAGE_MAX_CONCURRENCY: int = 2
+    
+    # 排版合成：条漫按此高度（像素）的条带逐块渲染和编码
+    LAYOUT_STRIP_HEIGHT: int = 1024
+    LAYOUT_PAGE_WORKERS: int = 0  # 页漫并行渲染的进程数，0 表示 CPU 核数
+    # 气泡字体：按顺序使用第一个存在的字体文件（需支持中日文），都不存在时使用 PIL 默认字体
+    LAYOUT_FONT_PATHS: List[str] = [
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+        "/System/Library/Fonts/PingFang.ttc",
+        "C:/Windows/Fonts/msyh.ttc",
+    ]
+    LAYOUT_MIN_FONT_SIZE: int = 12  # 文字放不下气泡时缩小到的最小字号
+    
+    # 图像结果缓存配置（仅缓存固定种子的SD请求）
+    IMAGE_CACHE_ENABLED: bool = True
+    IMAGE_CACHE_DIR: str = ""  # 默认 {DATA_DIR}/cache/images
+    IMAGE_CACHE_MAX_BYTES: int = 5 * 1024 * 1024 * 1024  # 5GB
+    IMAGE_CACHE_MAX_AGE_DAYS: int = 30
+    
     # JWT 认证配置
     SECRET_KEY: str = "man-secret-key-change-in-production"
     JWT_ALGORITHM: str = "HS256"
@@ -37,6 +97,7 @@ class Settings(BaseSettings):
     
     # 文件存储配置
     DATA_DIR: str = "./data"
+    ARTIFACT_DIR: str = ""  # 生成图像等产物的存储目录，默认 {DATA_DIR}/artifacts
     MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024  # 50MB
     
     class Config:
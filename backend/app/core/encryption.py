@@ -2,6 +2,7 @@
 
 import os
 import base64
+from functools import lru_cache
 from typing import Optional
 from cryptography.fernet import Fernet
 
@@ -10,7 +11,12 @@ from app.core.config import settings
 
 def _get_fernet() -> Fernet:
     """获取Fernet加密实例"""
-    key = settings.ENCRYPTION_KEY
+    return _build_fernet(settings.ENCRYPTION_KEY)
+
+
+@lru_cache(maxsize=4)
+def _build_fernet(key: str) -> Fernet:
+    """根据配置的密钥构建Fernet实例（按密钥缓存）"""
     if not key:
         # 如果没有配置加密密钥，生成一个警告并使用默认密钥
         # 生产环境中必须配置 ENCRYPTION_KEY
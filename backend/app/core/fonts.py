@@ -0,0 +1,189 @@
+"""气泡文字排版用的字体注册表
+
+进程内共享：配置的 CJK 字体每个字号只加载一次，字形宽度按字符缓存，
+断行和字号适配结果按 (字体, 文本, 气泡尺寸, 最大字号) 缓存，同一章节大量重复的对白不再重复测量。
+断行规则：CJK 字符之间可断行，连续的字母数字作为一个单词不拆开（超过行宽时才按字符拆），
+行首禁则标点悬挂在上一行末尾。
+"""
+
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import ImageFont
+
+from app.core.config import settings
+
+
+# 不能出现在行首的标点，放不下时悬挂在上一行末尾
+NO_LINE_START = set("，。、！？；：）」』】》〉…—～,.!?;:)]}’”%")
+
+
+class FontFace:
+    """某一字号的字体及其字形宽度缓存"""
+
+    __slots__ = ("font", "size", "line_height", "_advances")
+
+    def __init__(self, font: ImageFont.ImageFont, size: int):
+        self.font = font
+        self.size = size
+        if hasattr(font, "getmetrics"):
+            ascent, descent = font.getmetrics()
+            self.line_height = ascent + descent
+        else:
+            self.line_height = size
+        self._advances: Dict[str, float] = {}
+
+    def advance(self, char: str) -> float:
+        """单个字符的宽度"""
+        width = self._advances.get(char)
+        if width is None:
+            width = self._advances[char] = self.font.getlength(char)
+        return width
+
+    def measure(self, text: str) -> float:
+        """文本宽度（按字符宽度累加，不计字偶距）"""
+        advance = self.advance
+        return sum(advance(c) for c in text)
+
+
+class TextLayout(NamedTuple):
+    """适配到气泡内的文字排版结果"""
+
+    font_path: Optional[str]
+    size: int
+    lines: Tuple[str, ...]
+    line_height: int
+    height: int
+    fits: bool  # 最小字号仍放不下时为 False
+
+
+@lru_cache(maxsize=1)
+def font_path() -> Optional[str]:
+    """LAYOUT_FONT_PATHS 中第一个存在的字体文件，都不存在时返回 None（使用 PIL 默认字体）"""
+    for path in settings.LAYOUT_FONT_PATHS:
+        if path and os.path.exists(path):
+            return path
+    print("No CJK font found in LAYOUT_FONT_PATHS, falling back to the default font")
+    return None
+
+
+_faces: Dict[Tuple[Optional[str], int], FontFace] = {}
+_lock = threading.Lock()
+
+
+def get_font(size: int, path: Optional[str] = None) -> FontFace:
+    """获取字号对应的字体，每个 (字体文件, 字号) 只加载一次"""
+    path = path or font_path()
+    key = (path, size)
+    face = _faces.get(key)
+    if face is not None:
+        return face
+    with _lock:
+        face = _faces.get(key)
+        if face is None:
+            if path:
+                font = ImageFont.truetype(path, size)
+            else:
+                font = ImageFont.load_default(size)
+            face = _faces[key] = FontFace(font, size)
+    return face
+
+
+def _tokens(text: str) -> List[str]:
+    """拆分为断行单位：连续的字母数字为一个单词，空白和其他字符各自为一个单位"""
+    tokens = []
+    word = ""
+    for char in text:
+        if char.isascii() and char.isalnum():
+            word += char
+            continue
+        if word:
+            tokens.append(word)
+            word = ""
+        tokens.append(char)
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+def wrap_text(text: str, face: FontFace, max_width: float) -> List[str]:
+    """按行宽断行，保留文本中的换行"""
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        width = 0.0
+        for token in _tokens(paragraph):
+            token_width = face.measure(token)
+            if line and width + token_width > max_width:
+                if token.isspace():
+                    continue
+                if token in NO_LINE_START:
+                    line += token
+                    width += token_width
+                    continue
+                lines.append(line.rstrip())
+                line, width = "", 0.0
+            if not line and token.isspace():
+                continue
+            if token_width > max_width:
+                # 单词比行宽还长，按字符拆分
+                for char in token:
+                    char_width = face.advance(char)
+                    if line and width + char_width > max_width:
+                        lines.append(line)
+                        line, width = "", 0.0
+                    line += char
+                    width += char_width
+                continue
+            line += token
+            width += token_width
+        lines.append(line.rstrip())
+    return lines
+
+
+@lru_cache(maxsize=4096)
+def _layout_text(
+    path: Optional[str],
+    text: str,
+    box_width: int,
+    box_height: int,
+    max_size: int,
+    min_size: int,
+) -> TextLayout:
+    size = max_size
+    while True:
+        face = get_font(size, path)
+        lines = wrap_text(text, face, box_width)
+        height = len(lines) * face.line_height
+        if height <= box_height or size <= min_size:
+            return TextLayout(
+                font_path=path,
+                size=size,
+                lines=tuple(lines),
+                line_height=face.line_height,
+                height=height,
+                fits=height <= box_height,
+            )
+        size = max(min_size, size - 2)
+
+
+def layout_text(
+    text: str,
+    box_width: int,
+    box_height: int,
+    max_size: int,
+    min_size: Optional[int] = None,
+) -> TextLayout:
+    """在气泡内断行并选择字号：从 max_size 开始逐步缩小，直到所有行放得下
+
+    Args:
+        text: 文字
+        box_width: 可用宽度（已扣除内边距）
+        box_height: 可用高度
+        max_size: 最大字号
+        min_size: 最小字号，默认 LAYOUT_MIN_FONT_SIZE
+    """
+    min_size = min(min_size or settings.LAYOUT_MIN_FONT_SIZE, max_size)
+    return _layout_text(font_path(), text, max(1, box_width), max(1, box_height), max_size, min_size)
@@ -0,0 +1,85 @@
+"""共享HTTP连接池
+
+按 base_url 复用长连接的 httpx.AsyncClient，避免每次请求都重新建立 TCP/TLS 连接。
+客户端与创建它的事件循环绑定，事件循环变化时会自动重建。
+"""
+
+import asyncio
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+
+# base_url -> (所属事件循环, 客户端)
+_clients: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+
+def _http2_available() -> bool:
+    """检查是否安装了 HTTP/2 依赖（httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client(base_url: str) -> httpx.AsyncClient:
+    """创建带连接池配置的客户端"""
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        limits=limits,
+        timeout=httpx.Timeout(settings.HTTP_POOL_DEFAULT_TIMEOUT),
+        http2=settings.HTTP2_ENABLED and _http2_available(),
+    )
+
+
+def get_http_client(base_url: str) -> httpx.AsyncClient:
+    """获取指定 base_url 的共享客户端
+
+    Args:
+        base_url: 服务基础 URL
+
+    Returns:
+        复用连接池的 httpx.AsyncClient，调用方不应关闭它
+    """
+    key = base_url.rstrip("/")
+    loop = asyncio.get_running_loop()
+
+    entry = _clients.get(key)
+    if entry:
+        owner_loop, client = entry
+        if owner_loop is loop and not client.is_closed:
+            return client
+
+    client = _build_client(key)
+    _clients[key] = (loop, client)
+    return client
+
+
+async def close_http_clients(base_url: Optional[str] = None) -> None:
+    """关闭共享客户端
+
+    Args:
+        base_url: 只关闭指定 URL 的客户端，不指定则全部关闭
+    """
+    if base_url:
+        keys = [base_url.rstrip("/")]
+    else:
+        keys = list(_clients.keys())
+
+    loop = asyncio.get_running_loop()
+    for key in keys:
+        entry = _clients.pop(key, None)
+        if not entry:
+            continue
+        owner_loop, client = entry
+        # 只能在创建它的事件循环中关闭连接，其他循环的客户端直接丢弃
+        if owner_loop is loop and not client.is_closed:
+            await client.aclose()
@@ -0,0 +1,146 @@
+"""增量JSON解析
+
+逐段接收模型输出，在指定路径上的对象闭合时立即解析返回，不必等待完整响应。
+路径由键名和数组下标组成，模式中的 "*" 匹配任意键或下标，例如 ("scenes", "*", "panels", "*")。
+根对象必须是 JSON 对象，第一个 '{' 之前的内容（如 ```json）和根对象结束之后的内容会被忽略。
+"""
+
+import json
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple, Union
+
+
+PathKey = Union[str, int]
+Path = Tuple[PathKey, ...]
+
+
+class _Frame:
+    """一层正在解析的对象或数组"""
+
+    __slots__ = ("is_object", "start", "key", "index", "expect_key", "current_key")
+
+    def __init__(self, is_object: bool, start: int, key: Optional[PathKey]):
+        self.is_object = is_object
+        self.start = start
+        self.key = key
+        self.index = 0
+        self.expect_key = is_object
+        self.current_key: Optional[str] = None
+
+
+def match_path(path: Path, pattern: Sequence[PathKey]) -> bool:
+    """路径是否匹配模式"""
+    if len(path) != len(pattern):
+        return False
+    return all(p == "*" or p == k for k, p in zip(path, pattern))
+
+
+class JSONStreamParser:
+    """增量JSON解析器"""
+
+    def __init__(self, patterns: Sequence[Sequence[PathKey]]):
+        """初始化
+
+        Args:
+            patterns: 需要提取的对象路径模式
+        """
+        self.patterns = [tuple(p) for p in patterns]
+        self._text = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._started = False
+        self.finished = False
+
+    def _child_key(self) -> Optional[PathKey]:
+        """即将打开的值在父容器中的键"""
+        if not self._stack:
+            return None
+        parent = self._stack[-1]
+        return parent.current_key if parent.is_object else parent.index
+
+    def _path(self) -> Path:
+        return tuple(f.key for f in self._stack[1:])
+
+    def feed(self, text: str) -> List[Tuple[Path, Any]]:
+        """输入一段文本，返回本段内闭合的匹配对象 [(路径, 值)]"""
+        self._text += text
+        if self.finished or not text:
+            return []
+
+        results: List[Tuple[Path, Any]] = []
+        data = self._text
+
+        i = self._pos
+        while i < len(data):
+            c = data[i]
+
+            if not self._started:
+                if c == "{":
+                    self._started = True
+                    self._stack.append(_Frame(True, i, None))
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    frame = self._stack[-1]
+                    if frame.is_object and frame.expect_key:
+                        frame.current_key = json.loads(data[self._string_start:i + 1])
+                        frame.expect_key = False
+                i += 1
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                self._stack.append(_Frame(c == "{", i, self._child_key()))
+            elif c in "}]":
+                frame = self._stack.pop()
+                path = self._path() + ((frame.key,) if self._stack else ())
+                if any(match_path(path, p) for p in self.patterns):
+                    results.append((path, json.loads(data[frame.start:i + 1])))
+                if not self._stack:
+                    self.finished = True
+                    self._pos = i + 1
+                    return results
+            elif c == ",":
+                frame = self._stack[-1]
+                if frame.is_object:
+                    frame.expect_key = True
+                else:
+                    frame.index += 1
+            i += 1
+
+        self._pos = i
+        return results
+
+    @property
+    def text(self) -> str:
+        """已接收的完整文本"""
+        return self._text
+
+
+async def iter_json_objects(
+    chunks: AsyncIterator[str],
+    patterns: Sequence[Sequence[PathKey]],
+    parser: Optional[JSONStreamParser] = None,
+) -> AsyncIterator[Tuple[Path, Any]]:
+    """从流式文本中逐个产出匹配路径的对象
+
+    Args:
+        chunks: 增量文本
+        patterns: 路径模式
+        parser: 可传入解析器以便结束后读取完整文本
+    """
+    parser = parser or JSONStreamParser(patterns)
+    async for text in chunks:
+        for item in parser.feed(text):
+            yield item
@@ -0,0 +1,269 @@
+"""流式PDF写入
+
+逐页追加图像并立即写出，已写出的页只保留对象偏移量，内存占用与页数无关：
+- JPEG（灰度 / RGB / CMYK）按原数据以 DCTDecode 嵌入，不重新编码
+- 非隔行的 8 位灰度 / RGB PNG 直接复制 IDAT 数据（FlateDecode + PNG 预测器），不解码
+- 其他格式解码后按行块 Flate 压缩
+对象长度在数据写完后以间接对象给出，因此输出只需支持 write（文件或 HTTP 流式响应）。
+"""
+
+import struct
+import zlib
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Union
+
+from PIL import Image
+
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+_ENCODE_STRIP_HEIGHT = 256
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_JPEG_COLOR_SPACES = {"L": ("DeviceGray", 1), "RGB": ("DeviceRGB", 3), "CMYK": ("DeviceCMYK", 4)}
+_PNG_COLOR_SPACES = {0: ("DeviceGray", 1), 2: ("DeviceRGB", 3)}  # PNG 颜色类型 -> (颜色空间, 通道数)
+
+# 对象编号：1 为 Catalog，2 为 Pages，页面对象从 3 开始
+_CATALOG = 1
+_PAGES = 2
+
+
+def _png_stream_info(fp: BinaryIO) -> Optional[dict]:
+    """可直接嵌入的 PNG 的尺寸和 IDAT 位置，不满足条件时返回 None"""
+    fp.seek(0)
+    if fp.read(8) != _PNG_SIGNATURE:
+        return None
+    length, kind = struct.unpack(">I4s", fp.read(8))
+    if kind != b"IHDR":
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", fp.read(13))
+    if bit_depth != 8 or interlace or color_type not in _PNG_COLOR_SPACES:
+        return None
+    fp.seek(length - 13 + 4, 1)
+
+    idat = []  # [(偏移, 长度)]
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return None
+        length, kind = struct.unpack(">I4s", header)
+        if kind == b"IDAT":
+            idat.append((fp.tell(), length))
+        elif kind == b"IEND":
+            break
+        elif kind in (b"tRNS", b"PLTE"):
+            return None
+        fp.seek(length + 4, 1)
+    color_space, colors = _PNG_COLOR_SPACES[color_type]
+    return {
+        "width": width,
+        "height": height,
+        "color_space": color_space,
+        "colors": colors,
+        "idat": idat,
+    }
+
+
+class PDFStreamWriter:
+    """逐页写入图像的PDF"""
+
+    def __init__(self, fp: BinaryIO, resolution: float = 72.0):
+        """初始化并写入文件头
+
+        Args:
+            fp: 输出（只需支持 write）
+            resolution: 图像分辨率（DPI），决定页面的物理尺寸，与 PIL 保存 PDF 的默认值一致
+        """
+        self.fp = fp
+        self.resolution = resolution
+        self.position = 0
+        self._offsets: List[int] = [0, 0, 0]  # 下标为对象编号，0 号不使用
+        self._pages: List[int] = []
+        self._closed = False
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def _write(self, data: bytes) -> None:
+        self.fp.write(data)
+        self.position += len(data)
+
+    def _new_object(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _begin(self, number: int) -> None:
+        self._offsets[number] = self.position
+        self._write(f"{number} 0 obj\n".encode())
+
+    def _object(self, number: int, body: str) -> None:
+        self._begin(number)
+        self._write(f"{body}\nendobj\n".encode())
+
+    def _stream(self, number: int, dictionary: str, chunks: Iterable[bytes]) -> None:
+        """写入流对象，长度写在其后的间接对象中"""
+        length_number = self._new_object()
+        self._begin(number)
+        self._write(f"<< {dictionary} /Length {length_number} 0 R >>\nstream\n".encode())
+        length = 0
+        for chunk in chunks:
+            if chunk:
+                self._write(chunk)
+                length += len(chunk)
+        self._write(b"\nendstream\nendobj\n")
+        self._object(length_number, str(length))
+
+    def add_page(self, source: Union[str, BinaryIO]) -> None:
+        """追加一页，页面尺寸与图像一致
+
+        Args:
+            source: 图像文件路径或文件对象（需支持 seek）
+        """
+        if self._closed:
+            raise ValueError("PDF 已关闭")
+        if isinstance(source, str):
+            with open(source, "rb") as fp:
+                self._add_page(fp)
+        else:
+            self._add_page(source)
+
+    def _add_page(self, fp: BinaryIO) -> None:
+        image_number = self._new_object()
+        png = _png_stream_info(fp)
+        if png:
+            width, height = png["width"], png["height"]
+            self._stream(
+                image_number,
+                f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /{png['color_space']} /BitsPerComponent 8 /Filter /FlateDecode "
+                f"/DecodeParms << /Predictor 15 /Colors {png['colors']} "
+                f"/BitsPerComponent 8 /Columns {width} >>",
+                self._copy_ranges(fp, png["idat"]),
+            )
+        else:
+            fp.seek(0)
+            with Image.open(fp) as img:
+                width, height = img.size
+                if img.format == "JPEG" and img.mode in _JPEG_COLOR_SPACES:
+                    color_space, _ = _JPEG_COLOR_SPACES[img.mode]
+                    # Adobe 软件写出的 CMYK JPEG 是反相存储的
+                    decode = " /Decode [1 0 1 0 1 0 1 0]" if img.mode == "CMYK" and "adobe" in img.info else ""
+                    fp.seek(0, 2)
+                    size = fp.tell()
+                    self._stream(
+                        image_number,
+                        f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                        f"/ColorSpace /{color_space} /BitsPerComponent 8 /Filter /DCTDecode{decode}",
+                        self._copy_ranges(fp, [(0, size)]),
+                    )
+                else:
+                    mode = "L" if img.mode in ("1", "L") else "RGB"
+                    self._stream(
+                        image_number,
+                        f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                        f"/ColorSpace /{'DeviceGray' if mode == 'L' else 'DeviceRGB'} "
+                        f"/BitsPerComponent 8 /Filter /FlateDecode",
+                        self._encode(img, mode),
+                    )
+
+        page_width = width * 72.0 / self.resolution
+        page_height = height * 72.0 / self.resolution
+        content_number = self._new_object()
+        content = f"q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /Im0 Do Q".encode()
+        self._stream(content_number, "", [content])
+
+        page_number = self._new_object()
+        self._object(
+            page_number,
+            f"<< /Type /Page /Parent {_PAGES} 0 R "
+            f"/MediaBox [0 0 {page_width:.4f} {page_height:.4f}] "
+            f"/Resources << /XObject << /Im0 {image_number} 0 R >> >> "
+            f"/Contents {content_number} 0 R >>",
+        )
+        self._pages.append(page_number)
+
+    @staticmethod
+    def _copy_ranges(fp: BinaryIO, ranges: List[tuple]) -> Iterator[bytes]:
+        """按块读取文件中的若干区间"""
+        for offset, length in ranges:
+            fp.seek(offset)
+            while length > 0:
+                chunk = fp.read(min(length, _COPY_CHUNK_SIZE))
+                if not chunk:
+                    raise ValueError("图像文件不完整")
+                length -= len(chunk)
+                yield chunk
+
+    @staticmethod
+    def _encode(img: Image.Image, mode: str) -> Iterator[bytes]:
+        """按行块转换并压缩像素"""
+        compressor = zlib.compressobj(6)
+        for top in range(0, img.height, _ENCODE_STRIP_HEIGHT):
+            strip = img.crop((0, top, img.width, min(top + _ENCODE_STRIP_HEIGHT, img.height)))
+            if strip.mode != mode:
+                if strip.mode in ("RGBA", "LA") or (strip.mode == "P" and "transparency" in img.info):
+                    # 透明部分按白色背景合成
+                    strip = strip.convert("RGBA")
+                    background = Image.new("RGBA", strip.size, "white")
+                    strip = Image.alpha_composite(background, strip)
+                strip = strip.convert(mode)
+            yield compressor.compress(strip.tobytes())
+        yield compressor.flush()
+
+    def close(self) -> None:
+        """写入页面树、交叉引用表和文件尾"""
+        if self._closed:
+            return
+        if not self._pages:
+            raise ValueError("PDF 至少需要一页")
+        self._closed = True
+        kids = " ".join(f"{number} 0 R" for number in self._pages)
+        self._object(_PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>")
+        self._object(_CATALOG, f"<< /Type /Catalog /Pages {_PAGES} 0 R >>")
+
+        xref = self.position
+        lines = [f"xref\n0 {len(self._offsets)}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{offset:010d} 00000 n \n" for offset in self._offsets[1:])
+        lines.append(
+            f"trailer\n<< /Size {len(self._offsets)} /Root {_CATALOG} 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n"
+        )
+        self._write("".join(lines).encode())
+
+
+class _ChunkBuffer:
+    """收集写入的数据，供生成器分段产出"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.chunks.append(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_pdf(sources: Iterable[Union[str, BinaryIO]], resolution: float = 72.0) -> Iterator[bytes]:
+    """逐页生成PDF数据，用于 HTTP 流式响应（每次产出一页）"""
+    buffer = _ChunkBuffer()
+    writer = PDFStreamWriter(buffer, resolution)
+    for source in sources:
+        writer.add_page(source)
+        yield buffer.drain()
+    writer.close()
+    yield buffer.drain()
+
+
+def write_pdf(
+    sources: Iterable[Union[str, BinaryIO]],
+    fp: BinaryIO,
+    resolution: float = 72.0,
+) -> int:
+    """逐页写入PDF文件，返回页数"""
+    writer = PDFStreamWriter(fp, resolution)
+    for source in sources:
+        writer.add_page(source)
+    writer.close()
+    return writer.page_count
@@ -0,0 +1,95 @@
+"""流式PNG编码
+
+按行块（条带）写入像素并增量压缩输出，内存占用只与条带大小有关，与图像总高度无关。
+每行使用 Up 滤波（与上一行做差），由 ImageChops.subtract_modulo 计算。
+"""
+
+import struct
+import zlib
+from typing import BinaryIO, Optional
+
+from PIL import Image, ImageChops
+
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4)}  # 模式 -> (颜色类型, 每像素字节数)
+_FILTER_UP = b"\x02"
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF)
+    )
+
+
+class PNGStreamWriter:
+    """按条带写入的PNG编码器"""
+
+    def __init__(
+        self,
+        fp: BinaryIO,
+        width: int,
+        height: int,
+        mode: str = "RGB",
+        compress_level: int = 6,
+    ):
+        """初始化并写入文件头
+
+        Args:
+            fp: 输出文件（只需支持 write）
+            width: 图像宽度
+            height: 图像总高度
+            mode: L / RGB / RGBA
+            compress_level: zlib 压缩级别
+        """
+        if mode not in _COLOR_TYPES:
+            raise ValueError(f"不支持的图像模式: {mode}")
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._previous_row: Optional[Image.Image] = None
+
+        color_type, self._bytes_per_pixel = _COLOR_TYPES[mode]
+        fp.write(_SIGNATURE)
+        fp.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+
+    def write(self, strip: Image.Image) -> None:
+        """写入一个条带，宽度必须与图像相同"""
+        if strip.width != self.width:
+            raise ValueError(f"条带宽度 {strip.width} 与图像宽度 {self.width} 不一致")
+        if self.rows_written + strip.height > self.height:
+            raise ValueError("写入的行数超过图像高度")
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+
+        # 上一行图像：条带整体下移一行，首行取上一条带的末行（第一条带为全 0）
+        above = Image.new(self.mode, strip.size)
+        if self._previous_row is not None:
+            above.paste(self._previous_row, (0, 0))
+        above.paste(strip.crop((0, 0, self.width, strip.height - 1)), (0, 1))
+        self._previous_row = strip.crop((0, strip.height - 1, self.width, strip.height))
+
+        data = ImageChops.subtract_modulo(strip, above).tobytes()
+        stride = self.width * self._bytes_per_pixel
+        raw = b"".join(
+            _FILTER_UP + data[offset:offset + stride] for offset in range(0, len(data), stride)
+        )
+        self._write_idat(self._compressor.compress(raw))
+        self.rows_written += strip.height
+
+    def _write_idat(self, data: bytes) -> None:
+        if data:
+            self.fp.write(_chunk(b"IDAT", data))
+
+    def close(self) -> None:
+        """写入剩余压缩数据和文件尾"""
+        if self.rows_written != self.height:
+            raise ValueError(f"只写入了 {self.rows_written}/{self.height} 行")
+        self._write_idat(self._compressor.flush())
+        self.fp.write(_chunk(b"IEND", b""))
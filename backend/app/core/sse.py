@@ -0,0 +1,64 @@
+"""Server-Sent Events 工具"""
+
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+
+def format_sse(event: str, data: Any) -> str:
+    """格式化单条 SSE 消息"""
+    payload = json.dumps(jsonable_encoder(data), ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def stream_generation(
+    chunks: AsyncIterator[str],
+    parse: Callable[[str], Any],
+    discard: Optional[Callable[[], Awaitable[None]]] = None,
+) -> AsyncIterator[str]:
+    """将模型增量输出转为 SSE 事件流
+
+    事件依次为：若干 token（增量文本）、result（解析后的完整结果）或 error、done。
+    
+    Args:
+        discard: 完整输出解析失败时调用，删除缓存的响应，使重新生成时再次请求模型
+    """
+    parts = []
+    try:
+        async for text in chunks:
+            parts.append(text)
+            yield format_sse("token", {"text": text})
+        try:
+            result = parse("".join(parts))
+        except Exception:
+            if discard is not None:
+                await discard()
+            raise
+        yield format_sse("result", result)
+    except Exception as e:
+        yield format_sse("error", {"message": str(e)})
+    yield format_sse("done", {})
+
+
+async def stream_events(events: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[str]:
+    """将 (事件名, 数据) 序列转为 SSE 事件流，出错时发送 error，最后发送 done"""
+    try:
+        async for event, data in events:
+            yield format_sse(event, data)
+    except Exception as e:
+        yield format_sse("error", {"message": str(e)})
+    yield format_sse("done", {})
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """构建 SSE 响应（禁用代理缓冲）"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
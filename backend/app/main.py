@@ -7,6 +7,9 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import auth, users, projects, presets, story_bible, stories, chapters, storyboard, assets, generation, export, ai_models
 from app.core.config import settings
+from app.core.http_client import close_http_clients
+from app.services.ai.adapter_cache import stop_subscriber
+from app.services.ai.comfyui_ws import close_event_listeners
 
 
 @asynccontextmanager
@@ -17,6 +20,9 @@ async def lifespan(app: FastAPI):
     yield
     # 关闭时
     print("MAN Backend shutting down...")
+    stop_subscriber()
+    await close_event_listeners()
+    await close_http_clients()
 
 
 app = FastAPI(
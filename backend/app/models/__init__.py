@@ -7,7 +7,7 @@ from app.models.story_bible import StoryBible, Character
 from app.models.chapter import Chapter, Scene, Panel
 from app.models.asset import Asset
 from app.models.preset import Preset
-from app.models.ai_model import AIModel, ModelProvider, ModelType
+from app.models.ai_model import AIModel, AIModelHealthCheck, ModelProvider, ModelType
 
 __all__ = [
     "User",
@@ -21,6 +21,7 @@ __all__ = [
     "Asset",
     "Preset",
     "AIModel",
+    "AIModelHealthCheck",
     "ModelProvider",
     "ModelType",
 ]
@@ -3,7 +3,9 @@
 import uuid
 from enum import Enum
 from datetime import datetime
-from sqlalchemy import Column, String, Text, JSON, DateTime, Integer, Float, Boolean, Enum as SQLEnum
+from sqlalchemy import (
+    Column, String, Text, JSON, DateTime, Integer, Float, Boolean, ForeignKey, Index, Enum as SQLEnum
+)
 
 from app.core.database import Base
 
@@ -78,3 +80,23 @@ class AIModel(Base):
 
     def __repr__(self):
         return f"<AIModel {self.name} ({self.provider.value}/{self.model_name})>"
+
+
+class AIModelHealthCheck(Base):
+    """模型连接测试结果（时间序列）"""
+    __tablename__ = "ai_model_health_checks"
+    __table_args__ = (
+        Index("ix_ai_model_health_checks_model_id_checked_at", "model_id", "checked_at"),
+    )
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    model_id = Column(
+        String(36),
+        ForeignKey("ai_models.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    checked_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    success = Column(Boolean, nullable=False, comment="是否连接成功")
+    latency_ms = Column(Float, nullable=True, comment="耗时(毫秒)")
+    error_class = Column(String(100), nullable=True, comment="异常类型，如 TimeoutError / AuthenticationError")
+    message = Column(Text, nullable=True, comment="结果说明")
@@ -12,6 +12,8 @@ from app.schemas.ai_model import (
     AIModelResponse,
     AIModelListResponse,
     AIModelTestResult,
+    AIModelBulkTestResponse,
+    AIModelLatencyHistoryResponse,
     DefaultModelsResponse,
 )
 
@@ -32,5 +34,7 @@ __all__ = [
     "AIModelResponse",
     "AIModelListResponse",
     "AIModelTestResult",
+    "AIModelBulkTestResponse",
+    "AIModelLatencyHistoryResponse",
     "DefaultModelsResponse",
 ]
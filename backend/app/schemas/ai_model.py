@@ -143,6 +143,51 @@ class AIModelTestResult(BaseModel):
     success: bool
     message: str
     latency_ms: Optional[float] = None
+    error_class: Optional[str] = None
+
+
+class AIModelHealthCheckItem(AIModelTestResult):
+    """批量连接测试中单个模型的结果"""
+    model_id: str
+    name: str
+    provider: ModelProvider
+    model_type: ModelType
+
+
+class AIModelBulkTestResponse(BaseModel):
+    """批量连接测试结果"""
+    items: List[AIModelHealthCheckItem]
+    timeout: float
+    total: int
+    failed: int
+
+
+class LatencyBucket(BaseModel):
+    """一个时间段内的连接测试统计"""
+    start: datetime
+    checks: int
+    failures: int
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+
+
+class AIModelLatencyHistory(BaseModel):
+    """模型的连接测试延迟历史"""
+    model_id: str
+    name: str
+    checks: int
+    failures: int
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    last_error_class: Optional[str] = None
+    buckets: List[LatencyBucket]
+
+
+class AIModelLatencyHistoryResponse(BaseModel):
+    """各模型的延迟历史"""
+    items: List[AIModelLatencyHistory]
+    hours: int
+    bucket_minutes: int
 
 
 class DefaultModelsResponse(BaseModel):
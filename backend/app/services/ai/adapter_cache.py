@@ -0,0 +1,104 @@
+"""适配器实例缓存
+
+按 (适配器类别, 模型ID) 缓存已创建的适配器，版本号取模型的 updated_at，
+配置变更后自动重建。模型更新/删除时通过 Redis pub/sub 通知所有 API 和 Celery 进程清除缓存。
+"""
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from app.models.ai_model import AIModel
+
+
+INVALIDATE_CHANNEL = "man:ai-models:invalidate"
+
+# (类别, 模型ID) -> (版本, 适配器)
+_adapters: Dict[Tuple[str, str], Tuple[Optional[str], Any]] = {}
+_lock = threading.Lock()
+_subscriber = None
+
+
+def _version(model: AIModel) -> Optional[str]:
+    """模型配置版本"""
+    return model.updated_at.isoformat() if model.updated_at else None
+
+
+def get_cached_adapter(kind: str, model: AIModel) -> Optional[Any]:
+    """获取缓存的适配器，配置版本不一致时返回 None"""
+    _ensure_subscriber()
+    with _lock:
+        entry = _adapters.get((kind, model.id))
+    if entry and entry[0] == _version(model):
+        return entry[1]
+    return None
+
+
+def cache_adapter(kind: str, model: AIModel, adapter: Any) -> None:
+    """缓存适配器"""
+    with _lock:
+        _adapters[(kind, model.id)] = (_version(model), adapter)
+
+
+def invalidate_local(model_id: Optional[str] = None) -> None:
+    """清除当前进程的缓存
+
+    Args:
+        model_id: 只清除指定模型，不指定则全部清除
+    """
+    with _lock:
+        if model_id is None:
+            _adapters.clear()
+            return
+        for key in [k for k in _adapters if k[1] == model_id]:
+            del _adapters[key]
+
+
+def invalidate_adapters(model_id: str) -> None:
+    """清除指定模型的缓存并通知其他进程"""
+    invalidate_local(model_id)
+
+    from app.core.redis import get_redis
+
+    try:
+        get_redis().publish(INVALIDATE_CHANNEL, model_id)
+    except Exception as e:
+        # Redis 不可用时其他进程依赖 updated_at 版本检查
+        print(f"Failed to publish adapter invalidation for {model_id}: {e}")
+
+
+def _handle_message(message: dict) -> None:
+    """处理失效通知"""
+    data = message.get("data")
+    if isinstance(data, bytes):
+        data = data.decode()
+    if data:
+        invalidate_local(data)
+
+
+def _ensure_subscriber() -> None:
+    """首次使用缓存时启动后台订阅线程"""
+    global _subscriber
+    if _subscriber is not None:
+        return
+
+    from app.core.redis import get_redis
+
+    with _lock:
+        if _subscriber is not None:
+            return
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATE_CHANNEL: _handle_message})
+            _subscriber = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        except Exception as e:
+            # 订阅失败不影响使用，仅依赖版本检查
+            print(f"Failed to subscribe adapter invalidation channel: {e}")
+            _subscriber = False
+
+
+def stop_subscriber() -> None:
+    """停止订阅线程"""
+    global _subscriber
+    if _subscriber:
+        _subscriber.stop()
+    _subscriber = None
@@ -1,7 +1,8 @@
 """AI服务适配器基类"""
 
+import os
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict, Any
+from typing import AsyncIterator, Optional, List, Dict, Any, Union
 
 
 class BaseAIAdapter(ABC):
@@ -14,10 +15,40 @@ class BaseAIAdapter(ABC):
         system_prompt: Optional[str] = None,
         max_tokens: int = 4096,
         temperature: float = 0.7,
+        context: Optional[str] = None,
     ) -> str:
-        """生成文本"""
+        """生成文本
+
+        Args:
+            prompt: 每次变化的提示词
+            system_prompt: 系统提示词
+            max_tokens: 最大输出 token 数
+            temperature: 温度
+            context: 跨请求不变的上下文（如故事圣经），放在 prompt 之前，
+                支持提示词缓存的服务商会缓存 system_prompt + context 前缀
+        """
         pass
 
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: int = 4096,
+        temperature: float = 0.7,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成文本，逐段返回增量内容
+
+        默认一次性返回完整结果，支持流式输出的适配器应覆盖此方法。
+        """
+        yield await self.generate_text(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            context=context,
+        )
+
     @abstractmethod
     async def generate_image(
         self,
@@ -33,16 +64,24 @@ class BaseAIAdapter(ABC):
     @abstractmethod
     async def analyze_image(
         self,
-        image_url: str,
+        image: Union[str, bytes, os.PathLike],
         prompt: str,
     ) -> str:
-        """分析图像"""
+        """分析图像
+
+        Args:
+            image: HTTP(S) URL、data URL、本地文件路径或原始字节
+            prompt: 提示词
+        """
         pass
 
 
 class BaseImageAdapter(ABC):
     """图像生成服务适配器基类"""
 
+    # 后端可同时执行的请求数，None 表示使用 IMAGE_MAX_CONCURRENCY
+    max_concurrency: Optional[int] = None
+
     @abstractmethod
     async def txt2img(
         self,
@@ -57,6 +96,34 @@ class BaseImageAdapter(ABC):
         """文生图"""
         pass
 
+    async def txt2img_batch(
+        self,
+        prompts: List[str],
+        negative_prompt: Optional[str] = None,
+        width: int = 1024,
+        height: int = 1024,
+        steps: int = 20,
+        cfg_scale: float = 7.0,
+        seed: int = -1,
+    ) -> List[Optional[str]]:
+        """批量文生图，每个提示词返回一张图像
+
+        默认逐个调用 txt2img，支持批量请求的适配器可覆盖此方法。
+        """
+        results = []
+        for prompt in prompts:
+            images = await self.txt2img(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                width=width,
+                height=height,
+                steps=steps,
+                cfg_scale=cfg_scale,
+                seed=seed,
+            )
+            results.append(images[0] if images else None)
+        return results
+
     @abstractmethod
     async def img2img(
         self,
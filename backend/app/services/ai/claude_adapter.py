@@ -1,10 +1,12 @@
 """Claude服务适配器"""
 
-from typing import Optional, List
+import os
+from typing import Any, AsyncIterator, Dict, Optional, List, Union
 from anthropic import AsyncAnthropic
 
 from app.core.config import settings
 from app.services.ai.base import BaseAIAdapter
+from app.services.ai.image_input import load_image
 
 
 class ClaudeAdapter(BaseAIAdapter):
@@ -17,6 +19,7 @@ class ClaudeAdapter(BaseAIAdapter):
         model_name: str = "claude-3-opus-20240229",
         default_max_tokens: Optional[int] = None,
         timeout: int = 300,
+        max_retries: int = 2,
     ):
         """初始化 Claude 适配器
         
@@ -26,6 +29,7 @@ class ClaudeAdapter(BaseAIAdapter):
             model_name: 模型名称
             default_max_tokens: 默认最大 token 数
             timeout: 请求超时时间（秒）
+            max_retries: SDK 内置重试次数，由外层重试策略接管时设为 0
         """
         self.model_name = model_name
         self.default_max_tokens = default_max_tokens or 4096
@@ -34,25 +38,67 @@ class ClaudeAdapter(BaseAIAdapter):
             api_key=api_key or settings.ANTHROPIC_API_KEY,
             base_url=base_url,
             timeout=timeout,
+            max_retries=max_retries,
         )
 
+    @staticmethod
+    def _build_system(
+        system_prompt: Optional[str],
+        context: Optional[str],
+    ) -> Union[str, List[Dict[str, Any]]]:
+        """构建系统提示词，有固定上下文时在其末尾设置缓存断点
+
+        system_prompt + context 作为可缓存前缀（cache_control: ephemeral），
+        同一项目的后续请求只需重新计算变化的 prompt 部分。
+        """
+        if not context:
+            return system_prompt or ""
+        blocks: List[Dict[str, Any]] = []
+        if system_prompt:
+            blocks.append({"type": "text", "text": system_prompt})
+        blocks.append({
+            "type": "text",
+            "text": context,
+            "cache_control": {"type": "ephemeral"},
+        })
+        return blocks
+
     async def generate_text(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
+        context: Optional[str] = None,
     ) -> str:
         """使用Claude生成文本"""
         response = await self.client.messages.create(
             model=self.model_name,
             max_tokens=max_tokens or self.default_max_tokens,
-            system=system_prompt or "",
+            system=self._build_system(system_prompt, context),
             messages=[{"role": "user", "content": prompt}],
         )
 
         return response.content[0].text
 
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """使用Claude流式生成文本"""
+        async with self.client.messages.stream(
+            model=self.model_name,
+            max_tokens=max_tokens or self.default_max_tokens,
+            system=self._build_system(system_prompt, context),
+            messages=[{"role": "user", "content": prompt}],
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
     async def generate_image(
         self,
         prompt: str,
@@ -66,20 +112,14 @@ class ClaudeAdapter(BaseAIAdapter):
 
     async def analyze_image(
         self,
-        image_url: str,
+        image: Union[str, bytes, os.PathLike],
         prompt: str,
     ) -> str:
-        """使用Claude分析图像"""
-        import httpx
-        import base64
-
-        # 下载图像并转为base64
-        async with httpx.AsyncClient() as client:
-            response = await client.get(image_url)
-            image_data = base64.b64encode(response.content).decode("utf-8")
+        """使用Claude分析图像
 
-        # 获取图像类型
-        content_type = response.headers.get("content-type", "image/jpeg")
+        URL 图像经共享缓存下载编码，本地文件和字节直接编码，不经过网络。
+        """
+        content_type, image_data = await load_image(image)
 
         response = await self.client.messages.create(
             model=self.model_name,
@@ -1,12 +1,76 @@
 """ComfyUI服务适配器"""
 
 from typing import Optional, List, Dict, Any
+import asyncio
+import base64
+import hashlib
 import httpx
 import json
-import uuid
+import random
 
 from app.core.config import settings
+from app.core.http_client import get_http_client
 from app.services.ai.base import BaseImageAdapter
+from app.services.ai.comfyui_workflow import CompiledWorkflow, get_workflow
+from app.services.ai.comfyui_ws import ComfyUIEventListener, get_client_id, get_event_listener
+
+
+POLL_INTERVAL = 2.0  # WebSocket 不可用时的轮询间隔（秒）
+WS_SAFETY_CHECK_INTERVAL = 15.0  # WebSocket 在线时兜底查询历史的间隔（秒）
+WS_CONNECT_TIMEOUT = 2.0  # 首次建立 WebSocket 连接的等待时间（秒）
+HISTORY_RETRY_INTERVAL = 0.2  # 收到完成事件后历史未就绪时的重试间隔（秒）
+
+# SD WebUI 采样器名称 -> ComfyUI sampler_name（模型的 default_sampler 在各后端间共用）
+SD_SAMPLER_NAMES = {
+    "euler": "euler",
+    "euler a": "euler_ancestral",
+    "heun": "heun",
+    "lms": "lms",
+    "dpm2": "dpm_2",
+    "dpm2 a": "dpm_2_ancestral",
+    "dpm++ 2s a": "dpmpp_2s_ancestral",
+    "dpm++ 2m": "dpmpp_2m",
+    "dpm++ sde": "dpmpp_sde",
+    "dpm++ 2m sde": "dpmpp_2m_sde",
+    "dpm++ 3m sde": "dpmpp_3m_sde",
+    "dpm fast": "dpm_fast",
+    "dpm adaptive": "dpm_adaptive",
+    "ddim": "ddim",
+    "plms": "ddim",  # ComfyUI 没有 PLMS
+    "unipc": "uni_pc",
+    "lcm": "lcm",
+}
+
+# SD WebUI 采样器名称中的调度器后缀 -> ComfyUI scheduler
+SD_SCHEDULER_SUFFIXES = {
+    "karras": "karras",
+    "exponential": "exponential",
+    "sgm uniform": "sgm_uniform",
+}
+
+
+def comfyui_sampler(name: Optional[str]) -> tuple:
+    """把采样器名称转换为 ComfyUI 的 (sampler_name, scheduler)
+
+    已是 ComfyUI 名称（如 euler、dpmpp_2m）时原样返回；SD WebUI 名称（如 "Euler a"、
+    "DPM++ 2M Karras"）按映射转换，调度器后缀转为 scheduler。无法识别时返回 (None, None)，使用模板默认值。
+    """
+    if not name:
+        return None, None
+    key = " ".join(name.lower().split())
+    if key in SD_SAMPLER_NAMES.values():
+        return key, None
+    scheduler = None
+    for suffix, value in SD_SCHEDULER_SUFFIXES.items():
+        if key.endswith(f" {suffix}"):
+            key = key[: -len(suffix) - 1]
+            scheduler = value
+            break
+    sampler = SD_SAMPLER_NAMES.get(key)
+    if sampler is None:
+        print(f"Unknown sampler {name!r} for ComfyUI, using workflow default")
+        return None, None
+    return sampler, scheduler
 
 
 class ComfyUIAdapter(BaseImageAdapter):
@@ -16,6 +80,13 @@ class ComfyUIAdapter(BaseImageAdapter):
         self,
         base_url: Optional[str] = None,
         workflow_template: Optional[str] = None,
+        default_width: Optional[int] = None,
+        default_height: Optional[int] = None,
+        default_steps: Optional[int] = None,
+        default_cfg_scale: Optional[float] = None,
+        default_sampler: Optional[str] = None,
+        checkpoint_name: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
         timeout: int = 300,
     ):
         """初始化 ComfyUI 适配器
@@ -23,12 +94,31 @@ class ComfyUIAdapter(BaseImageAdapter):
         Args:
             base_url: API 基础 URL
             workflow_template: 默认工作流模板 ID
+            default_width: 默认宽度
+            default_height: 默认高度
+            default_steps: 默认步数
+            default_cfg_scale: 默认 CFG 值
+            default_sampler: 默认采样器（ComfyUI 名称如 euler，或 SD WebUI 名称如 "Euler a"）
+            checkpoint_name: 模型文件名，默认 COMFYUI_CHECKPOINT
+            max_concurrency: 同时执行的请求数
             timeout: 请求超时时间（秒）
         """
         self.base_url = base_url or settings.COMFYUI_API_URL
         self.workflow_template = workflow_template
+        self.default_width = default_width or 1024
+        self.default_height = default_height or 1024
+        self.default_steps = default_steps or 20
+        self.default_cfg_scale = default_cfg_scale or 7.0
+        self.default_sampler = default_sampler
+        self.checkpoint_name = checkpoint_name or settings.COMFYUI_CHECKPOINT or None
+        self.max_concurrency = max_concurrency
         self.timeout = timeout
-        self.client_id = str(uuid.uuid4())
+        self.client_id = get_client_id(self.base_url)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享连接池客户端"""
+        return get_http_client(self.base_url)
 
     async def _queue_prompt(self, workflow: Dict[str, Any]) -> str:
         """提交工作流到队列"""
@@ -37,24 +127,28 @@ class ComfyUIAdapter(BaseImageAdapter):
             "client_id": self.client_id,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/prompt",
-                json=payload,
-            )
-            response.raise_for_status()
-            data = response.json()
+        response = await self.client.post(
+            "/prompt",
+            json=payload,
+            timeout=float(self.timeout),
+        )
+        response.raise_for_status()
+        data = response.json()
 
         return data["prompt_id"]
 
+    async def queue_depth(self) -> int:
+        """当前执行中和排队的任务数"""
+        response = await self.client.get("/queue", timeout=5.0)
+        response.raise_for_status()
+        data = response.json()
+        return len(data.get("queue_running", [])) + len(data.get("queue_pending", []))
+
     async def _get_history(self, prompt_id: str) -> Dict[str, Any]:
         """获取执行历史"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/history/{prompt_id}",
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.get(f"/history/{prompt_id}")
+        response.raise_for_status()
+        return response.json()
 
     async def _get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
         """获取图像"""
@@ -64,27 +158,86 @@ class ComfyUIAdapter(BaseImageAdapter):
             "type": folder_type,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/view",
-                params=params,
-            )
-            response.raise_for_status()
-            return response.content
+        response = await self.client.get(
+            "/view",
+            params=params,
+            timeout=float(self.timeout),
+        )
+        response.raise_for_status()
+        return response.content
+
+    async def _upload_image(self, image_base64: str) -> str:
+        """上传输入图像，返回 LoadImage 节点可用的文件名
+
+        文件名取内容哈希，重复上传同一张图会覆盖为同一文件。
+        """
+        image_data = base64.b64decode(image_base64)
+        filename = f"man_{hashlib.sha256(image_data).hexdigest()[:32]}.png"
+
+        response = await self.client.post(
+            "/upload/image",
+            files={"image": (filename, image_data, "image/png")},
+            data={"overwrite": "true"},
+            timeout=float(self.timeout),
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        name = data.get("name", filename)
+        subfolder = data.get("subfolder")
+        return f"{subfolder}/{name}" if subfolder else name
+
+    def _common_values(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str],
+        steps: Optional[int],
+        cfg_scale: Optional[float],
+        seed: int,
+        sampler: Optional[str],
+    ) -> Dict[str, Any]:
+        """txt2img/img2img 共用的参数槽取值"""
+        sampler_name, scheduler = comfyui_sampler(sampler or self.default_sampler)
+        return {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt or "",
+            "steps": steps or self.default_steps,
+            "cfg_scale": cfg_scale or self.default_cfg_scale,
+            # ComfyUI 不接受 -1，随机种子在客户端生成
+            "seed": seed if seed >= 0 else random.getrandbits(48),
+            "sampler": sampler_name,
+            "scheduler": scheduler,
+            "checkpoint": self.checkpoint_name,
+        }
+
+    def _check_checkpoint(self, template: CompiledWorkflow) -> None:
+        """未指定模型文件时，模板自身必须带有有效的模型名"""
+        if self.checkpoint_name or not template.has_slot("checkpoint"):
+            return
+        node_id, input_name = template.slots["checkpoint"]
+        if not template.workflow[node_id]["inputs"].get(input_name):
+            raise ValueError("ComfyUI 工作流需要配置 checkpoint_name（或 COMFYUI_CHECKPOINT）")
 
     async def txt2img(
         self,
         prompt: str,
         negative_prompt: Optional[str] = None,
-        width: int = 1024,
-        height: int = 1024,
-        steps: int = 20,
-        cfg_scale: float = 7.0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        steps: Optional[int] = None,
+        cfg_scale: Optional[float] = None,
         seed: int = -1,
+        sampler: Optional[str] = None,
     ) -> List[str]:
-        """文生图 - 使用基础工作流"""
-        # TODO: 实现ComfyUI工作流
-        raise NotImplementedError("ComfyUI txt2img not implemented yet")
+        """文生图 - 使用 workflow_template 或内置默认工作流"""
+        template = get_workflow(self.workflow_template, "txt2img")
+        self._check_checkpoint(template)
+
+        values = self._common_values(prompt, negative_prompt, steps, cfg_scale, seed, sampler)
+        values["width"] = width or self.default_width
+        values["height"] = height or self.default_height
+
+        return await self.run_workflow(template.render(values))
 
     async def img2img(
         self,
@@ -92,43 +245,92 @@ class ComfyUIAdapter(BaseImageAdapter):
         prompt: str,
         negative_prompt: Optional[str] = None,
         strength: float = 0.75,
-        steps: int = 20,
-        cfg_scale: float = 7.0,
+        steps: Optional[int] = None,
+        cfg_scale: Optional[float] = None,
+        seed: int = -1,
+        sampler: Optional[str] = None,
     ) -> List[str]:
-        """图生图 - 使用基础工作流"""
-        # TODO: 实现ComfyUI工作流
-        raise NotImplementedError("ComfyUI img2img not implemented yet")
+        """图生图 - 使用 workflow_template 或内置默认工作流"""
+        template = get_workflow(self.workflow_template, "img2img")
+        self._check_checkpoint(template)
+
+        values = self._common_values(prompt, negative_prompt, steps, cfg_scale, seed, sampler)
+        values["denoise"] = strength
+        values["init_image"] = await self._upload_image(init_image)
+
+        return await self.run_workflow(template.render(values))
 
     async def run_workflow(self, workflow: Dict[str, Any]) -> List[str]:
         """运行自定义工作流"""
+        listener = get_event_listener(self.base_url)
+        if listener and not listener.connected:
+            # 首次连接稍作等待，确保提交前已订阅事件
+            await listener.wait_connected(timeout=WS_CONNECT_TIMEOUT)
+
         prompt_id = await self._queue_prompt(workflow)
-        
-        # 等待执行完成
-        import asyncio
-        max_wait = 300  # 最大等待5分钟
-        wait_time = 0
-        
-        while wait_time < max_wait:
-            await asyncio.sleep(2)
-            wait_time += 2
-            
+
+        try:
+            history = await self._wait_for_history(prompt_id, listener)
+        finally:
+            if listener:
+                listener.discard(prompt_id)
+
+        return await self._collect_images(history)
+
+    async def _wait_for_history(
+        self,
+        prompt_id: str,
+        listener: Optional[ComfyUIEventListener],
+    ) -> Dict[str, Any]:
+        """等待执行完成并返回该 prompt 的历史记录
+
+        WebSocket 在线时等待完成事件，并定期查询一次历史兜底漏掉的事件；
+        连接断开时回退为按 POLL_INTERVAL 轮询。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        future = listener.expect(prompt_id) if listener else None
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError("ComfyUI workflow execution timeout")
+
+            if future is not None and future.done():
+                # 已收到完成事件，执行失败时抛出异常
+                future.result()
+            elif future is not None and listener.connected:
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(future),
+                        timeout=min(remaining, WS_SAFETY_CHECK_INTERVAL),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(remaining, POLL_INTERVAL))
+
             history = await self._get_history(prompt_id)
             if prompt_id in history:
-                outputs = history[prompt_id].get("outputs", {})
-                images = []
-                
-                for node_id, output in outputs.items():
-                    if "images" in output:
-                        for img in output["images"]:
-                            img_data = await self._get_image(
-                                img["filename"],
-                                img.get("subfolder", ""),
-                                img.get("type", "output"),
-                            )
-                            # 转为base64
-                            import base64
-                            images.append(base64.b64encode(img_data).decode("utf-8"))
-                
-                return images
-        
-        raise TimeoutError("ComfyUI workflow execution timeout")
+                return history[prompt_id]
+
+            if future is not None and future.done():
+                # 完成事件先于历史写入到达，短间隔重试
+                await asyncio.sleep(HISTORY_RETRY_INTERVAL)
+
+    async def _collect_images(self, history: Dict[str, Any]) -> List[str]:
+        """并发下载历史记录中的所有输出图像，返回base64列表"""
+        refs = []
+        for node_id, output in history.get("outputs", {}).items():
+            refs.extend(output.get("images", []))
+
+        contents = await asyncio.gather(*[
+            self._get_image(
+                img["filename"],
+                img.get("subfolder", ""),
+                img.get("type", "output"),
+            )
+            for img in refs
+        ])
+
+        return [base64.b64encode(data).decode("utf-8") for data in contents]
@@ -0,0 +1,293 @@
+"""ComfyUI工作流模板
+
+模板文件存放在 COMFYUI_WORKFLOW_DIR 下，文件名为 `<workflow_template>.json`，格式：
+
+{
+    "txt2img": {
+        "workflow": {API 格式的节点图},
+        "slots": {"prompt": {"node": "6", "input": "text"}, ...}
+    },
+    "img2img": {...}
+}
+
+模板只在首次使用（或文件修改）时解析和校验一次，之后每次调用只复制并修改声明的节点输入。
+未配置模板或模板缺少某种模式时使用内置的默认工作流。
+"""
+
+import copy
+import json
+import os
+import threading
+from typing import Any, Dict, Literal, Optional, Tuple
+
+from app.core.config import settings
+
+
+WorkflowMode = Literal["txt2img", "img2img"]
+
+# 支持的参数槽
+SLOT_NAMES = {
+    "prompt",
+    "negative_prompt",
+    "seed",
+    "width",
+    "height",
+    "steps",
+    "cfg_scale",
+    "sampler",
+    "scheduler",
+    "denoise",
+    "checkpoint",
+    "init_image",
+    "batch_size",
+}
+
+# 各模式必须声明的参数槽
+REQUIRED_SLOTS = {
+    "txt2img": {"prompt"},
+    "img2img": {"prompt", "init_image"},
+}
+
+
+class WorkflowTemplateError(ValueError):
+    """工作流模板无效"""
+
+
+class CompiledWorkflow:
+    """已校验的工作流模板
+
+    保存节点图和参数槽到节点输入的映射，render 时只复制被修改的节点。
+    """
+
+    def __init__(self, workflow: Dict[str, Any], slots: Dict[str, Tuple[str, str]]):
+        self.workflow = workflow
+        self.slots = slots
+
+    def has_slot(self, name: str) -> bool:
+        """模板是否声明了指定参数槽"""
+        return name in self.slots
+
+    def render(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """填充参数生成可提交的工作流
+
+        Args:
+            values: 参数槽名称到取值的映射，值为 None 或未声明的槽会被忽略
+
+        Returns:
+            新的工作流字典，未修改的节点与模板共享
+        """
+        graph = dict(self.workflow)
+        patched = set()
+
+        for name, value in values.items():
+            if value is None or name not in self.slots:
+                continue
+            node_id, input_name = self.slots[name]
+            if node_id not in patched:
+                node = graph[node_id]
+                graph[node_id] = {**node, "inputs": dict(node["inputs"])}
+                patched.add(node_id)
+            graph[node_id]["inputs"][input_name] = value
+
+        return graph
+
+
+def compile_workflow(spec: Dict[str, Any], mode: WorkflowMode, source: str) -> CompiledWorkflow:
+    """校验模板并生成 CompiledWorkflow
+
+    Raises:
+        WorkflowTemplateError: 节点图或参数槽声明无效
+    """
+    workflow = spec.get("workflow")
+    slots = spec.get("slots")
+    if not isinstance(workflow, dict) or not workflow:
+        raise WorkflowTemplateError(f"{source} [{mode}]: 缺少 workflow 节点图")
+    if not isinstance(slots, dict):
+        raise WorkflowTemplateError(f"{source} [{mode}]: 缺少 slots 参数槽声明")
+
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or not isinstance(node.get("inputs"), dict):
+            raise WorkflowTemplateError(f"{source} [{mode}]: 节点 {node_id} 缺少 inputs")
+
+    compiled_slots = {}
+    for name, target in slots.items():
+        if name not in SLOT_NAMES:
+            raise WorkflowTemplateError(f"{source} [{mode}]: 未知参数槽 {name}")
+        if not isinstance(target, dict) or "node" not in target or "input" not in target:
+            raise WorkflowTemplateError(f"{source} [{mode}]: 参数槽 {name} 需要 node 和 input")
+
+        node_id, input_name = str(target["node"]), target["input"]
+        if node_id not in workflow:
+            raise WorkflowTemplateError(f"{source} [{mode}]: 参数槽 {name} 指向不存在的节点 {node_id}")
+        if input_name not in workflow[node_id]["inputs"]:
+            raise WorkflowTemplateError(
+                f"{source} [{mode}]: 节点 {node_id} 没有输入 {input_name}（参数槽 {name}）"
+            )
+        compiled_slots[name] = (node_id, input_name)
+
+    missing = REQUIRED_SLOTS[mode] - compiled_slots.keys()
+    if missing:
+        raise WorkflowTemplateError(f"{source} [{mode}]: 缺少必需参数槽 {', '.join(sorted(missing))}")
+
+    # 深拷贝一次，防止调用方修改原始数据影响缓存
+    return CompiledWorkflow(copy.deepcopy(workflow), compiled_slots)
+
+
+# 内置默认工作流（ComfyUI 默认节点图）
+_DEFAULT_TXT2IMG = {
+    "workflow": {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ""}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1024, "height": 1024, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["4", 1]}},
+        "3": {
+            "class_type": "KSampler",
+            "inputs": {
+                "seed": 0,
+                "steps": 20,
+                "cfg": 7.0,
+                "sampler_name": "euler",
+                "scheduler": "normal",
+                "denoise": 1.0,
+                "model": ["4", 0],
+                "positive": ["6", 0],
+                "negative": ["7", 0],
+                "latent_image": ["5", 0],
+            },
+        },
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "man", "images": ["8", 0]}},
+    },
+    "slots": {
+        "checkpoint": {"node": "4", "input": "ckpt_name"},
+        "width": {"node": "5", "input": "width"},
+        "height": {"node": "5", "input": "height"},
+        "batch_size": {"node": "5", "input": "batch_size"},
+        "prompt": {"node": "6", "input": "text"},
+        "negative_prompt": {"node": "7", "input": "text"},
+        "seed": {"node": "3", "input": "seed"},
+        "steps": {"node": "3", "input": "steps"},
+        "cfg_scale": {"node": "3", "input": "cfg"},
+        "sampler": {"node": "3", "input": "sampler_name"},
+        "scheduler": {"node": "3", "input": "scheduler"},
+    },
+}
+
+_DEFAULT_IMG2IMG = {
+    "workflow": {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ""}},
+        "10": {"class_type": "LoadImage", "inputs": {"image": ""}},
+        "11": {"class_type": "VAEEncode", "inputs": {"pixels": ["10", 0], "vae": ["4", 2]}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["4", 1]}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["4", 1]}},
+        "3": {
+            "class_type": "KSampler",
+            "inputs": {
+                "seed": 0,
+                "steps": 20,
+                "cfg": 7.0,
+                "sampler_name": "euler",
+                "scheduler": "normal",
+                "denoise": 0.75,
+                "model": ["4", 0],
+                "positive": ["6", 0],
+                "negative": ["7", 0],
+                "latent_image": ["11", 0],
+            },
+        },
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "man", "images": ["8", 0]}},
+    },
+    "slots": {
+        "checkpoint": {"node": "4", "input": "ckpt_name"},
+        "init_image": {"node": "10", "input": "image"},
+        "prompt": {"node": "6", "input": "text"},
+        "negative_prompt": {"node": "7", "input": "text"},
+        "seed": {"node": "3", "input": "seed"},
+        "steps": {"node": "3", "input": "steps"},
+        "cfg_scale": {"node": "3", "input": "cfg"},
+        "sampler": {"node": "3", "input": "sampler_name"},
+        "scheduler": {"node": "3", "input": "scheduler"},
+        "denoise": {"node": "3", "input": "denoise"},
+    },
+}
+
+_DEFAULT_SPECS = {"txt2img": _DEFAULT_TXT2IMG, "img2img": _DEFAULT_IMG2IMG}
+
+# 模板文件路径 -> (修改时间, {模式: 已编译模板})
+_cache: Dict[str, Tuple[float, Dict[str, CompiledWorkflow]]] = {}
+_defaults: Dict[str, CompiledWorkflow] = {}
+_lock = threading.Lock()
+
+
+def get_workflow_dir() -> str:
+    """模板目录"""
+    return settings.COMFYUI_WORKFLOW_DIR or os.path.join(settings.DATA_DIR, "workflows")
+
+
+def _template_path(name: str) -> str:
+    """模板名称对应的文件路径，禁止跳出模板目录"""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise WorkflowTemplateError(f"无效的工作流模板名称: {name}")
+    filename = name if name.endswith(".json") else f"{name}.json"
+    return os.path.join(get_workflow_dir(), filename)
+
+
+def _load_file(path: str) -> Dict[str, CompiledWorkflow]:
+    """读取并编译模板文件中的所有模式"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise WorkflowTemplateError(f"工作流模板不存在: {path}")
+    except json.JSONDecodeError as e:
+        raise WorkflowTemplateError(f"工作流模板不是有效的JSON: {path}: {e}")
+
+    if not isinstance(data, dict):
+        raise WorkflowTemplateError(f"工作流模板格式错误: {path}")
+
+    compiled = {}
+    for mode in ("txt2img", "img2img"):
+        if mode in data:
+            compiled[mode] = compile_workflow(data[mode], mode, path)
+    if not compiled:
+        raise WorkflowTemplateError(f"工作流模板未定义 txt2img 或 img2img: {path}")
+    return compiled
+
+
+def get_workflow(name: Optional[str], mode: WorkflowMode) -> CompiledWorkflow:
+    """获取已编译的工作流模板
+
+    Args:
+        name: 模板名称（AIModel.workflow_template），为空时使用内置默认工作流
+        mode: txt2img 或 img2img
+
+    Returns:
+        已编译的模板；模板文件中没有该模式时回退到内置默认工作流
+    """
+    if name:
+        path = _template_path(name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            raise WorkflowTemplateError(f"工作流模板不存在: {path}")
+
+        with _lock:
+            entry = _cache.get(path)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, _load_file(path))
+                _cache[path] = entry
+
+        if mode in entry[1]:
+            return entry[1][mode]
+
+    with _lock:
+        if mode not in _defaults:
+            _defaults[mode] = compile_workflow(_DEFAULT_SPECS[mode], mode, "<default>")
+        return _defaults[mode]
+
+
+def clear_workflow_cache() -> None:
+    """清空模板缓存"""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,209 @@
+"""ComfyUI WebSocket 事件监听
+
+在一条 /ws?clientId= 连接上复用多个进行中的 prompt，收到完成/失败事件时唤醒对应的等待者。
+每个服务地址在进程内使用固定的 client_id，所有适配器实例共用一条连接。
+连接断开后自动重连，期间调用方回退到轮询 /history。
+"""
+
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+try:
+    import websockets
+except ImportError:  # pragma: no cover - 未安装时只能轮询
+    websockets = None
+
+
+class ComfyUIExecutionError(RuntimeError):
+    """ComfyUI 工作流执行失败"""
+
+
+class ComfyUIEventListener:
+    """ComfyUI WebSocket 事件监听器"""
+
+    # 记录最近完成但尚无人等待的 prompt，避免事件早于注册到达时丢失
+    _RECENT_LIMIT = 256
+
+    def __init__(self, base_url: str, client_id: str):
+        self.base_url = base_url.rstrip("/")
+        self.client_id = client_id
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._recent: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ws_url(self) -> str:
+        """WebSocket 地址"""
+        url = self.base_url
+        if url.startswith("https://"):
+            url = "wss://" + url[len("https://"):]
+        elif url.startswith("http://"):
+            url = "ws://" + url[len("http://"):]
+        return f"{url}/ws?clientId={self.client_id}"
+
+    @property
+    def connected(self) -> bool:
+        """当前是否保持连接"""
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        """启动后台监听任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def wait_connected(self, timeout: float) -> bool:
+        """等待连接建立，超时返回 False"""
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def expect(self, prompt_id: str) -> asyncio.Future:
+        """注册等待指定 prompt 完成的 Future"""
+        future = self._waiters.get(prompt_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[prompt_id] = future
+
+        if prompt_id in self._recent:
+            error = self._recent.pop(prompt_id)
+            self._settle(prompt_id, error)
+        return future
+
+    def discard(self, prompt_id: str) -> None:
+        """取消对指定 prompt 的等待"""
+        future = self._waiters.pop(prompt_id, None)
+        if future and not future.done():
+            future.cancel()
+
+    async def close(self) -> None:
+        """停止监听并取消所有等待者"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        self._connected.clear()
+        for prompt_id in list(self._waiters):
+            self.discard(prompt_id)
+
+    async def _run(self) -> None:
+        """连接并持续接收事件，断线后指数退避重连"""
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.ws_url, max_size=None) as ws:
+                    self._connected.set()
+                    backoff = 1.0
+                    async for message in ws:
+                        # 二进制消息是预览图，忽略
+                        if isinstance(message, bytes):
+                            continue
+                        self._handle_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ComfyUI websocket disconnected ({self.base_url}): {e}")
+            finally:
+                self._connected.clear()
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _handle_message(self, message: str) -> None:
+        """处理单条事件消息"""
+        try:
+            event = json.loads(message)
+        except json.JSONDecodeError:
+            return
+
+        event_type = event.get("type")
+        data = event.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        if event_type == "execution_success":
+            self._finish(prompt_id, None)
+        elif event_type == "executing" and data.get("node") is None:
+            # 旧版 ComfyUI 以 node=None 的 executing 事件表示完成
+            self._finish(prompt_id, None)
+        elif event_type == "execution_error":
+            message = data.get("exception_message") or "unknown error"
+            self._finish(prompt_id, f"node {data.get('node_id')}: {message}")
+        elif event_type == "execution_interrupted":
+            self._finish(prompt_id, "execution interrupted")
+
+    def _finish(self, prompt_id: str, error: Optional[str]) -> None:
+        """记录完成结果并唤醒等待者"""
+        if prompt_id in self._waiters:
+            self._settle(prompt_id, error)
+            return
+
+        self._recent[prompt_id] = error
+        while len(self._recent) > self._RECENT_LIMIT:
+            self._recent.popitem(last=False)
+
+    def _settle(self, prompt_id: str, error: Optional[str]) -> None:
+        """设置 Future 结果"""
+        future = self._waiters.pop(prompt_id, None)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(ComfyUIExecutionError(error))
+        else:
+            future.set_result(prompt_id)
+
+
+# base_url -> 进程内固定的 client_id
+_client_ids: Dict[str, str] = {}
+
+# base_url -> (所属事件循环, 监听器)
+_listeners: Dict[str, Tuple[asyncio.AbstractEventLoop, ComfyUIEventListener]] = {}
+
+
+def get_client_id(base_url: str) -> str:
+    """服务地址在当前进程中使用的 client_id（提交 prompt 和 WebSocket 连接共用）"""
+    key = base_url.rstrip("/")
+    client_id = _client_ids.get(key)
+    if client_id is None:
+        client_id = _client_ids.setdefault(key, str(uuid.uuid4()))
+    return client_id
+
+
+def get_event_listener(base_url: str) -> Optional[ComfyUIEventListener]:
+    """获取（必要时启动）服务地址共享的事件监听器
+
+    未安装 websockets 时返回 None，调用方应使用轮询。
+    """
+    if websockets is None:
+        return None
+
+    key = base_url.rstrip("/")
+    loop = asyncio.get_running_loop()
+
+    entry = _listeners.get(key)
+    if entry and entry[0] is loop:
+        listener = entry[1]
+    else:
+        listener = ComfyUIEventListener(key, get_client_id(key))
+        _listeners[key] = (loop, listener)
+
+    listener.start()
+    return listener
+
+
+async def close_event_listeners() -> None:
+    """关闭当前事件循环中的所有监听器"""
+    loop = asyncio.get_running_loop()
+    for key, (owner_loop, listener) in list(_listeners.items()):
+        _listeners.pop(key, None)
+        if owner_loop is loop:
+            await listener.close()
@@ -1,18 +1,33 @@
 """AI适配器工厂"""
 
-from typing import Optional, Union
-from sqlalchemy.orm import Session
+from typing import Any, Callable, Optional, Union
+from sqlalchemy.orm import Session, object_session
 
 from app.models.ai_model import AIModel, ModelProvider, ModelType
 from app.services.ai_model_service import AIModelService
 from app.services.ai.base import BaseAIAdapter, BaseImageAdapter
+from app.services.ai.adapter_cache import get_cached_adapter, cache_adapter
+from app.services.ai.rate_limit import with_rate_limit
+from app.services.ai.resilience import with_retry_policy
+from app.services.ai.response_cache import with_response_cache
+from app.core.config import settings
 from app.core.encryption import decrypt_api_key
 
 
+# 可创建文本适配器的提供商
+TEXT_PROVIDERS = (
+    ModelProvider.openai,
+    ModelProvider.openai_compatible,
+    ModelProvider.zhipu,
+    ModelProvider.anthropic,
+)
+
+
 class AIAdapterFactory:
     """AI适配器工厂
     
-    根据数据库中的模型配置动态创建适配器实例
+    根据数据库中的模型配置动态创建适配器实例。
+    实例按模型ID和 updated_at 缓存复用（连同其 HTTP 连接池），配置变更后自动重建。
     """
 
     @staticmethod
@@ -29,8 +44,14 @@ class AIAdapterFactory:
         Returns:
             文本生成适配器实例
         """
+        if not model_id:
+            routed = AIAdapterFactory._get_routed_text_adapter(db, ModelType.text_generation)
+            if routed is not None:
+                return routed
         model = AIAdapterFactory._get_model(db, model_id, ModelType.text_generation)
-        return AIAdapterFactory._create_text_adapter(model)
+        return AIAdapterFactory._get_or_create(
+            "text", model, AIAdapterFactory._create_text_adapter
+        )
 
     @staticmethod
     def get_image_adapter(
@@ -47,7 +68,26 @@ class AIAdapterFactory:
             图像生成适配器实例
         """
         model = AIAdapterFactory._get_model(db, model_id, ModelType.image_generation)
-        return AIAdapterFactory._create_image_adapter(model)
+        return AIAdapterFactory._get_or_create(
+            "image", model, AIAdapterFactory._create_image_adapter
+        )
+
+    @staticmethod
+    def get_default_image_backend() -> Optional[BaseImageAdapter]:
+        """获取默认图像模型对应的 SD / ComfyUI 后端（供 Celery 任务使用）
+
+        使用独立数据库会话；未配置默认图像模型或其不是 SD / ComfyUI 时返回 None。
+        """
+        from app.core.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            adapter = AIAdapterFactory.get_image_adapter(db)
+        except ValueError:
+            return None
+        finally:
+            db.close()
+        return adapter if isinstance(adapter, BaseImageAdapter) else None
 
     @staticmethod
     def get_vision_adapter(
@@ -63,9 +103,72 @@ class AIAdapterFactory:
         Returns:
             图像分析适配器实例
         """
+        if not model_id:
+            routed = AIAdapterFactory._get_routed_text_adapter(db, ModelType.image_analysis)
+            if routed is not None:
+                return routed
         model = AIAdapterFactory._get_model(db, model_id, ModelType.image_analysis)
         # 图像分析使用文本适配器（支持视觉功能）
-        return AIAdapterFactory._create_text_adapter(model)
+        return AIAdapterFactory._get_or_create(
+            "text", model, AIAdapterFactory._create_text_adapter
+        )
+
+    @staticmethod
+    def _get_routed_text_adapter(
+        db: Session,
+        model_type: ModelType,
+    ) -> Optional[BaseAIAdapter]:
+        """在该类型所有启用的模型间路由，启用的模型少于两个或关闭路由时返回 None
+
+        偏好顺序取 extra_config.route_priority（越小越优先，默认模型默认为 0，其余为 1），
+        同一偏好内优先选择未熔断且延迟最低的模型；extra_config.routing 为 false 的模型不参与路由。
+        路由成员不重试（只尝试一次），失败后立即切换到下一个模型，而不是先耗尽主模型的重试次数。
+        """
+        if not settings.MODEL_ROUTING_ENABLED:
+            return None
+        models = [
+            m for m in AIModelService.list_models(db, model_type=model_type, is_enabled=True)
+            if (m.extra_config or {}).get("routing", True) and m.provider in TEXT_PROVIDERS
+        ]
+        if len(models) < 2:
+            return None
+
+        from app.services.ai.model_router import RoutedTextAdapter
+
+        members = []
+        for model in models:
+            priority = (model.extra_config or {}).get("route_priority")
+            if priority is None:
+                priority = 0 if model.is_default else 1
+            adapter = AIAdapterFactory._get_or_create(
+                "routed_text", model, AIAdapterFactory._create_routed_member_adapter
+            )
+            members.append((model.id, priority, adapter))
+        return RoutedTextAdapter(members)
+
+    @staticmethod
+    def get_model_adapter(model: AIModel) -> Any:
+        """获取指定模型配置的适配器（不检查启用状态，供连接测试复用连接池）"""
+        if model.model_type == ModelType.image_generation:
+            return AIAdapterFactory._get_or_create(
+                "image", model, AIAdapterFactory._create_image_adapter
+            )
+        return AIAdapterFactory._get_or_create(
+            "text", model, AIAdapterFactory._create_text_adapter
+        )
+
+    @staticmethod
+    def _get_or_create(
+        kind: str,
+        model: AIModel,
+        create: Callable[[AIModel], Any],
+    ) -> Any:
+        """从缓存获取适配器，不存在或配置已变更时重新创建"""
+        adapter = get_cached_adapter(kind, model)
+        if adapter is None:
+            adapter = create(model)
+            cache_adapter(kind, model, adapter)
+        return adapter
 
     @staticmethod
     def _get_model(
@@ -101,8 +204,55 @@ class AIAdapterFactory:
         return model
 
     @staticmethod
-    def _create_text_adapter(model: AIModel) -> BaseAIAdapter:
-        """根据配置创建文本适配器"""
+    def _create_text_adapter(model: AIModel, max_retries: Optional[int] = None) -> BaseAIAdapter:
+        """根据配置创建文本适配器
+
+        由内到外依次为：限流、重试与对冲、响应缓存（缓存命中不占用限流额度，重试和对冲请求重新排队限流）。
+
+        Args:
+            model: 模型配置
+            max_retries: 最大重试次数，不指定则取 extra_config.max_retries 或 LLM_MAX_RETRIES
+        """
+        adapter = AIAdapterFactory._build_text_adapter(model)
+        adapter = with_rate_limit(adapter, model.id, model.extra_config)
+        adapter = with_retry_policy(
+            adapter,
+            model.id,
+            model.extra_config,
+            AIAdapterFactory._create_hedge_adapter(model),
+            max_retries=max_retries,
+        )
+        return with_response_cache(adapter, (model.extra_config or {}).get("response_cache"))
+
+    @staticmethod
+    def _create_routed_member_adapter(model: AIModel) -> BaseAIAdapter:
+        """创建路由成员使用的文本适配器：不重试，由路由切换模型代替重试（保留对冲和响应缓存）"""
+        return AIAdapterFactory._create_text_adapter(model, max_retries=0)
+
+    @staticmethod
+    def _create_hedge_adapter(model: AIModel) -> Optional[BaseAIAdapter]:
+        """创建 extra_config.hedge_model_id 指定的对冲备用适配器，未配置或不可用时返回 None"""
+        extra_config = model.extra_config or {}
+        hedge_model_id = extra_config.get("hedge_model_id")
+        if not extra_config.get("hedge") or not hedge_model_id:
+            return None
+
+        db = object_session(model)
+        secondary = AIModelService.get_model(db, hedge_model_id) if db else None
+        if (
+            secondary is None
+            or not secondary.is_enabled
+            or secondary.model_type != model.model_type
+        ):
+            print(f"Hedge model {hedge_model_id} for {model.name} is unavailable, hedging to primary")
+            return None
+
+        adapter = AIAdapterFactory._build_text_adapter(secondary)
+        return with_rate_limit(adapter, secondary.id, secondary.extra_config)
+
+    @staticmethod
+    def _build_text_adapter(model: AIModel) -> BaseAIAdapter:
+        """根据提供商创建文本适配器（关闭 SDK 自带重试，由重试策略统一处理）"""
         api_key = decrypt_api_key(model.api_key) if model.api_key else None
 
         if model.provider in [ModelProvider.openai, ModelProvider.openai_compatible]:
@@ -116,6 +266,7 @@ class AIAdapterFactory:
                 default_temperature=model.default_temperature,
                 timeout=model.timeout,
                 extra_headers=model.extra_headers,
+                max_retries=0,
             )
         elif model.provider == ModelProvider.zhipu:
             # 智谱AI使用OpenAI兼容API
@@ -128,6 +279,7 @@ class AIAdapterFactory:
                 default_temperature=model.default_temperature,
                 timeout=model.timeout,
                 extra_headers=model.extra_headers,
+                max_retries=0,
             )
         elif model.provider == ModelProvider.anthropic:
             from app.services.ai.claude_adapter import ClaudeAdapter
@@ -137,35 +289,92 @@ class AIAdapterFactory:
                 model_name=model.model_name,
                 default_max_tokens=model.default_max_tokens,
                 timeout=model.timeout,
+                max_retries=0,
             )
         else:
             raise ValueError(f"不支持的文本模型提供商: {model.provider.value}")
 
     @staticmethod
     def _create_image_adapter(model: AIModel) -> Union[BaseAIAdapter, BaseImageAdapter]:
-        """根据配置创建图像适配器"""
+        """根据配置创建图像适配器
+
+        extra_config.backends 配置了额外的 SD / ComfyUI 后端时，创建负载均衡池，
+        每项格式为 {"base_url", "provider"?, "checkpoint_name"?, "workflow_template"?, "max_concurrency"?}，
+        未指定的字段沿用模型本身的配置。
+        """
+        extra_config = model.extra_config or {}
+        backends = extra_config.get("backends")
+        if not backends:
+            return AIAdapterFactory._build_image_adapter(model)
+
+        from app.services.ai.image_pool import PooledImageAdapter
+
+        members = [(model.base_url or model.provider.value, AIAdapterFactory._build_image_adapter(model))]
+        for backend in backends:
+            provider = ModelProvider(backend.get("provider", model.provider.value))
+            if provider not in (ModelProvider.stable_diffusion, ModelProvider.comfyui):
+                raise ValueError(f"图像后端池不支持的提供商: {provider.value}")
+            adapter = AIAdapterFactory._build_image_adapter(
+                model,
+                provider=provider,
+                base_url=backend["base_url"],
+                checkpoint_name=backend.get("checkpoint_name"),
+                workflow_template=backend.get("workflow_template"),
+                max_concurrency=backend.get("max_concurrency"),
+            )
+            members.append((backend["base_url"], adapter))
+
+        return PooledImageAdapter(
+            members,
+            failure_threshold=extra_config.get("pool_failure_threshold", 3),
+            eject_seconds=extra_config.get("pool_eject_seconds", 30.0),
+        )
+
+    @staticmethod
+    def _build_image_adapter(
+        model: AIModel,
+        provider: Optional[ModelProvider] = None,
+        base_url: Optional[str] = None,
+        checkpoint_name: Optional[str] = None,
+        workflow_template: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+    ) -> Union[BaseAIAdapter, BaseImageAdapter]:
+        """根据提供商创建单个图像适配器，参数未指定时使用模型配置"""
         api_key = decrypt_api_key(model.api_key) if model.api_key else None
+        provider = provider or model.provider
+        base_url = base_url or model.base_url
+        checkpoint_name = checkpoint_name or model.checkpoint_name
+        max_concurrency = max_concurrency or (model.extra_config or {}).get("max_concurrency")
 
-        if model.provider == ModelProvider.stable_diffusion:
+        if provider == ModelProvider.stable_diffusion:
             from app.services.ai.sd_adapter import SDAdapter
             return SDAdapter(
-                base_url=model.base_url,
+                base_url=base_url,
                 default_width=model.default_width,
                 default_height=model.default_height,
                 default_steps=model.default_steps,
                 default_cfg_scale=model.default_cfg_scale,
                 default_sampler=model.default_sampler,
-                checkpoint_name=model.checkpoint_name,
+                checkpoint_name=checkpoint_name,
+                max_batch_size=(model.extra_config or {}).get("max_batch_size"),
+                max_concurrency=max_concurrency,
                 timeout=model.timeout,
             )
-        elif model.provider == ModelProvider.comfyui:
+        elif provider == ModelProvider.comfyui:
             from app.services.ai.comfyui_adapter import ComfyUIAdapter
             return ComfyUIAdapter(
-                base_url=model.base_url,
-                workflow_template=model.workflow_template,
+                base_url=base_url,
+                workflow_template=workflow_template or model.workflow_template,
+                default_width=model.default_width,
+                default_height=model.default_height,
+                default_steps=model.default_steps,
+                default_cfg_scale=model.default_cfg_scale,
+                default_sampler=model.default_sampler,
+                checkpoint_name=checkpoint_name,
+                max_concurrency=max_concurrency,
                 timeout=model.timeout,
             )
-        elif model.provider == ModelProvider.openai:
+        elif provider == ModelProvider.openai:
             # DALL-E 使用 OpenAI 适配器
             from app.services.ai.openai_adapter import OpenAIAdapter
             return OpenAIAdapter(
@@ -174,7 +383,7 @@ class AIAdapterFactory:
                 model_name=model.model_name,
                 timeout=model.timeout,
             )
-        elif model.provider == ModelProvider.midjourney:
+        elif provider == ModelProvider.midjourney:
             from app.services.ai.midjourney_adapter import MidjourneyAdapter
             return MidjourneyAdapter(
                 api_key=api_key,
@@ -182,4 +391,4 @@ class AIAdapterFactory:
                 timeout=model.timeout,
             )
         else:
-            raise ValueError(f"不支持的图像模型提供商: {model.provider.value}")
+            raise ValueError(f"不支持的图像模型提供商: {provider.value}")
@@ -0,0 +1,229 @@
+"""确定性图像生成结果缓存
+
+固定种子的 SD 请求在同一后端、同一模型下结果是确定的，按 后端标识 + 请求体 的规范化哈希缓存生成结果：
+图像按内容哈希存放在 {IMAGE_CACHE_DIR}/blobs 下，请求索引存放在 {IMAGE_CACHE_DIR}/requests 下。
+超过最大保留时间或总大小上限时按最近使用时间淘汰。
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+
+# 每写入多少次触发一次淘汰
+EVICT_EVERY_WRITES = 100
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageResultCache:
+    """内容寻址的图像结果缓存"""
+
+    def __init__(self, root: str, max_bytes: int, max_age_seconds: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+
+    @staticmethod
+    def make_key(
+        endpoint: str,
+        payload: Dict[str, Any],
+        backend: Optional[Any] = None,
+    ) -> Optional[str]:
+        """计算请求的缓存键，随机种子或后端未知的请求不可缓存，返回 None
+
+        Args:
+            endpoint: 接口路径
+            payload: 请求体
+            backend: 后端标识（服务地址 + 实际使用的模型），不同后端/模型的结果互不共享
+        """
+        seed = payload.get("seed", -1)
+        if seed is None or seed < 0 or backend is None:
+            return None
+
+        canonical = dict(payload)
+        if "init_images" in canonical:
+            # 输入图用内容哈希代替，避免键中包含整张图
+            canonical["init_images"] = [
+                _sha256(base64.b64decode(img)) for img in canonical["init_images"]
+            ]
+        raw = json.dumps(
+            [backend, endpoint, canonical],
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return _sha256(raw.encode("utf-8"))
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], f"{digest}.png")
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.root, "requests", key[:2], f"{key}.json")
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存（同步）"""
+        index_path = self._index_path(key)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        images = []
+        now = time.time()
+        for digest in index.get("images", []):
+            path = self._blob_path(digest)
+            try:
+                with open(path, "rb") as f:
+                    images.append(base64.b64encode(f.read()).decode("utf-8"))
+                # 更新访问时间，淘汰时按最近使用排序
+                os.utime(path, (now, now))
+            except OSError:
+                # 图像已被淘汰，索引失效
+                return None
+
+        os.utime(index_path, (now, now))
+        return {"images": images, "info": index.get("info")}
+
+    def _write(self, key: str, images: List[str], info: Any) -> None:
+        """写入缓存（同步），先写图像再写索引"""
+        digests = []
+        for image in images:
+            data = base64.b64decode(image)
+            digest = _sha256(data)
+            path = self._blob_path(digest)
+            if not os.path.exists(path):
+                _atomic_write(path, data)
+            digests.append(digest)
+
+        index = json.dumps({"images": digests, "info": info}, ensure_ascii=False)
+        _atomic_write(self._index_path(key), index.encode("utf-8"))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的生成结果 {images, info}"""
+        result = await asyncio.to_thread(self._read, key)
+        self._count("hits" if result is not None else "misses")
+        return result
+
+    async def put(self, key: str, images: List[str], info: Any = None) -> None:
+        """写入生成结果"""
+        if not images:
+            return
+        try:
+            await asyncio.to_thread(self._write, key, images, info)
+        except OSError as e:
+            print(f"Failed to write image cache entry {key}: {e}")
+            return
+
+        self._count("stores")
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % EVICT_EVERY_WRITES == 0
+        if should_evict:
+            await asyncio.to_thread(self.evict)
+
+    def _scan(self, kind: str) -> List[os.DirEntry]:
+        """列出指定目录下的所有文件"""
+        entries = []
+        base = os.path.join(self.root, kind)
+        if not os.path.isdir(base):
+            return entries
+        for shard in os.scandir(base):
+            if shard.is_dir():
+                entries.extend(e for e in os.scandir(shard.path) if e.is_file())
+        return entries
+
+    def evict(self) -> Dict[str, int]:
+        """按保留时间和总大小淘汰缓存"""
+        now = time.time()
+        removed = 0
+        freed = 0
+
+        files = []
+        for entry in self._scan("blobs") + self._scan("requests"):
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age_seconds:
+                removed += _remove(entry.path)
+                freed += stat.st_size
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            # 最久未使用的先淘汰
+            files.sort()
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                removed += _remove(path)
+                total -= size
+                freed += size
+
+        self._count("evicted", removed)
+        return {"removed_files": removed, "freed_bytes": freed}
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        blobs = self._scan("blobs")
+        requests = self._scan("requests")
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            **counters,
+            "entries": len(requests),
+            "images": len(blobs),
+            "total_bytes": sum(e.stat().st_size for e in blobs + requests),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+        }
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """写入临时文件后重命名，避免并发读到半个文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remove(path: str) -> int:
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+
+_cache: Optional[ImageResultCache] = None
+
+
+def get_image_cache() -> Optional[ImageResultCache]:
+    """获取进程内共享的图像缓存，未启用时返回 None"""
+    global _cache
+    if not settings.IMAGE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ImageResultCache(
+            root=settings.IMAGE_CACHE_DIR or os.path.join(settings.DATA_DIR, "cache", "images"),
+            max_bytes=settings.IMAGE_CACHE_MAX_BYTES,
+            max_age_seconds=settings.IMAGE_CACHE_MAX_AGE_DAYS * 24 * 60 * 60,
+        )
+    return _cache
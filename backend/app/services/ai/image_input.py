@@ -0,0 +1,209 @@
+"""视觉模型的图像输入
+
+统一把 原始字节 / 本地路径 / data URL / 不带前缀的 base64 / 产物引用 / HTTP URL 转成 (media_type, base64)。
+HTTP 图像和本地文件的编码结果放在进程内 LRU 中：URL 在新鲜期内直接命中，
+过期后带 ETag / Last-Modified 重新验证，304 时沿用缓存；本地文件按修改时间和大小判断是否变化。
+"""
+
+import asyncio
+import base64
+import binascii
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from app.core.artifacts import Artifact, get_artifact_store, is_artifact
+from app.core.http_client import get_http_client
+
+
+ImageSource = Union[str, bytes, os.PathLike, Artifact, Dict[str, Any]]
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # 缓存的 base64 总大小上限
+URL_FRESH_SECONDS = 300.0  # URL 缓存新鲜期（秒），期内不重新验证
+
+_MAGIC_TYPES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def guess_media_type(data: bytes, default: str = "image/png") -> str:
+    """根据文件头判断图像类型"""
+    for magic, media_type in _MAGIC_TYPES:
+        if data.startswith(magic):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+
+class _Entry:
+    __slots__ = ("media_type", "data", "validator", "fetched_at")
+
+    def __init__(self, media_type: str, data: str, validator: dict, fetched_at: float):
+        self.media_type = media_type
+        self.data = data
+        self.validator = validator
+        self.fetched_at = fetched_at
+
+
+class ImageInputCache:
+    """已编码图像的 LRU 缓存"""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, fresh_seconds: float = URL_FRESH_SECONDS):
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
+    def _get(self, key: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key: str, entry: _Entry) -> None:
+        if len(entry.data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.data)
+            self._entries[key] = entry
+            self._size += len(entry.data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.data)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    async def fetch_url(self, url: str) -> Tuple[str, str]:
+        """下载 HTTP 图像，返回 (media_type, base64)"""
+        entry = self._get(url)
+        if entry is not None and time.monotonic() - entry.fetched_at < self.fresh_seconds:
+            self._count("hits")
+            return entry.media_type, entry.data
+
+        parts = urlsplit(url)
+        client = get_http_client(f"{parts.scheme}://{parts.netloc}")
+        headers = {}
+        if entry is not None:
+            if entry.validator.get("etag"):
+                headers["If-None-Match"] = entry.validator["etag"]
+            if entry.validator.get("last_modified"):
+                headers["If-Modified-Since"] = entry.validator["last_modified"]
+
+        response = await client.get(url, headers=headers)
+        if entry is not None and response.status_code == 304:
+            entry.fetched_at = time.monotonic()
+            self._count("revalidated")
+            return entry.media_type, entry.data
+        response.raise_for_status()
+
+        content = response.content
+        media_type = response.headers.get("content-type", "").split(";")[0].strip()
+        if not media_type.startswith("image/"):
+            media_type = guess_media_type(content)
+        data = base64.b64encode(content).decode("utf-8")
+
+        validator = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
+        self._put(url, _Entry(media_type, data, validator, time.monotonic()))
+        self._count("misses")
+        return media_type, data
+
+    async def read_file(self, path: str) -> Tuple[str, str]:
+        """读取本地图像文件，返回 (media_type, base64)"""
+        stat = await asyncio.to_thread(os.stat, path)
+        key = f"file://{os.path.abspath(path)}"
+        validator = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+        entry = self._get(key)
+        if entry is not None and entry.validator == validator:
+            self._count("hits")
+            return entry.media_type, entry.data
+
+        content = await asyncio.to_thread(_read_bytes, path)
+        media_type = guess_media_type(content)
+        data = base64.b64encode(content).decode("utf-8")
+        self._put(key, _Entry(media_type, data, validator, time.monotonic()))
+        self._count("misses")
+        return media_type, data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._size}
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+_cache = ImageInputCache()
+
+
+def get_image_input_cache() -> ImageInputCache:
+    """获取进程内共享的图像输入缓存"""
+    return _cache
+
+
+def _base64_media_type(image: str) -> Optional[str]:
+    """不带 data: 前缀的 base64 图像（SD WebUI 和流水线的输出）的类型，不是时返回 None"""
+    try:
+        head = base64.b64decode(image[:24], validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return guess_media_type(head, default="") or None
+
+
+def is_remote(image: ImageSource) -> bool:
+    """是否为 HTTP(S) URL"""
+    return isinstance(image, str) and image.startswith(("http://", "https://"))
+
+
+async def load_image(image: ImageSource) -> Tuple[str, str]:
+    """把图像输入转为 (media_type, base64)
+
+    Args:
+        image: 原始字节、本地路径、data URL、不带前缀的 base64、产物引用或 HTTP(S) URL
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return guess_media_type(bytes(image)), base64.b64encode(image).decode("utf-8")
+
+    if is_artifact(image):
+        return await _cache.read_file(get_artifact_store().path(image))
+
+    if isinstance(image, str) and image.startswith("data:"):
+        header, _, data = image.partition(",")
+        return header[5:].split(";")[0] or "image/png", data
+
+    if is_remote(image):
+        return await _cache.fetch_url(image)
+
+    if isinstance(image, str):
+        media_type = _base64_media_type(image)
+        if media_type:
+            return media_type, image
+
+    return await _cache.read_file(os.fspath(image))
+
+
+async def to_data_url(image: ImageSource) -> str:
+    """把图像输入转为 data URL"""
+    if isinstance(image, str) and image.startswith("data:"):
+        return image
+    media_type, data = await load_image(image)
+    return f"data:{media_type};base64,{data}"
@@ -0,0 +1,229 @@
+"""图像生成后端负载均衡池
+
+将请求分发到多个 SD WebUI / ComfyUI 后端：按实时队列深度、进行中请求数和观测延迟选择节点，
+优先选择进行中请求数未达到其并发上限的节点，连续失败的节点被暂时剔除，冷却后再次尝试。
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.services.ai.base import BaseImageAdapter
+
+
+DEFAULT_LATENCY = 10.0  # 尚无观测数据时假设的单次耗时（秒）
+LATENCY_ALPHA = 0.3  # 延迟 EWMA 平滑系数
+QUEUE_PROBE_TIMEOUT = 3.0  # 队列深度探测超时（秒）
+
+
+class BackendNode:
+    """单个后端节点的状态"""
+
+    def __init__(self, name: str, adapter: BaseImageAdapter):
+        self.name = name
+        self.adapter = adapter
+        self.inflight = 0
+        self.latency: Optional[float] = None
+        self.queue_depth = 0
+        self.queue_checked_at = 0.0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def limit(self) -> int:
+        """节点并发上限"""
+        return self.adapter.max_concurrency or settings.IMAGE_MAX_CONCURRENCY
+
+    def is_available(self, now: float) -> bool:
+        """是否未被剔除"""
+        return now >= self.ejected_until
+
+    def score(self) -> float:
+        """预计等待时间，越小越优先"""
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return (self.queue_depth + self.inflight + 1) * latency
+
+    def record_success(self, latency: float) -> None:
+        """记录成功请求"""
+        self.requests += 1
+        self.failures = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+
+    def record_failure(self, threshold: int, eject_seconds: float) -> None:
+        """记录失败，连续失败达到阈值后剔除，剔除时间指数增长"""
+        self.requests += 1
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= threshold:
+            backoff = min(2 ** (self.failures - threshold), 16)
+            self.ejected_until = time.monotonic() + eject_seconds * backoff
+
+    def to_dict(self) -> Dict[str, Any]:
+        """节点状态"""
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "available": self.is_available(now),
+            "ejected_for": max(0.0, round(self.ejected_until - now, 1)),
+            "inflight": self.inflight,
+            "limit": self.limit,
+            "queue_depth": self.queue_depth,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+def _is_retryable(error: Exception) -> bool:
+    """连接错误、超时和 5xx 可以换节点重试"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError))
+
+
+class PooledImageAdapter(BaseImageAdapter):
+    """多后端图像生成适配器"""
+
+    def __init__(
+        self,
+        backends: List[Tuple[str, BaseImageAdapter]],
+        failure_threshold: int = 3,
+        eject_seconds: float = 30.0,
+        queue_ttl: float = 2.0,
+    ):
+        """初始化负载均衡池
+
+        Args:
+            backends: (节点名称, 适配器) 列表
+            failure_threshold: 连续失败多少次后剔除节点
+            eject_seconds: 首次剔除时长（秒）
+            queue_ttl: 队列深度缓存时间（秒）
+        """
+        if not backends:
+            raise ValueError("图像后端池至少需要一个后端")
+        self.nodes = [BackendNode(name, adapter) for name, adapter in backends]
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.queue_ttl = queue_ttl
+
+    @property
+    def max_concurrency(self) -> int:
+        """池的并发上限为各节点上限之和"""
+        return sum(node.limit for node in self.nodes)
+
+    @property
+    def max_batch_size(self) -> int:
+        """单次请求的图像数上限取各节点的最小值，保证拆分后的请求任一节点都能执行"""
+        return min(getattr(node.adapter, "max_batch_size", None) or 1 for node in self.nodes)
+
+    async def _probe(self, node: BackendNode) -> None:
+        """探测节点队列深度，探测失败计为一次失败"""
+        try:
+            depth = await asyncio.wait_for(node.adapter.queue_depth(), QUEUE_PROBE_TIMEOUT)
+            node.queue_depth = depth
+        except Exception:
+            node.record_failure(self.failure_threshold, self.eject_seconds)
+        finally:
+            node.queue_checked_at = time.monotonic()
+
+    async def _refresh_queue_depths(self) -> None:
+        """并发刷新过期的队列深度"""
+        now = time.monotonic()
+        stale = [
+            node for node in self.nodes
+            if node.is_available(now)
+            and now - node.queue_checked_at > self.queue_ttl
+            and hasattr(node.adapter, "queue_depth")
+        ]
+        if stale:
+            await asyncio.gather(*[self._probe(node) for node in stale])
+
+    async def _pick(self, exclude: List[BackendNode]) -> Optional[BackendNode]:
+        """选择预计等待时间最短的可用节点（优先未满并发上限的节点）；全部被剔除时选最早恢复的节点试探"""
+        await self._refresh_queue_depths()
+
+        now = time.monotonic()
+        candidates = [n for n in self.nodes if n not in exclude]
+        if not candidates:
+            return None
+
+        available = [n for n in candidates if n.is_available(now)]
+        if available:
+            idle = [n for n in available if n.inflight < n.limit]
+            return min(idle or available, key=lambda n: n.score())
+        return min(candidates, key=lambda n: n.ejected_until)
+
+    async def _call(self, fn: Callable[[BaseImageAdapter], Awaitable[Any]]) -> Any:
+        """在选中的节点上执行请求，可重试的失败换下一个节点"""
+        tried: List[BackendNode] = []
+        last_error: Optional[Exception] = None
+
+        while True:
+            node = await self._pick(tried)
+            if node is None:
+                break
+            tried.append(node)
+
+            node.inflight += 1
+            started = time.monotonic()
+            try:
+                result = await fn(node.adapter)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                node.record_failure(self.failure_threshold, self.eject_seconds)
+                last_error = e
+                print(f"Image backend {node.name} failed: {e}")
+                continue
+            finally:
+                node.inflight -= 1
+
+            node.record_success(time.monotonic() - started)
+            return result
+
+        raise last_error or RuntimeError("没有可用的图像后端")
+
+    async def txt2img(self, prompt: str, **kwargs) -> List[str]:
+        """文生图"""
+        return await self._call(lambda adapter: adapter.txt2img(prompt=prompt, **kwargs))
+
+    async def img2img(self, init_image: str, prompt: str, **kwargs) -> List[str]:
+        """图生图"""
+        return await self._call(
+            lambda adapter: adapter.img2img(init_image=init_image, prompt=prompt, **kwargs)
+        )
+
+    async def txt2img_batch(self, prompts: List[str], **kwargs) -> List[Optional[str]]:
+        """批量文生图，按可用节点数拆分后并发执行"""
+        now = time.monotonic()
+        parts = max(1, min(len(prompts), sum(n.is_available(now) for n in self.nodes)))
+        size = -(-len(prompts) // parts)
+        chunks = [prompts[i:i + size] for i in range(0, len(prompts), size)]
+
+        results = await asyncio.gather(*[
+            self._call(lambda adapter, chunk=chunk: adapter.txt2img_batch(chunk, **kwargs))
+            for chunk in chunks
+        ])
+        images = [image for chunk_result in results for image in chunk_result]
+
+        # 后端内部吞掉的单条失败返回 None，统一重新路由一次
+        missing = [i for i, image in enumerate(images) if image is None]
+        if missing:
+            retried = await self._call(
+                lambda adapter: adapter.txt2img_batch([prompts[i] for i in missing], **kwargs)
+            )
+            for i, image in zip(missing, retried):
+                images[i] = image
+        return images
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """所有节点状态"""
+        return [node.to_dict() for node in self.nodes]
@@ -0,0 +1,287 @@
+"""同类型模型间的延迟感知路由与熔断
+
+按模型ID记录滚动延迟（EWMA）和错误率，连续失败达到阈值后熔断（open），
+熔断期过后放行一个试探请求（half_open），成功则恢复、失败则再次熔断且熔断时间翻倍。
+未指定模型ID时，未熔断的模型按 偏好顺序（extra_config.route_priority，越小越优先）→ 延迟 排序，
+依次尝试，可重试的错误（限流、5xx、连接错误、认证失败）切换到下一个模型。
+统计保存在进程内，并由 AIModelService.test_connection 的测试结果预热。
+"""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.ai.base import BaseAIAdapter
+from app.services.ai.resilience import is_retryable
+
+
+EWMA_ALPHA = 0.3  # 新样本在延迟/错误率均值中的权重
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_model_failure(error: Exception) -> bool:
+    """是否由模型服务本身导致（计入熔断并切换模型），请求参数错误等不计入"""
+    status = getattr(error, "status_code", None)
+    if status in (401, 403):
+        return True
+    return is_retryable(error)
+
+
+class ModelHealth:
+    """单个模型的健康状态"""
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.latency: Optional[float] = None  # EWMA 延迟（秒）
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.open_seconds = settings.MODEL_CIRCUIT_OPEN_SECONDS
+        self.trial_inflight = False
+        self.successes = 0
+        self.failures = 0
+        self.trips = 0
+
+    def _update(self, latency: Optional[float], failed: bool) -> None:
+        if latency is not None:
+            self.latency = latency if self.latency is None else (
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+            )
+        self.error_rate = EWMA_ALPHA * float(failed) + (1 - EWMA_ALPHA) * self.error_rate
+
+    def record_success(self, latency: Optional[float]) -> None:
+        """记录成功请求，关闭熔断"""
+        self._update(latency, False)
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.trial_inflight = False
+        if self.state != CLOSED:
+            print(f"Model {self.model_id} recovered, closing circuit")
+        self.state = CLOSED
+        self.open_seconds = settings.MODEL_CIRCUIT_OPEN_SECONDS
+
+    def record_failure(self) -> None:
+        """记录失败请求，达到阈值或试探失败时熔断（失败请求的耗时不计入延迟）"""
+        self._update(None, True)
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.trial_inflight = False
+        if self.state == HALF_OPEN:
+            self.open_seconds = min(self.open_seconds * 2, settings.MODEL_CIRCUIT_OPEN_MAX_SECONDS)
+            self._trip()
+        elif (
+            self.state == CLOSED
+            and self.consecutive_failures >= settings.MODEL_CIRCUIT_FAILURE_THRESHOLD
+        ):
+            self._trip()
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.open_seconds
+        self.trips += 1
+        print(f"Model {self.model_id} circuit open for {self.open_seconds:.0f}s")
+
+    def available(self) -> bool:
+        """当前是否可以接收请求（熔断期满后只放行一个试探请求）"""
+        if self.state == OPEN and time.monotonic() >= self.open_until:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not self.trial_inflight
+        return self.state == CLOSED
+
+    def acquire(self) -> None:
+        """请求发出前调用，半开状态下占用试探名额"""
+        if self.state == HALF_OPEN:
+            self.trial_inflight = True
+
+    def release(self) -> None:
+        """请求被取消（未产生结果）时归还试探名额"""
+        self.trial_inflight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        self.available()  # 刷新熔断期满的状态
+        return {
+            "state": self.state,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "consecutive_failures": self.consecutive_failures,
+            "open_for": max(0.0, round(self.open_until - time.monotonic(), 1))
+            if self.state == OPEN else 0.0,
+            "successes": self.successes,
+            "failures": self.failures,
+            "trips": self.trips,
+        }
+
+
+# 按模型ID保存，适配器重建后保留统计
+_health: Dict[str, ModelHealth] = {}
+
+
+def get_model_health(model_id: str) -> ModelHealth:
+    """获取模型健康状态，不存在时创建"""
+    health = _health.get(model_id)
+    if health is None:
+        health = _health.setdefault(model_id, ModelHealth(model_id))
+    return health
+
+
+def record_probe(model_id: str, success: bool, latency_ms: Optional[float]) -> None:
+    """记录连接测试结果，用于预热路由统计"""
+    health = get_model_health(model_id)
+    latency = latency_ms / 1000 if latency_ms is not None else None
+    if success:
+        health.record_success(latency)
+    else:
+        health.record_failure()
+
+
+def route_key(priority: int, model_id: str) -> Tuple[int, int, float]:
+    """路由排序键：可用性 → 偏好顺序 → 延迟（无样本的模型排在有样本的之后）"""
+    health = get_model_health(model_id)
+    latency = health.latency if health.latency is not None else float("inf")
+    return (0 if health.available() else 1, priority, latency)
+
+
+def get_router_stats() -> Dict[str, Dict[str, Any]]:
+    """当前进程中各模型的路由统计"""
+    return {model_id: health.snapshot() for model_id, health in _health.items()}
+
+
+class RoutedTextAdapter(BaseAIAdapter):
+    """在同类型的多个模型间路由的文本适配器，其余属性转发给当前首选模型"""
+
+    def __init__(self, members: List[Tuple[str, int, BaseAIAdapter]]):
+        """初始化
+
+        Args:
+            members: [(模型ID, 偏好顺序, 适配器)]，偏好顺序越小越优先
+        """
+        self.members = members
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "members":
+            raise AttributeError(name)
+        return getattr(self._ordered()[0][2], name)
+
+    def _ordered(self) -> List[Tuple[str, int, BaseAIAdapter]]:
+        """按可用性、偏好、延迟排序的成员"""
+        return sorted(self.members, key=lambda m: route_key(m[1], m[0]))
+
+    def _candidates(self) -> List[Tuple[str, BaseAIAdapter]]:
+        """本次请求依次尝试的模型，全部熔断时仍尝试首选模型"""
+        ordered = self._ordered()
+        candidates = [(m[0], m[2]) for m in ordered if get_model_health(m[0]).available()]
+        return candidates or [(ordered[0][0], ordered[0][2])]
+
+    async def _call(self, method: str, *args, **kwargs) -> Any:
+        """按顺序尝试各模型"""
+        error: Optional[Exception] = None
+        for model_id, adapter in self._candidates():
+            health = get_model_health(model_id)
+            health.acquire()
+            started = time.monotonic()
+            try:
+                result = await getattr(adapter, method)(*args, **kwargs)
+            except asyncio.CancelledError:
+                health.release()
+                raise
+            except Exception as e:
+                if not is_model_failure(e):
+                    health.release()
+                    raise
+                health.record_failure()
+                print(f"Model {model_id} failed ({e}), failing over")
+                error = e
+                continue
+            health.record_success(time.monotonic() - started)
+            return result
+        raise error
+
+    async def generate_text(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> str:
+        """生成文本"""
+        return await self._call(
+            "generate_text",
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            context=context,
+        )
+
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成文本，只在收到首个片段之前切换模型，延迟按首个片段到达时间计"""
+        kwargs = dict(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            context=context,
+        )
+        error: Optional[Exception] = None
+        for model_id, adapter in self._candidates():
+            health = get_model_health(model_id)
+            health.acquire()
+            started = time.monotonic()
+            first = True
+            try:
+                async for text in adapter.generate_text_stream(**kwargs):
+                    if first:
+                        first = False
+                        health.record_success(time.monotonic() - started)
+                    yield text
+            except Exception as e:
+                if not first or not is_model_failure(e):
+                    health.release()
+                    raise
+                health.record_failure()
+                print(f"Model {model_id} failed ({e}), failing over")
+                error = e
+                continue
+            except BaseException:
+                health.release()
+                raise
+            if first:
+                health.record_success(time.monotonic() - started)
+            return
+        raise error
+
+    async def discard(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> None:
+        """删除各成员缓存的对应响应"""
+        from app.services.ai.response_cache import discard_cached_response
+
+        for _, _, adapter in self.members:
+            await discard_cached_response(
+                adapter, prompt, system_prompt, max_tokens, temperature, context
+            )
+
+    async def generate_image(self, *args, **kwargs) -> List[str]:
+        return await self._call("generate_image", *args, **kwargs)
+
+    async def analyze_image(self, *args, **kwargs) -> str:
+        return await self._call("analyze_image", *args, **kwargs)
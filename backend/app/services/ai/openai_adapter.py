@@ -1,10 +1,12 @@
 """OpenAI服务适配器"""
 
-from typing import Optional, List, Dict
+import os
+from typing import AsyncIterator, Optional, List, Dict, Union
 from openai import AsyncOpenAI
 
 from app.core.config import settings
 from app.services.ai.base import BaseAIAdapter
+from app.services.ai.image_input import is_remote, to_data_url
 
 
 class OpenAIAdapter(BaseAIAdapter):
@@ -23,6 +25,7 @@ class OpenAIAdapter(BaseAIAdapter):
         default_temperature: Optional[float] = None,
         timeout: int = 300,
         extra_headers: Optional[Dict[str, str]] = None,
+        max_retries: int = 2,
     ):
         """初始化 OpenAI 适配器
         
@@ -35,6 +38,7 @@ class OpenAIAdapter(BaseAIAdapter):
             default_temperature: 默认温度
             timeout: 请求超时时间（秒）
             extra_headers: 额外请求头
+            max_retries: SDK 内置重试次数，由外层重试策略接管时设为 0
         """
         self.model_name = model_name
         self.default_max_tokens = default_max_tokens or 4096
@@ -47,20 +51,37 @@ class OpenAIAdapter(BaseAIAdapter):
             organization=organization,
             timeout=timeout,
             default_headers=extra_headers,
+            max_retries=max_retries,
         )
 
+    @staticmethod
+    def _build_messages(
+        prompt: str,
+        system_prompt: Optional[str],
+        context: Optional[str],
+    ) -> List[Dict[str, str]]:
+        """构建消息列表
+
+        固定内容在前、变化内容在后（system -> context -> prompt），
+        使支持自动前缀缓存的服务端（OpenAI、vLLM 等）能命中相同前缀。
+        """
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        content = f"{context}\n\n{prompt}" if context else prompt
+        messages.append({"role": "user", "content": content})
+        return messages
+
     async def generate_text(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
+        context: Optional[str] = None,
     ) -> str:
         """使用GPT生成文本"""
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+        messages = self._build_messages(prompt, system_prompt, context)
 
         response = await self.client.chat.completions.create(
             model=self.model_name,
@@ -71,6 +92,29 @@ class OpenAIAdapter(BaseAIAdapter):
 
         return response.choices[0].message.content
 
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """使用GPT流式生成文本"""
+        messages = self._build_messages(prompt, system_prompt, context)
+
+        stream = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=max_tokens or self.default_max_tokens,
+            temperature=temperature or self.default_temperature,
+            stream=True,
+        )
+
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
     async def generate_image(
         self,
         prompt: str,
@@ -102,12 +146,16 @@ class OpenAIAdapter(BaseAIAdapter):
 
     async def analyze_image(
         self,
-        image_url: str,
+        image: Union[str, bytes, os.PathLike],
         prompt: str,
     ) -> str:
-        """使用GPT-4V分析图像"""
+        """使用GPT-4V分析图像
+
+        HTTP(S) URL 直接交给服务端下载，本地文件和字节以 data URL 内联发送。
+        """
         # 使用配置的模型名称或默认视觉模型
         vision_model = self.model_name if "vision" in self.model_name or "gpt-4o" in self.model_name else "gpt-4-vision-preview"
+        image_url = image if is_remote(image) else await to_data_url(image)
         
         response = await self.client.chat.completions.create(
             model=vision_model,
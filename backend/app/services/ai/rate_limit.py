@@ -0,0 +1,357 @@
+"""LLM调用限流
+
+每个模型一组令牌桶（每分钟请求数 rpm、每分钟 token 数 tpm），状态存放在 Redis 中由所有进程共享，
+Redis 不可用时退化为进程内令牌桶。另有进程内并发上限。容量不足时等待而不是失败。
+通过模型 extra_config 的 rpm / tpm / max_concurrency 配置，未配置的维度不限制。
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.services.ai.base import BaseAIAdapter
+
+
+REDIS_KEY_PREFIX = "man:ratelimit:"
+MAX_SLEEP = 5.0  # 单次等待上限（秒），醒来后重新检查令牌桶
+REDIS_RETRY_INTERVAL = 30.0  # Redis 出错后多久再尝试（秒）
+
+# 同时检查多个令牌桶，全部足够时才扣减；返回需要等待的秒数
+# KEYS: 桶键；ARGV: 依次为每个桶的 容量、每秒补充量、请求量
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local requested = tonumber(ARGV[i * 3])
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < requested then
+        wait = math.max(wait, (requested - tokens) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - tonumber(ARGV[i * 3])
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return tostring(wait)
+"""
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符 1 token，其余字符（中文等）约 1 字符 1 token"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+class _LocalBucket:
+    """进程内令牌桶（Redis 不可用时使用）"""
+
+    def __init__(self):
+        self.tokens: Optional[float] = None
+        self.ts = time.monotonic()
+
+
+class RateLimiter:
+    """单个模型的限流器"""
+
+    def __init__(
+        self,
+        name: str,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        self._local: Dict[str, _LocalBucket] = {}
+        self._lock = threading.Lock()
+        self._script = None
+        self._redis_retry_at = 0.0
+        self._stats = {
+            "acquired": 0,
+            "waited": 0,
+            "wait_seconds": 0.0,
+            "in_flight": 0,
+            "waiting": 0,
+            "redis_errors": 0,
+        }
+
+    def configure(
+        self,
+        rpm: Optional[int],
+        tpm: Optional[int],
+        max_concurrency: Optional[int],
+    ) -> None:
+        """更新限流配置"""
+        if max_concurrency != self.max_concurrency:
+            self._semaphore = None
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+
+    def _buckets(self, tokens: int) -> List[Tuple[str, float, float, float]]:
+        """生效的令牌桶：(名称, 容量, 每秒补充量, 请求量)"""
+        buckets = []
+        if self.rpm:
+            buckets.append(("rpm", float(self.rpm), self.rpm / 60.0, 1.0))
+        if self.tpm:
+            # 单次请求超过容量时按容量扣减，否则永远等不到
+            buckets.append(("tpm", float(self.tpm), self.tpm / 60.0, float(min(tokens, self.tpm))))
+        return buckets
+
+    def _get_semaphore(self) -> Optional[asyncio.Semaphore]:
+        """当前事件循环的并发信号量"""
+        if not self.max_concurrency:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._semaphore[1]
+
+    async def _try_redis(self, buckets: List[Tuple[str, float, float, float]]) -> float:
+        """在 Redis 中尝试扣减，返回需要等待的秒数"""
+        from app.core.redis import get_async_redis
+
+        if self._script is None:
+            self._script = get_async_redis().register_script(_ACQUIRE_SCRIPT)
+        keys = [f"{REDIS_KEY_PREFIX}{self.name}:{name}" for name, _, _, _ in buckets]
+        args: List[float] = []
+        for _, capacity, rate, requested in buckets:
+            args.extend([capacity, rate, requested])
+        return float(await self._script(keys=keys, args=args))
+
+    def _try_local(self, buckets: List[Tuple[str, float, float, float]]) -> float:
+        """在进程内令牌桶中尝试扣减，返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for name, capacity, rate, requested in buckets:
+                bucket = self._local.setdefault(name, _LocalBucket())
+                tokens = capacity if bucket.tokens is None else bucket.tokens
+                tokens = min(capacity, tokens + max(0.0, now - bucket.ts) * rate)
+                levels.append(tokens)
+                if tokens < requested:
+                    wait = max(wait, (requested - tokens) / rate)
+            for (name, _, _, requested), tokens in zip(buckets, levels):
+                bucket = self._local[name]
+                bucket.tokens = tokens - requested if wait == 0 else tokens
+                bucket.ts = now
+        return wait
+
+    async def _wait_for_tokens(self, tokens: int) -> None:
+        """等待令牌桶容量"""
+        buckets = self._buckets(tokens)
+        if not buckets:
+            return
+
+        started = time.monotonic()
+        while True:
+            if time.monotonic() < self._redis_retry_at:
+                wait = self._try_local(buckets)
+            else:
+                try:
+                    wait = await self._try_redis(buckets)
+                except Exception as e:
+                    self._stats["redis_errors"] += 1
+                    self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+                    print(f"Rate limiter redis unavailable, using local buckets: {e}")
+                    wait = self._try_local(buckets)
+            if wait <= 0:
+                break
+            await asyncio.sleep(min(wait, MAX_SLEEP))
+
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self._stats["waited"] += 1
+            self._stats["wait_seconds"] += waited
+
+    async def acquire(self, tokens: int = 0) -> Optional[asyncio.Semaphore]:
+        """获取调用许可（并发 + 令牌桶），返回值需传给 release"""
+        semaphore = self._get_semaphore()
+        self._stats["waiting"] += 1
+        try:
+            if semaphore is not None:
+                await semaphore.acquire()
+            try:
+                await self._wait_for_tokens(tokens)
+            except BaseException:
+                if semaphore is not None:
+                    semaphore.release()
+                raise
+        finally:
+            self._stats["waiting"] -= 1
+        self._stats["acquired"] += 1
+        self._stats["in_flight"] += 1
+        return semaphore
+
+    def release(self, semaphore: Optional[asyncio.Semaphore]) -> None:
+        """释放并发许可"""
+        self._stats["in_flight"] -= 1
+        if semaphore is not None:
+            semaphore.release()
+
+    async def stats(self) -> Dict[str, Any]:
+        """限流状态：配置、当前进程计数和共享令牌桶余量"""
+        buckets: Dict[str, Any] = {}
+        if self.rpm or self.tpm:
+            from app.core.redis import get_async_redis
+
+            for name in ("rpm", "tpm"):
+                if not getattr(self, name):
+                    continue
+                try:
+                    level = await get_async_redis().hget(f"{REDIS_KEY_PREFIX}{self.name}:{name}", "tokens")
+                    buckets[name] = float(level) if level is not None else None
+                except Exception:
+                    bucket = self._local.get(name)
+                    buckets[name] = bucket.tokens if bucket else None
+        return {
+            "model": self.name,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "max_concurrency": self.max_concurrency,
+            "buckets": buckets,
+            **self._stats,
+            "wait_seconds": round(self._stats["wait_seconds"], 3),
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(
+    name: str,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+) -> RateLimiter:
+    """获取进程内共享的限流器，配置变更时就地更新（保留计数）"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = RateLimiter(name, rpm, tpm, max_concurrency)
+    else:
+        limiter.configure(rpm, tpm, max_concurrency)
+    return limiter
+
+
+def list_rate_limiters() -> List[RateLimiter]:
+    """当前进程中的所有限流器"""
+    return list(_limiters.values())
+
+
+class RateLimitedTextAdapter(BaseAIAdapter):
+    """为文本适配器增加限流，其余方法直接转发"""
+
+    def __init__(self, adapter: BaseAIAdapter, limiter: RateLimiter):
+        self.adapter = adapter
+        self.limiter = limiter
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "adapter":
+            raise AttributeError(name)
+        return getattr(self.adapter, name)
+
+    def _request_tokens(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        max_tokens: Optional[int],
+        context: Optional[str] = None,
+    ) -> int:
+        """预占的 token 数：输入估算 + 输出上限（与服务商计算 TPM 的方式一致）"""
+        max_tokens = max_tokens or getattr(self.adapter, "default_max_tokens", None) or 0
+        return (
+            estimate_tokens(prompt)
+            + estimate_tokens(system_prompt)
+            + estimate_tokens(context)
+            + max_tokens
+        )
+
+    async def generate_text(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs,
+    ) -> str:
+        """生成文本"""
+        permit = await self.limiter.acquire(
+            self._request_tokens(prompt, system_prompt, max_tokens, kwargs.get("context"))
+        )
+        try:
+            return await self.adapter.generate_text(
+                prompt=prompt, system_prompt=system_prompt, max_tokens=max_tokens, **kwargs
+            )
+        finally:
+            self.limiter.release(permit)
+
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        """流式生成文本，流结束前一直占用并发许可"""
+        permit = await self.limiter.acquire(
+            self._request_tokens(prompt, system_prompt, max_tokens, kwargs.get("context"))
+        )
+        try:
+            async for text in self.adapter.generate_text_stream(
+                prompt=prompt, system_prompt=system_prompt, max_tokens=max_tokens, **kwargs
+            ):
+                yield text
+        finally:
+            self.limiter.release(permit)
+
+    async def generate_image(self, *args, **kwargs) -> List[str]:
+        permit = await self.limiter.acquire()
+        try:
+            return await self.adapter.generate_image(*args, **kwargs)
+        finally:
+            self.limiter.release(permit)
+
+    async def analyze_image(self, image, prompt: str, *args, **kwargs) -> str:
+        # 图像输入的 token 无法准确估算，只计提示词和输出上限
+        permit = await self.limiter.acquire(self._request_tokens(prompt, None, kwargs.get("max_tokens")))
+        try:
+            return await self.adapter.analyze_image(image, prompt, *args, **kwargs)
+        finally:
+            self.limiter.release(permit)
+
+
+def with_rate_limit(adapter: BaseAIAdapter, name: str, config: Optional[Dict[str, Any]]) -> BaseAIAdapter:
+    """按模型 extra_config 为适配器启用限流，未配置任何限制时原样返回
+
+    Args:
+        adapter: 文本适配器
+        name: 限流器名称（模型ID）
+        config: 模型 extra_config
+    """
+    config = config or {}
+    rpm = config.get("rpm")
+    tpm = config.get("tpm")
+    max_concurrency = config.get("max_concurrency")
+    if not (rpm or tpm or max_concurrency):
+        return adapter
+    return RateLimitedTextAdapter(adapter, get_rate_limiter(name, rpm, tpm, max_concurrency))
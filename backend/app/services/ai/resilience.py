@@ -0,0 +1,304 @@
+"""LLM请求重试与对冲
+
+重试：429、408、5xx、连接错误和超时按指数退避（带抖动）重试，响应带 Retry-After 时以其为准。
+对冲：请求耗时超过该模型近期 p95 延迟（不低于 LLM_HEDGE_MIN_DELAY）仍未返回时，
+再发出一个相同请求（可发往备用模型），取先成功的结果并取消另一个。
+通过模型 extra_config 的 hedge / hedge_model_id / hedge_percentile / max_retries 配置。
+"""
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+import anthropic
+import httpx
+import openai
+
+from app.core.config import settings
+from app.services.ai.base import BaseAIAdapter
+
+
+LATENCY_WINDOW = 200  # 参与分位数计算的最近样本数
+HEDGE_MIN_SAMPLES = 20  # 样本不足时不对冲
+
+_CONNECTION_ERRORS = (
+    openai.APIConnectionError,
+    anthropic.APIConnectionError,
+    httpx.TransportError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """读取响应的 Retry-After（秒）"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """是否值得重试：限流、服务端错误、连接错误和超时"""
+    status = getattr(error, "status_code", None)
+    if status is None and isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    return isinstance(error, _CONNECTION_ERRORS)
+
+
+class LatencyTracker:
+    """最近请求耗时的滑动窗口"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """分位数，样本不足时返回 None"""
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+
+# 按模型ID保存，适配器重建后保留延迟历史和计数
+_trackers: Dict[str, LatencyTracker] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+class ResilientTextAdapter(BaseAIAdapter):
+    """为文本适配器增加重试和对冲，其余方法直接转发"""
+
+    def __init__(
+        self,
+        adapter: BaseAIAdapter,
+        name: str,
+        secondary: Optional[BaseAIAdapter] = None,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        max_retries: Optional[int] = None,
+    ):
+        """初始化
+
+        Args:
+            adapter: 主适配器
+            name: 统计名称（模型ID）
+            secondary: 对冲请求使用的备用适配器，不指定则发往主适配器
+            hedge: 是否启用对冲
+            hedge_percentile: 对冲等待时间取近期延迟的分位数
+            max_retries: 最大重试次数，不指定则取 LLM_MAX_RETRIES
+        """
+        self.adapter = adapter
+        self.name = name
+        self.secondary = secondary
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.latency = _trackers.setdefault(name, LatencyTracker())
+        self.stats = _stats.setdefault(name, {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "hedges_fired": 0,
+            "hedges_won": 0,
+        })
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "adapter":
+            raise AttributeError(name)
+        return getattr(self.adapter, name)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """第 attempt 次失败后的等待时间，不应重试时返回 None"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = _retry_after(error)
+        if delay is None:
+            backoff = min(settings.LLM_RETRY_BACKOFF_MAX, settings.LLM_RETRY_BACKOFF * 2 ** attempt)
+            delay = backoff * (0.5 + random.random() / 2)
+        return min(delay, settings.LLM_RETRY_BACKOFF_MAX)
+
+    async def _with_retry(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """执行请求，可重试的错误按退避重试"""
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                print(f"LLM request to {self.name} failed ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _timed(self, kwargs: Dict[str, Any]) -> str:
+        """调用主适配器并记录耗时"""
+        started = time.monotonic()
+        result = await self.adapter.generate_text(**kwargs)
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def hedge_delay(self) -> Optional[float]:
+        """对冲等待时间，未启用或样本不足时返回 None"""
+        if not self.hedge:
+            return None
+        value = self.latency.percentile(self.hedge_percentile)
+        if value is None:
+            return None
+        return max(value, settings.LLM_HEDGE_MIN_DELAY)
+
+    async def generate_text(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> str:
+        """生成文本"""
+        kwargs = dict(prompt=prompt, system_prompt=system_prompt, max_tokens=max_tokens, context=context)
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+
+        self.stats["requests"] += 1
+        try:
+            delay = self.hedge_delay()
+            if delay is None:
+                return await self._with_retry(lambda: self._timed(kwargs))
+            return await self._hedged(kwargs, delay)
+        except Exception:
+            self.stats["failures"] += 1
+            raise
+
+    async def _hedged(self, kwargs: Dict[str, Any], delay: float) -> str:
+        """主请求超过 delay 未返回时发出对冲请求，取先成功的结果"""
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._with_retry(lambda: self._timed(kwargs)))
+        backup: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.stats["hedges_fired"] += 1
+            backup_adapter = self.secondary or self.adapter
+            backup = asyncio.ensure_future(
+                self._with_retry(lambda: backup_adapter.generate_text(**kwargs))
+            )
+
+            pending = {primary, backup}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        error = error or asyncio.CancelledError()
+                        continue
+                    if task.exception() is None:
+                        if task is backup:
+                            self.stats["hedges_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # cancel() 之后任务要到下一次事件循环才变为 cancelled，需在取消前判断
+            primary_pending = not primary.done()
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+            if primary_pending:
+                # 被取消的慢请求按已等待时间计入，避免延迟分布只剩快请求
+                self.latency.record(time.monotonic() - started)
+
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成文本，只在收到首个片段之前重试（不对冲）"""
+        kwargs = dict(prompt=prompt, system_prompt=system_prompt, max_tokens=max_tokens, context=context)
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+
+        self.stats["requests"] += 1
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async for text in self.adapter.generate_text_stream(**kwargs):
+                    started = True
+                    yield text
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(e, attempt)
+                if delay is None:
+                    self.stats["failures"] += 1
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def generate_image(self, *args, **kwargs) -> List[str]:
+        return await self._with_retry(lambda: self.adapter.generate_image(*args, **kwargs))
+
+    async def analyze_image(self, *args, **kwargs) -> str:
+        return await self._with_retry(lambda: self.adapter.analyze_image(*args, **kwargs))
+
+
+def with_retry_policy(
+    adapter: BaseAIAdapter,
+    name: str,
+    config: Optional[Dict[str, Any]],
+    secondary: Optional[BaseAIAdapter] = None,
+    max_retries: Optional[int] = None,
+) -> BaseAIAdapter:
+    """按模型 extra_config 为适配器启用重试和对冲
+
+    Args:
+        adapter: 文本适配器（应关闭 SDK 自带重试）
+        name: 模型ID
+        config: 模型 extra_config
+        secondary: 对冲备用适配器
+        max_retries: 最大重试次数，指定时覆盖 extra_config.max_retries（路由成员为 0）
+    """
+    config = config or {}
+    if max_retries is None:
+        max_retries = config.get("max_retries")
+    return ResilientTextAdapter(
+        adapter,
+        name,
+        secondary=secondary,
+        hedge=bool(config.get("hedge")),
+        hedge_percentile=config.get("hedge_percentile", 0.95),
+        max_retries=max_retries,
+    )
+
+
+def get_policy_stats() -> Dict[str, Dict[str, Any]]:
+    """当前进程中各模型的重试/对冲计数和延迟分位数"""
+    result = {}
+    for name, counters in _stats.items():
+        tracker = _trackers.get(name)
+        result[name] = {
+            **counters,
+            "p50": tracker.percentile(0.5) if tracker else None,
+            "p95": tracker.percentile(0.95) if tracker else None,
+        }
+    return result
@@ -0,0 +1,403 @@
+"""LLM响应缓存
+
+缓存键为 模型 + 系统提示词 + 固定上下文 + 提示词 + max_tokens + temperature 的哈希。
+进程内 LRU 在前，Redis 在后，两层都有 TTL；单条超过大小上限的响应不缓存。
+通过 LLM_CACHE_ENABLED 或模型 extra_config.response_cache 开启。
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.services.ai.base import BaseAIAdapter
+
+
+T = TypeVar("T")
+
+
+REDIS_KEY_PREFIX = "man:llm-cache:"
+REDIS_STATS_KEY = "man:llm-cache:stats"
+STATS_FLUSH_INTERVAL = 30.0  # 跨进程计数器写入 Redis 的间隔（秒）
+
+
+class LLMResponseCache:
+    """两级LLM响应缓存"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: int,
+        max_entry_bytes: int,
+        use_redis: bool = True,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.use_redis = use_redis
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "skipped": 0}
+        self._pending: Dict[str, int] = {}  # 尚未写入 Redis 的计数增量
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def make_key(
+        model: str,
+        system_prompt: Optional[str],
+        prompt: str,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        context: Optional[str] = None,
+    ) -> str:
+        """计算缓存键"""
+        raw = json.dumps(
+            [model, system_prompt or "", prompt, max_tokens, temperature, context or ""],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str) -> None:
+        """累加计数器，跨进程计数先记在进程内，定期写入 Redis"""
+        with self._lock:
+            self._stats[name] += 1
+            if self.use_redis:
+                self._pending[name] = self._pending.get(name, 0) + 1
+
+    async def _flush_stats(self, force: bool = False) -> None:
+        """把累积的计数增量写入 Redis（距上次写入超过 STATS_FLUSH_INTERVAL 或 force 时）"""
+        if not self.use_redis:
+            return
+        with self._lock:
+            if not self._pending or (
+                not force and time.monotonic() - self._last_flush < STATS_FLUSH_INTERVAL
+            ):
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        from app.core.redis import get_async_redis
+
+        try:
+            pipe = get_async_redis().pipeline(transaction=False)
+            for name, n in pending.items():
+                pipe.hincrby(REDIS_STATS_KEY, name, n)
+            await pipe.execute()
+        except Exception:
+            pass
+
+    async def get(self, key: str) -> Optional[str]:
+        """读取缓存，先查进程内再查 Redis"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                value = entry[1]
+            else:
+                if entry:
+                    del self._entries[key]
+                value = None
+
+        if value is not None:
+            self._count("local_hits")
+            await self._flush_stats()
+            return value
+
+        if self.use_redis:
+            from app.core.redis import get_async_redis
+
+            try:
+                data = await get_async_redis().get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                print(f"LLM cache redis read failed: {e}")
+                data = None
+            if data is not None:
+                value = data.decode("utf-8")
+                self._put_local(key, value)
+                self._count("redis_hits")
+                await self._flush_stats()
+                return value
+
+        self._count("misses")
+        await self._flush_stats()
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """写入两级缓存"""
+        if not value or len(value.encode("utf-8")) > self.max_entry_bytes:
+            self._count("skipped")
+            return
+
+        self._put_local(key, value)
+        self._count("stores")
+
+        if self.use_redis:
+            from app.core.redis import get_async_redis
+
+            try:
+                await get_async_redis().set(REDIS_KEY_PREFIX + key, value, ex=self.ttl)
+            except Exception as e:
+                print(f"LLM cache redis write failed: {e}")
+
+    async def delete(self, key: str) -> None:
+        """删除缓存"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+        if self.use_redis:
+            from app.core.redis import get_async_redis
+
+            try:
+                await get_async_redis().delete(REDIS_KEY_PREFIX + key)
+            except Exception:
+                pass
+
+    def _put_local(self, key: str, value: str) -> None:
+        """写入进程内 LRU"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def stats(self) -> Dict[str, Any]:
+        """命中统计：当前进程和所有进程汇总（汇总最多滞后各进程 STATS_FLUSH_INTERVAL 秒）"""
+        await self._flush_stats(force=True)
+        with self._lock:
+            local = dict(self._stats)
+            local["local_entries"] = len(self._entries)
+
+        result: Dict[str, Any] = {"process": local, "global": None}
+        if self.use_redis:
+            from app.core.redis import get_async_redis
+
+            try:
+                data = await get_async_redis().hgetall(REDIS_STATS_KEY)
+                result["global"] = {k.decode(): int(v) for k, v in data.items()}
+            except Exception:
+                pass
+        return result
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def get_response_cache() -> LLMResponseCache:
+    """获取进程内共享的响应缓存"""
+    global _cache
+    if _cache is None:
+        _cache = LLMResponseCache(
+            max_entries=settings.LLM_CACHE_LOCAL_MAX_ENTRIES,
+            ttl=settings.LLM_CACHE_TTL,
+            max_entry_bytes=settings.LLM_CACHE_MAX_ENTRY_BYTES,
+        )
+    return _cache
+
+
+def _endpoint(adapter: BaseAIAdapter) -> str:
+    """适配器请求的服务地址，同名模型部署在不同地址时不共享缓存"""
+    base_url = getattr(adapter, "base_url", None)
+    if base_url is None:
+        base_url = getattr(getattr(adapter, "client", None), "base_url", None)
+    return str(base_url or "").rstrip("/")
+
+
+class CachedTextAdapter(BaseAIAdapter):
+    """为文本适配器增加响应缓存
+
+    generate_text / generate_text_stream 支持 use_cache=False 跳过缓存，其余方法直接转发。
+    """
+
+    def __init__(self, adapter: BaseAIAdapter, cache: Optional[LLMResponseCache] = None):
+        self.adapter = adapter
+        self.cache = cache or get_response_cache()
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "adapter":
+            raise AttributeError(name)
+        return getattr(self.adapter, name)
+
+    def cache_key(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> str:
+        """计算缓存键，未指定的参数按适配器默认值归一"""
+        model = (
+            f"{type(self.adapter).__name__}:{_endpoint(self.adapter)}:"
+            f"{getattr(self.adapter, 'model_name', '')}"
+        )
+        max_tokens = max_tokens or getattr(self.adapter, "default_max_tokens", None)
+        if temperature is None:
+            temperature = getattr(self.adapter, "default_temperature", None)
+        return self.cache.make_key(model, system_prompt, prompt, max_tokens, temperature, context)
+
+    async def generate_text(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> str:
+        """生成文本，命中缓存时直接返回"""
+        kwargs = dict(prompt=prompt, system_prompt=system_prompt, max_tokens=max_tokens, context=context)
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+
+        if not use_cache:
+            return await self.adapter.generate_text(**kwargs)
+
+        key = self.cache_key(prompt, system_prompt, max_tokens, temperature, context)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        response = await self.adapter.generate_text(**kwargs)
+        await self.cache.set(key, response)
+        return response
+
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[str]:
+        """流式生成文本，命中缓存时一次性返回，未命中时在流结束后写入缓存"""
+        kwargs = dict(prompt=prompt, system_prompt=system_prompt, max_tokens=max_tokens, context=context)
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+
+        key = self.cache_key(prompt, system_prompt, max_tokens, temperature, context) if use_cache else None
+        if key:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts: List[str] = []
+        async for text in self.adapter.generate_text_stream(**kwargs):
+            parts.append(text)
+            yield text
+
+        if key:
+            await self.cache.set(key, "".join(parts))
+
+    async def discard(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        context: Optional[str] = None,
+    ) -> None:
+        """删除指定请求的缓存（如响应解析失败）"""
+        await self.cache.delete(self.cache_key(prompt, system_prompt, max_tokens, temperature, context))
+
+    async def generate_image(self, *args, **kwargs) -> List[str]:
+        return await self.adapter.generate_image(*args, **kwargs)
+
+    async def analyze_image(self, *args, **kwargs) -> str:
+        return await self.adapter.analyze_image(*args, **kwargs)
+
+
+def with_response_cache(adapter: BaseAIAdapter, enabled: Optional[bool] = None) -> BaseAIAdapter:
+    """按配置为适配器启用响应缓存
+
+    Args:
+        adapter: 文本适配器
+        enabled: 是否启用，不指定时取 LLM_CACHE_ENABLED
+    """
+    if enabled is None:
+        enabled = settings.LLM_CACHE_ENABLED
+    if not enabled or isinstance(adapter, CachedTextAdapter):
+        return adapter
+    return CachedTextAdapter(adapter)
+
+
+class DiscardableStream:
+    """流式响应，附带删除其缓存的方法（完整输出解析失败时调用）"""
+
+    def __init__(self, chunks: AsyncIterator[str], discard: Callable[[], Awaitable[None]]):
+        self.chunks = chunks
+        self._discard = discard
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.chunks.__aiter__()
+
+    async def discard(self) -> None:
+        await self._discard()
+
+
+def discardable_stream(
+    adapter: BaseAIAdapter,
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    context: Optional[str] = None,
+) -> DiscardableStream:
+    """发起流式请求，返回可删除对应缓存的流"""
+    chunks = adapter.generate_text_stream(
+        prompt=prompt,
+        system_prompt=system_prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        context=context,
+    )
+    return DiscardableStream(
+        chunks,
+        lambda: discard_cached_response(
+            adapter, prompt, system_prompt, max_tokens, temperature, context
+        ),
+    )
+
+
+async def discard_cached_response(
+    adapter: BaseAIAdapter,
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    context: Optional[str] = None,
+) -> None:
+    """适配器启用了缓存时删除对应响应，否则不做任何事
+
+    多模型路由适配器会转发给各成员。
+    """
+    discard = getattr(adapter, "discard", None)
+    if discard is not None:
+        await discard(prompt, system_prompt, max_tokens, temperature, context)
+
+
+async def parse_or_discard(
+    adapter: BaseAIAdapter,
+    response: str,
+    parse: Callable[[str], T],
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    context: Optional[str] = None,
+) -> T:
+    """解析响应，解析失败（ValueError）时删除对应缓存后重新抛出
+
+    解析失败的响应不保留在缓存中，重新生成时会再次请求模型。
+    """
+    try:
+        return parse(response)
+    except ValueError:
+        await discard_cached_response(
+            adapter, prompt, system_prompt, max_tokens, temperature, context
+        )
+        raise
@@ -1,10 +1,45 @@
 """Stable Diffusion服务适配器"""
 
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Tuple
 import httpx
+import json
+import time
 
 from app.core.config import settings
+from app.core.http_client import get_http_client
 from app.services.ai.base import BaseImageAdapter
+from app.services.ai.image_cache import get_image_cache
+
+
+PROMPT_BATCH_SCRIPT = "prompts from file or textbox"
+LOADED_CHECKPOINT_TTL = 60.0  # 未指定模型时，后端当前加载模型的查询结果缓存时间（秒）
+
+
+def _normalize_prompt(prompt: str) -> str:
+    """提示词规范化为单行（批量脚本按行拆分任务）"""
+    return " ".join(prompt.split())
+
+
+def _script_unsupported(error: httpx.HTTPStatusError) -> bool:
+    """批量脚本不可用（脚本不存在或参数不兼容），而不是后端的临时故障"""
+    if error.response.status_code == 422:
+        return True
+    try:
+        text = error.response.text.lower()
+    except Exception:
+        return False
+    return "script" in text and "not found" in text
+
+
+def _parse_info(data: Dict[str, Any]) -> Dict[str, Any]:
+    """解析响应中的 info 字段"""
+    info = data.get("info")
+    if isinstance(info, str):
+        try:
+            return json.loads(info)
+        except json.JSONDecodeError:
+            return {}
+    return info or {}
 
 
 class SDAdapter(BaseImageAdapter):
@@ -19,6 +54,8 @@ class SDAdapter(BaseImageAdapter):
         default_cfg_scale: Optional[float] = None,
         default_sampler: Optional[str] = None,
         checkpoint_name: Optional[str] = None,
+        max_batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
         timeout: int = 300,
     ):
         """初始化 Stable Diffusion 适配器
@@ -31,6 +68,8 @@ class SDAdapter(BaseImageAdapter):
             default_cfg_scale: 默认 CFG 值
             default_sampler: 默认采样器
             checkpoint_name: 模型文件名
+            max_batch_size: 单次请求最多生成的图像数
+            max_concurrency: 同时执行的请求数
             timeout: 请求超时时间（秒）
         """
         self.base_url = base_url or settings.SD_API_URL
@@ -40,9 +79,53 @@ class SDAdapter(BaseImageAdapter):
         self.default_cfg_scale = default_cfg_scale or 7.0
         self.default_sampler = default_sampler
         self.checkpoint_name = checkpoint_name
+        self.max_batch_size = max_batch_size or 4
+        self.max_concurrency = max_concurrency
         self.timeout = timeout
+        self._prompt_script_supported = True
+        self._loaded_checkpoint: Optional[Tuple[float, Optional[str]]] = None  # (查询时间, 模型)
 
-    async def txt2img(
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享连接池客户端"""
+        return get_http_client(self.base_url)
+
+    async def queue_depth(self) -> int:
+        """当前排队的任务数"""
+        response = await self.client.get(
+            "/sdapi/v1/progress",
+            params={"skip_current_image": "true"},
+            timeout=5.0,
+        )
+        response.raise_for_status()
+        state = response.json().get("state") or {}
+        return int(state.get("job_count") or 0)
+
+    async def _current_checkpoint(self) -> Optional[str]:
+        """实际使用的模型：指定的 checkpoint_name，或后端当前加载的模型（查询失败时为 None）"""
+        if self.checkpoint_name:
+            return self.checkpoint_name
+        now = time.monotonic()
+        if self._loaded_checkpoint and now - self._loaded_checkpoint[0] < LOADED_CHECKPOINT_TTL:
+            return self._loaded_checkpoint[1]
+        try:
+            response = await self.client.get("/sdapi/v1/options", timeout=5.0)
+            response.raise_for_status()
+            checkpoint = response.json().get("sd_model_checkpoint") or None
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Failed to query loaded checkpoint from {self.base_url}: {e}")
+            checkpoint = None
+        self._loaded_checkpoint = (now, checkpoint)
+        return checkpoint
+
+    async def _backend_identity(self) -> Optional[List[str]]:
+        """图像缓存的后端标识 [服务地址, 模型]，无法确定模型时返回 None（不缓存）"""
+        checkpoint = await self._current_checkpoint()
+        if not checkpoint:
+            return None
+        return [self.base_url.rstrip("/"), checkpoint]
+
+    def _txt2img_payload(
         self,
         prompt: str,
         negative_prompt: Optional[str] = None,
@@ -52,8 +135,8 @@ class SDAdapter(BaseImageAdapter):
         cfg_scale: Optional[float] = None,
         seed: int = -1,
         sampler: Optional[str] = None,
-    ) -> List[str]:
-        """文生图"""
+    ) -> Dict[str, Any]:
+        """构建文生图请求体"""
         payload = {
             "prompt": prompt,
             "negative_prompt": negative_prompt or "",
@@ -74,17 +157,182 @@ class SDAdapter(BaseImageAdapter):
                 "sd_model_checkpoint": self.checkpoint_name
             }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/sdapi/v1/txt2img",
-                json=payload,
-                timeout=float(self.timeout),
-            )
-            response.raise_for_status()
-            data = response.json()
+        return payload
+
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """提交生成请求，返回原始响应
+
+        固定种子的请求在同一后端和模型下结果是确定的，命中图像缓存时不访问后端。
+        """
+        cache = get_image_cache()
+        key = None
+        seed = payload.get("seed")
+        if cache and seed is not None and seed >= 0:
+            key = cache.make_key(path, payload, await self._backend_identity())
+        if key:
+            cached = await cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = await self.client.post(
+            path,
+            json=payload,
+            timeout=float(self.timeout),
+        )
+        response.raise_for_status()
+        data = response.json()
 
+        if key:
+            await cache.put(key, data.get("images", []), data.get("info"))
+        return data
+
+    async def _post_txt2img(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """提交文生图请求，返回原始响应"""
+        return await self._post("/sdapi/v1/txt2img", payload)
+
+    async def txt2img(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        steps: Optional[int] = None,
+        cfg_scale: Optional[float] = None,
+        seed: int = -1,
+        sampler: Optional[str] = None,
+    ) -> List[str]:
+        """文生图"""
+        payload = self._txt2img_payload(
+            prompt, negative_prompt, width, height, steps, cfg_scale, seed, sampler
+        )
+        data = await self._post_txt2img(payload)
         return data.get("images", [])
 
+    async def txt2img_batch(
+        self,
+        prompts: List[str],
+        negative_prompt: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        steps: Optional[int] = None,
+        cfg_scale: Optional[float] = None,
+        seed: int = -1,
+        sampler: Optional[str] = None,
+    ) -> List[Optional[str]]:
+        """批量文生图，每个提示词返回一张图像
+
+        相同提示词合并为一次 batch_size/n_iter 请求；不同提示词通过
+        "prompts from file or textbox" 脚本在一次请求中排队，服务端不支持时回退为逐个请求。
+        结果按 info.all_prompts 映射回输入顺序。
+        """
+        results: List[Optional[str]] = [None] * len(prompts)
+        params = dict(
+            negative_prompt=negative_prompt,
+            width=width,
+            height=height,
+            steps=steps,
+            cfg_scale=cfg_scale,
+            seed=seed,
+            sampler=sampler,
+        )
+
+        # 按提示词分组
+        groups: Dict[str, List[int]] = {}
+        for i, prompt in enumerate(prompts):
+            groups.setdefault(_normalize_prompt(prompt), []).append(i)
+
+        singles = []
+        for prompt, indexes in groups.items():
+            if len(indexes) == 1:
+                singles.append((prompt, indexes[0]))
+                continue
+            for start in range(0, len(indexes), self.max_batch_size):
+                chunk = indexes[start:start + self.max_batch_size]
+                images = await self._txt2img_repeat(prompt, len(chunk), params)
+                for index, image in zip(chunk, images):
+                    results[index] = image
+
+        for start in range(0, len(singles), self.max_batch_size):
+            chunk = singles[start:start + self.max_batch_size]
+            images = await self._txt2img_multi([p for p, _ in chunk], params)
+            for (_, index), image in zip(chunk, images):
+                results[index] = image
+
+        return results
+
+    async def _txt2img_repeat(
+        self,
+        prompt: str,
+        count: int,
+        params: Dict[str, Any],
+    ) -> List[str]:
+        """同一提示词生成 count 张图像（单次前向批量）"""
+        payload = self._txt2img_payload(prompt, **params)
+        payload["batch_size"] = count
+        payload["n_iter"] = 1
+
+        data = await self._post_txt2img(payload)
+        images = data.get("images", [])
+        first = _parse_info(data).get("index_of_first_image", 0)
+        return images[first:first + count]
+
+    async def _txt2img_multi(
+        self,
+        prompts: List[str],
+        params: Dict[str, Any],
+    ) -> List[Optional[str]]:
+        """不同提示词在一次请求中生成，每个提示词一张图像"""
+        if len(prompts) == 1 or not self._prompt_script_supported:
+            return await self._txt2img_each(prompts, params)
+
+        payload = self._txt2img_payload("", **params)
+        payload["script_name"] = PROMPT_BATCH_SCRIPT
+        # [checkbox_iterate, checkbox_iterate_batch, prompt_position, prompt_txt]
+        payload["script_args"] = [False, False, "start", "\n".join(prompts)]
+
+        try:
+            data = await self._post_txt2img(payload)
+        except httpx.HTTPStatusError as e:
+            if _script_unsupported(e):
+                # 脚本不存在或参数不兼容，之后都逐个请求
+                self._prompt_script_supported = False
+                return await self._txt2img_each(prompts, params)
+            raise
+
+        info = _parse_info(data)
+        first = info.get("index_of_first_image", 0)
+        images = data.get("images", [])[first:]
+        all_prompts = info.get("all_prompts") or []
+
+        if len(all_prompts) != len(images):
+            # 无法确定图像对应的提示词，不按位置猜测（可能把图像分给错误的分镜）
+            print(
+                f"SD prompt batch returned {len(images)} images for {len(all_prompts)} prompts, "
+                "discarding unmatched results"
+            )
+            return [None] * len(prompts)
+
+        # 按实际提示词映射，避免依赖脚本的执行顺序
+        by_prompt: Dict[str, List[str]] = {}
+        for prompt, image in zip(all_prompts, images):
+            by_prompt.setdefault(_normalize_prompt(prompt), []).append(image)
+        return [
+            by_prompt[p].pop(0) if by_prompt.get(p) else None
+            for p in prompts
+        ]
+
+    async def _txt2img_each(
+        self,
+        prompts: List[str],
+        params: Dict[str, Any],
+    ) -> List[Optional[str]]:
+        """逐个请求生成"""
+        results = []
+        for prompt in prompts:
+            images = await self.txt2img(prompt=prompt, **params)
+            results.append(images[0] if images else None)
+        return results
+
     async def img2img(
         self,
         init_image: str,
@@ -93,6 +341,7 @@ class SDAdapter(BaseImageAdapter):
         strength: float = 0.75,
         steps: Optional[int] = None,
         cfg_scale: Optional[float] = None,
+        seed: int = -1,
         sampler: Optional[str] = None,
     ) -> List[str]:
         """图生图"""
@@ -103,6 +352,7 @@ class SDAdapter(BaseImageAdapter):
             "denoising_strength": strength,
             "steps": steps or self.default_steps,
             "cfg_scale": cfg_scale or self.default_cfg_scale,
+            "seed": seed,
         }
         
         # 添加采样器配置
@@ -115,13 +365,5 @@ class SDAdapter(BaseImageAdapter):
                 "sd_model_checkpoint": self.checkpoint_name
             }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/sdapi/v1/img2img",
-                json=payload,
-                timeout=float(self.timeout),
-            )
-            response.raise_for_status()
-            data = response.json()
-
+        data = await self._post("/sdapi/v1/img2img", payload)
         return data.get("images", [])
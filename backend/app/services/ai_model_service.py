@@ -1,14 +1,35 @@
 """AI模型配置服务"""
 
+import asyncio
+import math
 import uuid
 import time
-from typing import Optional, List
+from datetime import datetime, timedelta
+from typing import Dict, Optional, List, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
-from app.models.ai_model import AIModel, ModelProvider, ModelType
-from app.schemas.ai_model import AIModelCreate, AIModelUpdate, AIModelResponse, AIModelTestResult
-from app.core.encryption import encrypt_api_key, decrypt_api_key
+from app.core.config import settings
+from app.models.ai_model import AIModel, AIModelHealthCheck, ModelProvider, ModelType
+from app.schemas.ai_model import (
+    AIModelCreate,
+    AIModelUpdate,
+    AIModelResponse,
+    AIModelTestResult,
+    AIModelHealthCheckItem,
+    AIModelLatencyHistory,
+    LatencyBucket,
+)
+from app.core.encryption import encrypt_api_key
+
+
+def _percentile(checks: List[AIModelHealthCheck], q: float) -> Optional[float]:
+    """成功测试的延迟分位数（毫秒），没有成功记录时返回 None"""
+    values = sorted(c.latency_ms for c in checks if c.success and c.latency_ms is not None)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))
+    return values[index]
 
 
 class AIModelService:
@@ -108,6 +129,7 @@ class AIModelService:
 
         db.commit()
         db.refresh(model)
+        AIModelService._invalidate_adapters(model_id)
         return model
 
     @staticmethod
@@ -119,6 +141,7 @@ class AIModelService:
 
         db.delete(model)
         db.commit()
+        AIModelService._invalidate_adapters(model_id)
         return True
 
     @staticmethod
@@ -133,6 +156,7 @@ class AIModelService:
         model.is_default = True
         db.commit()
         db.refresh(model)
+        AIModelService._invalidate_adapters(model_id)
         return model
 
     @staticmethod
@@ -157,25 +181,83 @@ class AIModelService:
 
     @staticmethod
     async def test_connection(db: Session, model_id: str) -> AIModelTestResult:
-        """测试模型连接"""
+        """测试模型连接，结果写入连接测试历史"""
         model = AIModelService.get_model_or_raise(db, model_id)
 
+        timeout = min(model.timeout or settings.MODEL_TEST_TIMEOUT, settings.MODEL_TEST_TIMEOUT)
+        result = await AIModelService._probe(model, timeout)
+        AIModelService._save_health_checks(db, [(model, result)])
+        return result
+
+    @staticmethod
+    async def test_all(
+        db: Session,
+        model_type: Optional[ModelType] = None,
+        timeout: Optional[float] = None,
+    ) -> List[AIModelHealthCheckItem]:
+        """并发测试所有启用的模型，结果写入连接测试历史
+
+        Args:
+            db: 数据库会话
+            model_type: 只测试指定类型
+            timeout: 所有测试共用的超时（秒），到期未完成的记为超时
+        """
+        timeout = timeout or settings.MODEL_TEST_TIMEOUT
+        models = AIModelService.list_models(db, model_type=model_type, is_enabled=True)
+        if not models:
+            return []
+
+        from app.services.ai.model_router import record_probe
+
+        tasks = [
+            asyncio.ensure_future(AIModelService._probe(m, min(m.timeout or timeout, timeout)))
+            for m in models
+        ]
+        await asyncio.wait(tasks, timeout=timeout)
+
+        results = []
+        for model, task in zip(models, tasks):
+            if task.done():
+                result = task.result()
+            else:
+                task.cancel()
+                result = AIModelTestResult(
+                    success=False,
+                    message=f"连接失败: 超过 {timeout:g} 秒未完成",
+                    latency_ms=round(timeout * 1000, 2),
+                    error_class="TimeoutError",
+                )
+                record_probe(model.id, False, result.latency_ms)
+            results.append((model, result))
+
+        AIModelService._save_health_checks(db, results)
+        return [
+            AIModelHealthCheckItem(
+                model_id=model.id,
+                name=model.name,
+                provider=model.provider,
+                model_type=model.model_type,
+                **result.model_dump(),
+            )
+            for model, result in results
+        ]
+
+    @staticmethod
+    async def _probe(model: AIModel, timeout: float) -> AIModelTestResult:
+        """测试一个模型，测试结果同时计入路由统计"""
         start_time = time.time()
 
         try:
-            # 根据模型类型和提供商进行测试
-            api_key = decrypt_api_key(model.api_key) if model.api_key else None
-
             if model.provider in [ModelProvider.openai, ModelProvider.openai_compatible]:
-                await AIModelService._test_openai(model, api_key)
+                await AIModelService._test_openai(model, timeout)
             elif model.provider == ModelProvider.zhipu:
-                await AIModelService._test_zhipu(model, api_key)
+                await AIModelService._test_zhipu(model, timeout)
             elif model.provider == ModelProvider.anthropic:
-                await AIModelService._test_anthropic(model, api_key)
+                await AIModelService._test_anthropic(model, timeout)
             elif model.provider == ModelProvider.stable_diffusion:
-                await AIModelService._test_sd(model)
+                await AIModelService._test_sd(model, timeout)
             elif model.provider == ModelProvider.comfyui:
-                await AIModelService._test_comfyui(model)
+                await AIModelService._test_comfyui(model, timeout)
             else:
                 return AIModelTestResult(
                     success=False,
@@ -183,7 +265,7 @@ class AIModelService:
                 )
 
             latency = (time.time() - start_time) * 1000
-            return AIModelTestResult(
+            result = AIModelTestResult(
                 success=True,
                 message="连接成功",
                 latency_ms=round(latency, 2),
@@ -191,37 +273,39 @@ class AIModelService:
 
         except Exception as e:
             latency = (time.time() - start_time) * 1000
-            return AIModelTestResult(
+            result = AIModelTestResult(
                 success=False,
                 message=f"连接失败: {str(e)}",
                 latency_ms=round(latency, 2),
+                error_class=type(e).__name__,
             )
 
+        # 测试结果计入路由统计，使路由在真实请求到来前就能区分快慢和故障模型
+        from app.services.ai.model_router import record_probe
+
+        record_probe(model.id, result.success, result.latency_ms)
+        return result
+
     @staticmethod
-    async def _test_openai(model: AIModel, api_key: str):
-        """测试 OpenAI/兼容 API 连接"""
-        from openai import AsyncOpenAI
+    def _sdk_client(model: AIModel, timeout: float):
+        """获取模型适配器的 SDK 客户端（复用其连接池），测试使用较短超时且不重试"""
+        from app.services.ai.factory import AIAdapterFactory
 
-        client = AsyncOpenAI(
-            api_key=api_key,
-            base_url=model.base_url,
-            timeout=min(model.timeout, 30),  # 测试使用较短超时
-        )
+        adapter = AIAdapterFactory.get_model_adapter(model)
+        return adapter.client.with_options(timeout=timeout, max_retries=0)
+
+    @staticmethod
+    async def _test_openai(model: AIModel, timeout: float):
+        """测试 OpenAI/兼容 API 连接"""
+        client = AIModelService._sdk_client(model, timeout)
 
         # 尝试获取模型列表来测试连接
         await client.models.list()
 
     @staticmethod
-    async def _test_zhipu(model: AIModel, api_key: str):
+    async def _test_zhipu(model: AIModel, timeout: float):
         """测试智谱AI连接"""
-        from openai import AsyncOpenAI
-
-        base_url = model.base_url or "https://open.bigmodel.cn/api/paas/v4"
-        client = AsyncOpenAI(
-            api_key=api_key,
-            base_url=base_url,
-            timeout=min(model.timeout, 30),
-        )
+        client = AIModelService._sdk_client(model, timeout)
 
         # 发送一个简单的消息来测试
         await client.chat.completions.create(
@@ -231,15 +315,9 @@ class AIModelService:
         )
 
     @staticmethod
-    async def _test_anthropic(model: AIModel, api_key: str):
+    async def _test_anthropic(model: AIModel, timeout: float):
         """测试 Anthropic API 连接"""
-        from anthropic import AsyncAnthropic
-
-        client = AsyncAnthropic(
-            api_key=api_key,
-            base_url=model.base_url,
-            timeout=min(model.timeout, 30),
-        )
+        client = AIModelService._sdk_client(model, timeout)
 
         # 发送一个简单的消息来测试
         await client.messages.create(
@@ -249,22 +327,104 @@ class AIModelService:
         )
 
     @staticmethod
-    async def _test_sd(model: AIModel):
+    async def _test_sd(model: AIModel, timeout: float):
         """测试 Stable Diffusion WebUI 连接"""
-        import httpx
+        from app.core.http_client import get_http_client
 
-        async with httpx.AsyncClient(timeout=min(model.timeout, 30)) as client:
-            response = await client.get(f"{model.base_url}/sdapi/v1/sd-models")
-            response.raise_for_status()
+        response = await get_http_client(model.base_url).get("/sdapi/v1/sd-models", timeout=timeout)
+        response.raise_for_status()
 
     @staticmethod
-    async def _test_comfyui(model: AIModel):
+    async def _test_comfyui(model: AIModel, timeout: float):
         """测试 ComfyUI 连接"""
-        import httpx
+        from app.core.http_client import get_http_client
+
+        response = await get_http_client(model.base_url).get("/system_stats", timeout=timeout)
+        response.raise_for_status()
+
+    @staticmethod
+    def _save_health_checks(db: Session, results: List[Tuple[AIModel, AIModelTestResult]]):
+        """保存连接测试结果，并清理超过保留期的历史"""
+        now = datetime.utcnow()
+        for model, result in results:
+            db.add(AIModelHealthCheck(
+                id=str(uuid.uuid4()),
+                model_id=model.id,
+                checked_at=now,
+                success=result.success,
+                latency_ms=result.latency_ms,
+                error_class=result.error_class,
+                message=result.message,
+            ))
+        db.query(AIModelHealthCheck).filter(
+            AIModelHealthCheck.checked_at < now - timedelta(days=settings.MODEL_HEALTH_RETENTION_DAYS)
+        ).delete(synchronize_session=False)
+        db.commit()
+
+    @staticmethod
+    def latency_history(
+        db: Session,
+        model_id: Optional[str] = None,
+        hours: int = 24,
+        bucket_minutes: int = 60,
+    ) -> List[AIModelLatencyHistory]:
+        """按时间段统计各模型连接测试的 p50/p95 延迟（只统计成功的测试）
+
+        Args:
+            db: 数据库会话
+            model_id: 只统计指定模型，不指定则统计所有有记录的模型
+            hours: 统计最近多少小时
+            bucket_minutes: 每个时间段的分钟数
+        """
+        since = datetime.utcnow() - timedelta(hours=hours)
+        query = db.query(AIModelHealthCheck, AIModel.name).join(
+            AIModel, AIModel.id == AIModelHealthCheck.model_id
+        ).filter(AIModelHealthCheck.checked_at >= since)
+        if model_id:
+            query = query.filter(AIModelHealthCheck.model_id == model_id)
+        rows = query.order_by(AIModelHealthCheck.model_id, AIModelHealthCheck.checked_at).all()
+
+        grouped: Dict[str, Tuple[str, List[AIModelHealthCheck]]] = {}
+        for check, name in rows:
+            grouped.setdefault(check.model_id, (name, []))[1].append(check)
+
+        bucket_seconds = bucket_minutes * 60
+        history = []
+        for mid, (name, checks) in grouped.items():
+            buckets: Dict[int, List[AIModelHealthCheck]] = {}
+            for check in checks:
+                offset = int((check.checked_at - since).total_seconds() // bucket_seconds)
+                buckets.setdefault(offset, []).append(check)
+
+            history.append(AIModelLatencyHistory(
+                model_id=mid,
+                name=name,
+                checks=len(checks),
+                failures=sum(1 for c in checks if not c.success),
+                p50_ms=_percentile(checks, 0.5),
+                p95_ms=_percentile(checks, 0.95),
+                last_error_class=next(
+                    (c.error_class for c in reversed(checks) if not c.success), None
+                ),
+                buckets=[
+                    LatencyBucket(
+                        start=since + timedelta(seconds=offset * bucket_seconds),
+                        checks=len(items),
+                        failures=sum(1 for c in items if not c.success),
+                        p50_ms=_percentile(items, 0.5),
+                        p95_ms=_percentile(items, 0.95),
+                    )
+                    for offset, items in sorted(buckets.items())
+                ],
+            ))
+        return history
+
+    @staticmethod
+    def _invalidate_adapters(model_id: str):
+        """清除该模型已缓存的适配器实例（所有进程）"""
+        from app.services.ai.adapter_cache import invalidate_adapters
 
-        async with httpx.AsyncClient(timeout=min(model.timeout, 30)) as client:
-            response = await client.get(f"{model.base_url}/system_stats")
-            response.raise_for_status()
+        invalidate_adapters(model_id)
 
     @staticmethod
     def _clear_default(db: Session, model_type: ModelType):
@@ -1,10 +1,17 @@
 """Step 3: 分章节规划"""
 
-from typing import List
+from typing import List, Optional, Tuple
 from celery import shared_task
 
-from app.services.ai import OpenAIAdapter, ClaudeAdapter
+from app.services.ai import BaseAIAdapter, OpenAIAdapter, ClaudeAdapter
+from app.services.ai.response_cache import (
+    DiscardableStream,
+    discardable_stream,
+    parse_or_discard,
+    with_response_cache,
+)
 from app.schemas.chapter import ChapterResponse
+from app.services.pipeline.prompt_context import PromptContextBuilder
 
 
 CHAPTER_PLAN_SYSTEM_PROMPT = """你是一个专业的漫画分镜编剧。
@@ -12,10 +19,11 @@ CHAPTER_PLAN_SYSTEM_PROMPT = """你是一个专业的漫画分镜编剧。
 
 输出必须是有效的JSON格式，包含chapters数组。"""
 
-CHAPTER_PLAN_PROMPT_TEMPLATE = """故事大纲：
-{story_outline}
+# 章节规划需要的节拍和故事线字段
+CHAPTER_PLAN_BEAT_FIELDS = ("id", "order", "type", "description", "characters_involved")
+CHAPTER_PLAN_STORYLINE_FIELDS = ("id", "name", "description", "beats")
 
-配置：
+CHAPTER_PLAN_PROMPT_TEMPLATE = """配置：
 - 每章预计格数：{panels_per_chapter}
 - 目标章节数：{target_chapters}
 
@@ -49,34 +57,43 @@ CHAPTER_PLAN_PROMPT_TEMPLATE = """故事大纲：
 class ChapterPlanService:
     """章节规划服务"""
     
-    def __init__(self, use_claude: bool = False):
-        if use_claude:
-            self.ai = ClaudeAdapter()
+    def __init__(self, use_claude: bool = False, ai: Optional[BaseAIAdapter] = None):
+        if ai:
+            self.ai = ai
+        elif use_claude:
+            self.ai = with_response_cache(ClaudeAdapter())
         else:
-            self.ai = OpenAIAdapter()
+            self.ai = with_response_cache(OpenAIAdapter())
     
-    async def plan_chapters(
+    def _build_prompt(
         self,
         story_outline: dict,
-        panels_per_chapter: int = 12,
-        target_chapters: int = 1,
-    ) -> List[ChapterResponse]:
-        """规划章节"""
-        import json
-        
+        panels_per_chapter: int,
+        target_chapters: int,
+    ) -> Tuple[str, str]:
+        """构建规划提示词，返回 (固定上下文, 提示词)
+
+        固定上下文（故事大纲）同一项目重新规划时相同，放在前面以命中提示词缓存。
+        超出预算时先截断梗概，节拍最后截断。
+        """
+        synopsis = story_outline.get("synopsis_mid") or story_outline.get("synopsis_short", "")
+        context = (
+            PromptContextBuilder("chapter_plan", getattr(self.ai, "model_name", None))
+            .add("故事梗概", synopsis)
+            .add("关键节拍", story_outline.get("key_beats", []), CHAPTER_PLAN_BEAT_FIELDS, priority=2)
+            .add("故事线", story_outline.get("storylines", []), CHAPTER_PLAN_STORYLINE_FIELDS, priority=1)
+            .build()
+        )
         prompt = CHAPTER_PLAN_PROMPT_TEMPLATE.format(
-            story_outline=json.dumps(story_outline, ensure_ascii=False, indent=2),
             panels_per_chapter=panels_per_chapter,
             target_chapters=target_chapters,
         )
+        return context, prompt
+    
+    def parse_response(self, response: str, project_id: str = "") -> List[ChapterResponse]:
+        """解析模型输出"""
+        import json
         
-        response = await self.ai.generate_text(
-            prompt=prompt,
-            system_prompt=CHAPTER_PLAN_SYSTEM_PROMPT,
-            temperature=0.6,
-        )
-        
-        # 解析JSON响应
         try:
             json_start = response.find('{')
             json_end = response.rfind('}') + 1
@@ -84,11 +101,55 @@ class ChapterPlanService:
                 json_str = response[json_start:json_end]
                 data = json.loads(json_str)
                 chapters = data.get("chapters", [])
-                return [ChapterResponse(**ch) for ch in chapters]
+                return [ChapterResponse(**{"project_id": project_id, **ch}) for ch in chapters]
         except (json.JSONDecodeError, ValueError) as e:
             raise ValueError(f"Failed to parse chapters response: {e}")
         
         raise ValueError("No valid JSON found in response")
+    
+    async def plan_chapters(
+        self,
+        story_outline: dict,
+        panels_per_chapter: int = 12,
+        target_chapters: int = 1,
+        project_id: str = "",
+    ) -> List[ChapterResponse]:
+        """规划章节"""
+        context, prompt = self._build_prompt(story_outline, panels_per_chapter, target_chapters)
+        
+        response = await self.ai.generate_text(
+            prompt=prompt,
+            system_prompt=CHAPTER_PLAN_SYSTEM_PROMPT,
+            temperature=0.6,
+            context=context,
+        )
+        
+        return await parse_or_discard(
+            self.ai,
+            response,
+            lambda text: self.parse_response(text, project_id),
+            prompt,
+            CHAPTER_PLAN_SYSTEM_PROMPT,
+            temperature=0.6,
+            context=context,
+        )
+    
+    def plan_chapters_stream(
+        self,
+        story_outline: dict,
+        panels_per_chapter: int = 12,
+        target_chapters: int = 1,
+    ) -> DiscardableStream:
+        """流式规划章节，返回增量文本，完整结果用 parse_response 解析，解析失败时调用 discard"""
+        context, prompt = self._build_prompt(story_outline, panels_per_chapter, target_chapters)
+        
+        return discardable_stream(
+            self.ai,
+            prompt=prompt,
+            system_prompt=CHAPTER_PLAN_SYSTEM_PROMPT,
+            temperature=0.6,
+            context=context,
+        )
 
 
 @shared_task(bind=True)
@@ -104,6 +165,7 @@ def plan_chapters_task(self, project_id: str, story_outline: dict, config: dict)
             story_outline=story_outline,
             panels_per_chapter=config.get("panels_per_chapter", 12),
             target_chapters=config.get("target_chapters", 1),
+            project_id=project_id,
         )
     )
     
@@ -1,9 +1,16 @@
 """Step 5: 一致性资产生成"""
 
-from typing import List, Optional
+import asyncio
+import base64
+from io import BytesIO
+from typing import List, Literal, Optional
+
+from PIL import Image
 from celery import shared_task
 
+from app.core.config import settings
 from app.services.ai import OpenAIAdapter
+from app.services.ai.base import BaseImageAdapter
 from app.services.ai.sd_adapter import SDAdapter
 
 
@@ -19,25 +26,73 @@ EXPRESSION_SHEET_PROMPT_TEMPLATE = """masterpiece, best quality, expression shee
 {style_keywords},
 portrait, face close-up, white background"""
 
+EXPRESSION_ATLAS_PROMPT_TEMPLATE = """masterpiece, best quality, expression sheet,
+{character_description},
+{cols}x{rows} grid of {count} face close-up portraits of the same character,
+expressions from left to right, top to bottom: {expressions},
+{style_keywords},
+evenly spaced, separated panels, white background"""
+
 ENVIRONMENT_PROMPT_TEMPLATE = """masterpiece, best quality, concept art,
 {environment_description},
 {style_keywords},
 detailed background, environment design"""
 
+EXPRESSIONS = ["happy", "sad", "angry", "surprised", "neutral", "confused"]
+
+# 表情图生成方式：
+# batch - 每个表情一个提示词，合并为一次批量请求（默认）
+# atlas - 一次生成网格图再按固定像素切分（一次出图）；文生图不保证按网格对齐，
+#         切出的格子可能错位或与表情不对应，需显式指定，待有布局控制（ControlNet / 区域提示词）后再作为默认
+# separate - 每个表情单独请求（并发执行）
+ExpressionMode = Literal["atlas", "batch", "separate"]
+
+ATLAS_COLS = 3
+ATLAS_CELL_SIZE = 512
+
+
+def slice_grid(image_base64: str, cols: int, rows: int, count: int) -> List[str]:
+    """把网格图按行优先切分为 count 张 PNG（base64）"""
+    with Image.open(BytesIO(base64.b64decode(image_base64))) as atlas:
+        atlas = atlas.convert("RGB")
+        cell_w = atlas.width // cols
+        cell_h = atlas.height // rows
+        crops = []
+        for index in range(count):
+            row, col = divmod(index, cols)
+            cell = atlas.crop((col * cell_w, row * cell_h, (col + 1) * cell_w, (row + 1) * cell_h))
+            buffer = BytesIO()
+            cell.save(buffer, format="PNG")
+            crops.append(base64.b64encode(buffer.getvalue()).decode())
+        return crops
+
 
 class ConsistencyService:
     """一致性资产服务"""
     
-    def __init__(self):
+    def __init__(self, image_ai: Optional[BaseImageAdapter] = None):
         self.text_ai = OpenAIAdapter()
-        self.image_ai = SDAdapter()
+        self.image_ai = image_ai or SDAdapter()
+        # 同一服务实例发出的出图请求共享后端并发上限
+        self._semaphore = asyncio.Semaphore(
+            getattr(self.image_ai, "max_concurrency", None) or settings.IMAGE_MAX_CONCURRENCY
+        )
+    
+    async def _txt2img(self, **kwargs) -> List[str]:
+        async with self._semaphore:
+            return await self.image_ai.txt2img(**kwargs)
+    
+    async def _txt2img_batch(self, prompts: List[str], **kwargs) -> List[Optional[str]]:
+        async with self._semaphore:
+            return await self.image_ai.txt2img_batch(prompts, **kwargs)
     
     async def generate_character_sheet(
         self,
         character: dict,
         style_guide: dict,
+        expression_mode: ExpressionMode = "batch",
     ) -> dict:
-        """生成角色设定图"""
+        """生成角色设定图，三视图和表情图并发生成"""
         # 构建角色描述
         appearance = character.get("appearance", {})
         char_desc = f"{character.get('name', 'character')}, "
@@ -57,39 +112,17 @@ class ConsistencyService:
             style_keywords=style_keywords,
         )
         
-        images = await self.image_ai.txt2img(
-            prompt=prompt,
-            negative_prompt="low quality, blurry, bad anatomy, extra limbs",
-            width=1024,
-            height=768,
-            steps=30,
+        images, expression_images = await asyncio.gather(
+            self._txt2img(
+                prompt=prompt,
+                negative_prompt="low quality, blurry, bad anatomy, extra limbs",
+                width=1024,
+                height=768,
+                steps=30,
+            ),
+            self.generate_expressions(char_desc, style_keywords, EXPRESSIONS, expression_mode),
         )
         
-        # 生成表情图
-        expressions = ["happy", "sad", "angry", "surprised", "neutral", "confused"]
-        expression_images = []
-        
-        for expr in expressions[:6]:  # 生成6张表情
-            expr_prompt = EXPRESSION_SHEET_PROMPT_TEMPLATE.format(
-                character_description=char_desc,
-                expression=expr,
-                style_keywords=style_keywords,
-            )
-            
-            expr_images = await self.image_ai.txt2img(
-                prompt=expr_prompt,
-                negative_prompt="low quality, blurry",
-                width=512,
-                height=512,
-                steps=25,
-            )
-            
-            if expr_images:
-                expression_images.append({
-                    "emotion": expr,
-                    "image": expr_images[0],
-                })
-        
         return {
             "character_id": character.get("id"),
             "front_view": images[0] if images else None,
@@ -100,6 +133,57 @@ class ConsistencyService:
             "outfits": [],
         }
     
+    async def generate_expressions(
+        self,
+        char_desc: str,
+        style_keywords: str,
+        expressions: List[str],
+        mode: ExpressionMode = "batch",
+    ) -> List[dict]:
+        """生成表情图 [{emotion, image}]，未生成成功的表情不返回"""
+        if mode == "atlas":
+            cols = min(ATLAS_COLS, len(expressions))
+            rows = -(-len(expressions) // cols)
+            prompt = EXPRESSION_ATLAS_PROMPT_TEMPLATE.format(
+                character_description=char_desc,
+                cols=cols,
+                rows=rows,
+                count=len(expressions),
+                expressions=", ".join(expressions),
+                style_keywords=style_keywords,
+            )
+            atlas = await self._txt2img(
+                prompt=prompt,
+                negative_prompt="low quality, blurry, text, watermark",
+                width=ATLAS_CELL_SIZE * cols,
+                height=ATLAS_CELL_SIZE * rows,
+                steps=25,
+            )
+            if not atlas:
+                return []
+            images = await asyncio.to_thread(slice_grid, atlas[0], cols, rows, len(expressions))
+        else:
+            prompts = [
+                EXPRESSION_SHEET_PROMPT_TEMPLATE.format(
+                    character_description=char_desc,
+                    expression=expr,
+                    style_keywords=style_keywords,
+                )
+                for expr in expressions
+            ]
+            params = dict(negative_prompt="low quality, blurry", width=512, height=512, steps=25)
+            if mode == "batch":
+                images = await self._txt2img_batch(prompts, **params)
+            else:
+                results = await asyncio.gather(*[self._txt2img(prompt=p, **params) for p in prompts])
+                images = [r[0] if r else None for r in results]
+        
+        return [
+            {"emotion": expr, "image": image}
+            for expr, image in zip(expressions, images)
+            if image
+        ]
+    
     async def generate_environment_sheet(
         self,
         environment: dict,
@@ -114,7 +198,7 @@ class ConsistencyService:
             style_keywords=style_keywords,
         )
         
-        images = await self.image_ai.txt2img(
+        images = await self._txt2img(
             prompt=prompt,
             negative_prompt="low quality, blurry, text, watermark",
             width=1024,
@@ -129,6 +213,34 @@ class ConsistencyService:
             "reference_images": images,
             "prompt_fragments": [prompt],
         }
+    
+    async def generate_project_sheets(
+        self,
+        characters: List[dict],
+        environments: List[dict],
+        style_guide: dict,
+        expression_mode: ExpressionMode = "batch",
+    ) -> dict:
+        """并发生成项目所有角色和场景的设定图，单项失败不影响其他项
+        
+        Returns:
+            {"characters": [...], "environments": [...], "errors": [{id, kind, error}]}
+        """
+        results = await asyncio.gather(
+            *[self.generate_character_sheet(c, style_guide, expression_mode) for c in characters],
+            *[self.generate_environment_sheet(e, style_guide) for e in environments],
+            return_exceptions=True,
+        )
+        
+        output = {"characters": [], "environments": [], "errors": []}
+        items = [("character", c) for c in characters] + [("environment", e) for e in environments]
+        for (kind, item), result in zip(items, results):
+            if isinstance(result, BaseException):
+                print(f"Failed to generate {kind} sheet {item.get('id')}: {result}")
+                output["errors"].append({"id": item.get("id"), "kind": kind, "error": str(result)})
+            else:
+                output[f"{kind}s"].append(result)
+        return output
 
 
 @shared_task(bind=True)
@@ -137,18 +249,21 @@ def generate_character_sheet_task(
     project_id: str, 
     character_id: str,
     character: dict,
-    style_guide: dict
+    style_guide: dict,
+    expression_mode: str = "batch",
 ):
     """Celery任务：生成角色设定图"""
     import asyncio
+    from app.services.ai.factory import AIAdapterFactory
     
-    service = ConsistencyService()
+    service = ConsistencyService(image_ai=AIAdapterFactory.get_default_image_backend())
     loop = asyncio.get_event_loop()
     
     result = loop.run_until_complete(
         service.generate_character_sheet(
             character=character,
             style_guide=style_guide,
+            expression_mode=expression_mode,
         )
     )
     
@@ -164,8 +279,9 @@ def generate_environment_sheet_task(
 ):
     """Celery任务：生成场景设定图"""
     import asyncio
+    from app.services.ai.factory import AIAdapterFactory
     
-    service = ConsistencyService()
+    service = ConsistencyService(image_ai=AIAdapterFactory.get_default_image_backend())
     loop = asyncio.get_event_loop()
     
     result = loop.run_until_complete(
@@ -176,3 +292,29 @@ def generate_environment_sheet_task(
     )
     
     return result
+
+
+@shared_task(bind=True)
+def generate_project_sheets_task(
+    self,
+    project_id: str,
+    characters: List[dict],
+    environments: List[dict],
+    style_guide: dict,
+    expression_mode: str = "batch",
+):
+    """Celery任务：并发生成项目所有角色和场景的设定图"""
+    import asyncio
+    from app.services.ai.factory import AIAdapterFactory
+    
+    service = ConsistencyService(image_ai=AIAdapterFactory.get_default_image_backend())
+    loop = asyncio.get_event_loop()
+    
+    return loop.run_until_complete(
+        service.generate_project_sheets(
+            characters=characters,
+            environments=environments,
+            style_guide=style_guide,
+            expression_mode=expression_mode,
+        )
+    )
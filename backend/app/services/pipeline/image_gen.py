@@ -1,21 +1,17 @@
 """Step 6: 分镜出图"""
 
-from typing import List, Optional
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 from celery import shared_task
 
+from app.core.artifacts import get_artifact_store, image_base64
+from app.core.config import settings
+from app.services.ai.base import BaseImageAdapter
 from app.services.ai.sd_adapter import SDAdapter
 from app.services.ai.comfyui_adapter import ComfyUIAdapter
+from app.services.pipeline.panel_prompt import PanelPromptContext, get_panel_prompt_context
 
 
-PANEL_PROMPT_TEMPLATE = """{style_keywords},
-{scene_description},
-{character_descriptions},
-{action_description},
-{camera_type} shot,
-{composition},
-{mood},
-masterpiece, best quality"""
-
 ROUGH_NEGATIVE_PROMPT = "color, shading, detailed background"
 FINAL_NEGATIVE_PROMPT = "low quality, blurry, bad anatomy, extra limbs, watermark, text, signature"
 
@@ -23,70 +19,90 @@ FINAL_NEGATIVE_PROMPT = "low quality, blurry, bad anatomy, extra limbs, watermar
 class ImageGenService:
     """分镜出图服务"""
     
-    def __init__(self, use_comfyui: bool = False):
-        if use_comfyui:
+    def __init__(
+        self,
+        use_comfyui: bool = False,
+        image_ai: Optional[BaseImageAdapter] = None,
+        project_id: Optional[str] = None,
+        store_artifacts: bool = False,
+    ):
+        """初始化
+
+        Args:
+            use_comfyui: 未指定 image_ai 时使用 ComfyUI 而不是 SD WebUI
+            image_ai: 图像后端
+            project_id: 项目ID，指定时按项目缓存编译后的提示词上下文
+            store_artifacts: 生成的图像写入产物存储，结果中返回产物引用而不是 base64
+        """
+        if image_ai is not None:
+            self.image_ai = image_ai
+        elif use_comfyui:
             self.image_ai = ComfyUIAdapter()
         else:
             self.image_ai = SDAdapter()
+        self.project_id = project_id
+        self.store_artifacts = store_artifacts
+        # 最近一次使用的 (角色列表, 风格指南, 上下文)，同一任务内逐个分镜调用时不再重复查找
+        self._context: Optional[Tuple[List[dict], dict, PanelPromptContext]] = None
+    
+    async def _output(self, image: Optional[str]):
+        """生成结果：base64，或写入产物存储后的引用"""
+        if image is None or not self.store_artifacts:
+            return image
+        artifact = await get_artifact_store().put_base64(image)
+        return artifact.to_dict()
+    
+    def prompt_context(self, characters: List[dict], style_guide: dict) -> PanelPromptContext:
+        """编译后的提示词上下文（角色索引、描述片段、风格关键词）"""
+        cached = self._context
+        if cached and cached[0] is characters and cached[1] is style_guide:
+            return cached[2]
+        context = get_panel_prompt_context(characters, style_guide, self.project_id)
+        self._context = (characters, style_guide, context)
+        return context
     
     def build_panel_prompt(
         self,
         panel: dict,
         characters: List[dict],
         style_guide: dict,
+        context: Optional[PanelPromptContext] = None,
     ) -> str:
-        """构建分镜提示词"""
-        # 风格关键词
-        style_keywords = f"{style_guide.get('art_style', 'manga')}, "
-        style_keywords += f"{style_guide.get('line_style', 'clean lines')}, "
-        style_keywords += f"{style_guide.get('coloring', 'flat colors')}"
-        
-        # 场景描述
-        scene_desc = f"{panel.get('location', '')}, {panel.get('time', '')}"
+        """构建分镜提示词
         
-        # 角色描述
-        panel_characters = panel.get("characters", [])
-        char_descs = []
-        for char_id in panel_characters:
-            char = next((c for c in characters if c.get("id") == char_id), None)
-            if char:
-                appearance = char.get("appearance", {})
-                char_desc = f"{char.get('name')}, "
-                char_desc += f"{appearance.get('hair', '')}, "
-                char_desc += ", ".join(appearance.get("clothing", [])[:2])
-                char_descs.append(char_desc)
+        Args:
+            context: 预编译的上下文，批量构建时传入以避免重复编译
+        """
+        return (context or self.prompt_context(characters, style_guide)).build(panel)
+    
+    def _panel_request(
+        self,
+        panel: dict,
+        characters: List[dict],
+        style_guide: dict,
+        rough: bool,
+        context: Optional[PanelPromptContext] = None,
+    ) -> Tuple[str, dict]:
+        """构建分镜文生图的提示词和出图参数"""
+        prompt = self.build_panel_prompt(panel, characters, style_guide, context)
         
-        # 动作描述
-        action_desc = f"{panel.get('action', '')}, {panel.get('expression', '')}"
+        if rough:
+            # 草稿：黑白线稿
+            return f"monochrome, sketch, lineart, {prompt}", {
+                "negative_prompt": ROUGH_NEGATIVE_PROMPT,
+                "width": 768,
+                "height": 1024,  # 竖版
+                "steps": 20,
+                "cfg_scale": 7.0,
+            }
         
-        # 镜头类型映射
-        camera_map = {
-            "wide": "wide angle",
-            "medium": "medium shot",
-            "close_up": "close-up",
-            "extreme_close_up": "extreme close-up",
-            "bird_eye": "bird's eye view",
-            "worm_eye": "worm's eye view",
+        return prompt, {
+            "negative_prompt": FINAL_NEGATIVE_PROMPT,
+            "width": 768,
+            "height": 1024,
+            "steps": 30,
+            "cfg_scale": 7.5,
         }
-        camera_type = camera_map.get(panel.get("camera", "medium"), "medium shot")
-        
-        # 构图说明
-        composition = panel.get("composition", "")
-        
-        # 情绪/氛围
-        mood = panel.get("mood", "")
-        
-        prompt = PANEL_PROMPT_TEMPLATE.format(
-            style_keywords=style_keywords,
-            scene_description=scene_desc,
-            character_descriptions=", ".join(char_descs),
-            action_description=action_desc,
-            camera_type=camera_type,
-            composition=composition,
-            mood=mood,
-        )
-        
-        return prompt
     
     async def generate_rough(
         self,
@@ -95,50 +111,135 @@ class ImageGenService:
         style_guide: dict,
     ) -> str:
         """生成草稿分镜（黑白线稿）"""
-        base_prompt = self.build_panel_prompt(panel, characters, style_guide)
-        prompt = f"monochrome, sketch, lineart, {base_prompt}"
+        prompt, params = self._panel_request(panel, characters, style_guide, rough=True)
         
-        images = await self.image_ai.txt2img(
-            prompt=prompt,
-            negative_prompt=ROUGH_NEGATIVE_PROMPT,
-            width=768,
-            height=1024,  # 竖版
-            steps=20,
-            cfg_scale=7.0,
-        )
+        images = await self.image_ai.txt2img(prompt=prompt, **params)
         
-        return images[0] if images else None
+        return await self._output(images[0] if images else None)
     
     async def generate_final(
         self,
         panel: dict,
         characters: List[dict],
         style_guide: dict,
-        reference_images: Optional[List[str]] = None,
+        reference_images: Optional[List] = None,
     ) -> str:
-        """生成最终分镜（上色）"""
-        prompt = self.build_panel_prompt(panel, characters, style_guide)
+        """生成最终分镜（上色）
         
+        Args:
+            reference_images: 参考图（base64 或产物引用）
+        """
         # 如果有参考图，使用img2img
         if reference_images and len(reference_images) > 0:
+            prompt = self.build_panel_prompt(panel, characters, style_guide)
             images = await self.image_ai.img2img(
-                init_image=reference_images[0],
+                init_image=await asyncio.to_thread(image_base64, reference_images[0]),
                 prompt=prompt,
                 negative_prompt=FINAL_NEGATIVE_PROMPT,
                 strength=0.6,
                 steps=30,
             )
         else:
-            images = await self.image_ai.txt2img(
-                prompt=prompt,
-                negative_prompt=FINAL_NEGATIVE_PROMPT,
-                width=768,
-                height=1024,
-                steps=30,
-                cfg_scale=7.5,
-            )
+            prompt, params = self._panel_request(panel, characters, style_guide, rough=False)
+            images = await self.image_ai.txt2img(prompt=prompt, **params)
+        
+        return await self._output(images[0] if images else None)
+    
+    def _batch_jobs(
+        self,
+        panels: List[dict],
+        characters: List[dict],
+        style_guide: dict,
+        rough: bool,
+    ) -> List[Tuple[List[int], List[str], dict]]:
+        """把分镜拆成批量请求 [(分镜下标, 提示词, 出图参数)]
+
+        出图参数（尺寸/步数/CFG/负面提示词）相同的分镜合并，每个请求不超过后端的 max_batch_size。
+        """
+        batch_size = max(1, getattr(self.image_ai, "max_batch_size", None) or 1)
+        context = self.prompt_context(characters, style_guide)
+        groups: Dict[tuple, List[Tuple[int, str]]] = {}
+        for i, panel in enumerate(panels):
+            prompt, params = self._panel_request(panel, characters, style_guide, rough, context)
+            groups.setdefault(tuple(sorted(params.items())), []).append((i, prompt))
+        
+        jobs = []
+        for params_key, items in groups.items():
+            for start in range(0, len(items), batch_size):
+                chunk = items[start:start + batch_size]
+                jobs.append(([i for i, _ in chunk], [p for _, p in chunk], dict(params_key)))
+        return jobs
+    
+    async def stream_batch(
+        self,
+        panels: List[dict],
+        characters: List[dict],
+        style_guide: dict,
+        rough: bool = False,
+        max_concurrency: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[int, dict]]:
+        """并发批量生成分镜，按完成顺序逐个产出 (分镜下标, 结果)
+        
+        同时执行的请求数不超过后端的并发上限（模型 extra_config.max_concurrency，
+        后端池为各节点之和）。单个分镜失败只影响该分镜：结果的 image 为 None 并带 error，
+        整批请求失败时逐个分镜重试一次，以区分出真正失败的分镜。
+        store_artifacts 时 image 为产物引用。
+        """
+        limit = (
+            max_concurrency
+            or getattr(self.image_ai, "max_concurrency", None)
+            or settings.IMAGE_MAX_CONCURRENCY
+        )
+        semaphore = asyncio.Semaphore(limit)
+        
+        def result(index: int, image, error: Optional[str] = None) -> Tuple[int, dict]:
+            item = {"panel_id": panels[index].get("id"), "image": image, "is_rough": rough}
+            if image is None:
+                item["error"] = error or "后端未返回图像"
+            return index, item
+        
+        async def store(index: int, image: Optional[str]) -> Tuple[int, dict]:
+            # 单张图像解码或写入失败只影响对应分镜
+            try:
+                return result(index, await self._output(image))
+            except Exception as e:
+                print(f"Failed to store image for panel {panels[index].get('id')}: {e}")
+                return result(index, None, f"{type(e).__name__}: {e}")
         
-        return images[0] if images else None
+        async def run(indexes: List[int], prompts: List[str], params: dict) -> List[Tuple[int, dict]]:
+            async with semaphore:
+                try:
+                    images = await self.image_ai.txt2img_batch(prompts, **params)
+                except Exception as e:
+                    if len(indexes) == 1:
+                        print(f"Failed to generate panel {panels[indexes[0]].get('id')}: {e}")
+                        return [result(indexes[0], None, f"{type(e).__name__}: {e}")]
+                    images = None
+            if images is None:
+                # 整批失败：释放并发名额后逐个重试
+                retried = await asyncio.gather(*[
+                    run([i], [p], params) for i, p in zip(indexes, prompts)
+                ])
+                return [item for items in retried for item in items]
+            stored = await asyncio.gather(*[store(i, image) for i, image in zip(indexes, images)])
+            # 后端返回的图像少于提示词时，缺少的分镜也要有结果
+            missing = [
+                result(i, None, f"后端只返回了 {len(images)}/{len(indexes)} 张图像")
+                for i in indexes[len(images):]
+            ]
+            return list(stored) + missing
+        
+        tasks = [
+            asyncio.ensure_future(run(indexes, prompts, params))
+            for indexes, prompts, params in self._batch_jobs(panels, characters, style_guide, rough)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for item in await next_done:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
     
     async def generate_batch(
         self,
@@ -146,22 +247,20 @@ class ImageGenService:
         characters: List[dict],
         style_guide: dict,
         rough: bool = False,
+        on_result: Optional[Callable[[dict, int], None]] = None,
     ) -> List[dict]:
-        """批量生成分镜"""
-        results = []
-        
-        for panel in panels:
-            if rough:
-                image = await self.generate_rough(panel, characters, style_guide)
-            else:
-                image = await self.generate_final(panel, characters, style_guide)
-            
-            results.append({
-                "panel_id": panel.get("id"),
-                "image": image,
-                "is_rough": rough,
-            })
+        """批量生成分镜，结果按输入分镜顺序返回
         
+        Args:
+            on_result: 每个分镜完成时回调 (结果, 已完成数)
+        """
+        results: List[Optional[dict]] = [None] * len(panels)
+        completed = 0
+        async for index, item in self.stream_batch(panels, characters, style_guide, rough):
+            results[index] = item
+            completed += 1
+            if on_result:
+                on_result(item, completed)
         return results
 
 
@@ -175,10 +274,15 @@ def generate_panel_image_task(
     style_guide: dict,
     rough: bool = False,
 ):
-    """Celery任务：生成单个分镜图"""
+    """Celery任务：生成单个分镜图，image 为产物引用"""
     import asyncio
+    from app.services.ai.factory import AIAdapterFactory
     
-    service = ImageGenService()
+    service = ImageGenService(
+        image_ai=AIAdapterFactory.get_default_image_backend(),
+        project_id=project_id,
+        store_artifacts=True,
+    )
     loop = asyncio.get_event_loop()
     
     if rough:
@@ -206,14 +310,31 @@ def generate_panels_batch_task(
     style_guide: dict,
     rough: bool = False,
 ):
-    """Celery任务：批量生成分镜图"""
+    """Celery任务：批量生成分镜图，各结果的 image 为产物引用"""
     import asyncio
+    from app.services.ai.factory import AIAdapterFactory
     
-    service = ImageGenService()
+    service = ImageGenService(
+        image_ai=AIAdapterFactory.get_default_image_backend(),
+        project_id=project_id,
+        store_artifacts=True,
+    )
     loop = asyncio.get_event_loop()
+    failed = []
+    
+    def report(item: dict, completed: int):
+        if item["image"] is None:
+            failed.append(item["panel_id"])
+        self.update_state(state="PROGRESS", meta={
+            "project_id": project_id,
+            "completed": completed,
+            "total": len(panels),
+            "failed": failed,
+            "panel_id": item["panel_id"],
+        })
     
     result = loop.run_until_complete(
-        service.generate_batch(panels, characters, style_guide, rough)
+        service.generate_batch(panels, characters, style_guide, rough, on_result=report)
     )
     
     return result
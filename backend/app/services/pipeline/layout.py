@@ -1,12 +1,44 @@
 """Step 7: 排版与合成"""
 
-from typing import List, Literal, Optional
+from typing import BinaryIO, Dict, List, Literal, Optional, Tuple, Union
 from io import BytesIO
 import base64
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from celery import shared_task
 
+from app.core.artifacts import get_artifact_store, image_source, is_artifact
+from app.core.config import settings
+from app.core.fonts import get_font, layout_text
+from app.core.pdf_stream import write_pdf
+from app.core.png_stream import PNGStreamWriter
+
+
+def chapter_output_path(project_id: str, chapter_id: str, filename: str) -> str:
+    """章节合成结果的存储路径（自动创建目录）"""
+    directory = os.path.join(settings.DATA_DIR, "projects", project_id, "chapters", chapter_id)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+
+def list_chapter_pages(project_id: str, chapter_id: str) -> List[str]:
+    """章节已合成的页面文件，按页码排序"""
+    directory = os.path.join(
+        settings.DATA_DIR, "projects", project_id, "chapters", chapter_id, "pages"
+    )
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.startswith("page_") and name.endswith((".png", ".jpg"))
+    ]
+
 
 class LayoutService:
     """排版合成服务"""
@@ -80,43 +112,235 @@ class LayoutService:
         
         return pages
     
-    def composite_webtoon(
+    def _open_panel(self, source: Union[str, BinaryIO], size: Tuple[int, int]) -> Image.Image:
+        """解码分镜图像（文件路径或文件对象）并缩放到排版尺寸"""
+        img = Image.open(source)
+        # JPEG 按目标尺寸降采样解码，减少解码内存和耗时
+        img.draft("RGB", size)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return img.resize(size, Image.Resampling.LANCZOS)
+    
+    def render_webtoon(
         self,
-        panel_images: List[dict],  # [{panel_id, image_base64}]
+        panel_images: List[dict],  # [{panel_id, image}]，image 为 base64 或产物引用
         layout: List[dict],
+        output: BinaryIO,
         width: int = 800,
-    ) -> str:
-        """合成条漫"""
-        # 计算总高度
+        strip_height: Optional[int] = None,
+        text_layer: Optional[dict] = None,
+    ) -> Tuple[int, int]:
+        """按固定高度的横向条带合成条漫并流式写出PNG
+        
+        每个条带只解码与之相交的分镜，分镜跨越多个条带时解码结果保留到最后一个条带，
+        峰值内存只与条带高度有关，与章节长度无关。
+        
+        Args:
+            output: PNG 输出文件
+            strip_height: 条带高度，默认 LAYOUT_STRIP_HEIGHT
+            text_layer: 文字气泡，坐标为整张条漫的坐标
+        
+        Returns:
+            (宽度, 高度)
+        """
+        strip_height = strip_height or settings.LAYOUT_STRIP_HEIGHT
         total_height = max(p["y"] + p["height"] for p in layout) + self.page_margin
+        images = {p.get("panel_id"): p.get("image") for p in panel_images}
+        placements = sorted(layout, key=lambda p: p["y"])
+        bubbles = self._collect_bubbles(text_layer)
         
-        # 创建画布
-        canvas = Image.new("RGB", (width, total_height), color="white")
+        writer = PNGStreamWriter(output, width, total_height)
+        decoded: Dict[int, Optional[Image.Image]] = {}  # 与当前条带相交的分镜
         
-        # 粘贴每个分镜
-        for placement in layout:
-            panel_id = placement["panel_id"]
-            panel_data = next((p for p in panel_images if p.get("panel_id") == panel_id), None)
+        for top in range(0, total_height, strip_height):
+            bottom = min(top + strip_height, total_height)
+            strip = Image.new("RGB", (width, bottom - top), color="white")
+            
+            for index, placement in enumerate(placements):
+                if placement["y"] >= bottom:
+                    break
+                if placement["y"] + placement["height"] <= top:
+                    continue
+                if index not in decoded:
+                    decoded[index] = None
+                    data = images.get(placement["panel_id"])
+                    if data:
+                        try:
+                            decoded[index] = self._open_panel(
+                                image_source(data),
+                                (placement["width"], placement["height"]),
+                            )
+                        except Exception as e:
+                            print(f"Failed to process panel {placement['panel_id']}: {e}")
+                if decoded[index] is not None:
+                    strip.paste(decoded[index], (placement["x"], placement["y"] - top))
             
-            if panel_data and panel_data.get("image"):
-                try:
-                    # 解码base64图像
-                    img_data = base64.b64decode(panel_data["image"])
-                    img = Image.open(BytesIO(img_data))
-                    
-                    # 调整大小
-                    img = img.resize((placement["width"], placement["height"]), Image.Resampling.LANCZOS)
-                    
-                    # 粘贴到画布
-                    canvas.paste(img, (placement["x"], placement["y"]))
-                except Exception as e:
-                    print(f"Failed to process panel {panel_id}: {e}")
+            # 释放不再与后续条带相交的分镜
+            for index in [i for i in decoded if placements[i]["y"] + placements[i]["height"] <= bottom]:
+                del decoded[index]
+            
+            if bubbles:
+                draw = ImageDraw.Draw(strip)
+                for bubble in bubbles:
+                    y = bubble.get("y", 0)
+                    if y < bottom and y + bubble.get("height", 50) > top:
+                        self._draw_bubble(draw, bubble, offset_y=-top)
+            
+            writer.write(strip)
         
-        # 转为base64
+        writer.close()
+        return width, total_height
+    
+    def composite_webtoon(
+        self,
+        panel_images: List[dict],  # [{panel_id, image}]，image 为 base64 或产物引用
+        layout: List[dict],
+        width: int = 800,
+    ) -> str:
+        """合成条漫，返回 base64 PNG（大章节应使用 render_webtoon 直接写文件）"""
         buffer = BytesIO()
-        canvas.save(buffer, format="PNG")
+        self.render_webtoon(panel_images, layout, buffer, width)
         return base64.b64encode(buffer.getvalue()).decode()
     
+    def render_pages(
+        self,
+        panel_images: List[dict],  # [{panel_id, image}]，image 为 base64 或产物引用
+        pages_layout: List[List[dict]],
+        output_dir: str,
+        page_width: int = 1200,
+        page_height: int = 1700,
+        text_layer: Optional[dict] = None,
+        image_format: Literal["png", "jpeg"] = "png",
+    ) -> List[dict]:
+        """并行合成页漫，每页一个文件
+        
+        各页在进程池中独立渲染，按路径读取分镜（不通过进程间传递大字符串）：
+        产物引用直接使用存储中的文件，base64 图像只解码一次并写入本任务的临时目录。
+        
+        Args:
+            output_dir: 页面输出目录
+            text_layer: 文字气泡，panels 每项带 panel_id，气泡坐标相对于该分镜
+            image_format: 页面格式，jpeg 可在导出 PDF 时直接嵌入
+        
+        Returns:
+            [{page, path, width, height, mime_type}]，按页码排序
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        extension = "jpg" if image_format == "jpeg" else "png"
+        bubbles: Dict[str, List[dict]] = {}
+        for panel_text in (text_layer or {}).get("panels", []):
+            if panel_text.get("panel_id"):
+                bubbles.setdefault(panel_text["panel_id"], []).extend(panel_text.get("bubbles", []))
+        
+        with tempfile.TemporaryDirectory(prefix="pages-", dir=output_dir) as source_dir:
+            sources = _write_panel_sources(panel_images, source_dir)
+            jobs = []
+            for index, placements in enumerate(pages_layout):
+                jobs.append({
+                    "placements": placements,
+                    "sources": {p["panel_id"]: sources[p["panel_id"]] for p in placements if p["panel_id"] in sources},
+                    "bubbles": {p["panel_id"]: bubbles[p["panel_id"]] for p in placements if p["panel_id"] in bubbles},
+                    "width": page_width,
+                    "height": page_height,
+                    "format": image_format,
+                    "output": os.path.join(output_dir, f"page_{index + 1:03d}.{extension}"),
+                })
+            
+            with _page_executor(len(jobs)) as executor:
+                paths = list(executor.map(_render_page, jobs))
+        
+        # 重新合成后页数减少或格式变化时，删除上次留下的页面，避免导出时混入旧页
+        current = {os.path.basename(path) for path in paths}
+        for name in os.listdir(output_dir):
+            if name.startswith("page_") and name not in current:
+                os.remove(os.path.join(output_dir, name))
+        
+        return [
+            {
+                "page": index + 1,
+                "path": path,
+                "width": page_width,
+                "height": page_height,
+                "mime_type": f"image/{image_format}",
+            }
+            for index, path in enumerate(paths)
+        ]
+    
+    @staticmethod
+    def _collect_bubbles(text_layer: Optional[dict]) -> List[dict]:
+        """文字层中的所有气泡"""
+        if not text_layer:
+            return []
+        return [
+            bubble
+            for panel_text in text_layer.get("panels", [])
+            for bubble in panel_text.get("bubbles", [])
+        ]
+    
+    def _draw_bubble(
+        self,
+        draw: ImageDraw.ImageDraw,
+        bubble: dict,
+        offset_x: int = 0,
+        offset_y: int = 0,
+    ) -> None:
+        """绘制一个气泡，offset_x / offset_y 为气泡坐标到绘制区域的偏移
+        
+        文字在气泡内断行并居中，放不下时缩小字号（最小 LAYOUT_MIN_FONT_SIZE）。
+        """
+        x = bubble.get("x", 0) + offset_x
+        y = bubble.get("y", 0) + offset_y
+        width = bubble.get("width", 100)
+        height = bubble.get("height", 50)
+        text = bubble.get("text", "")
+        bubble_type = bubble.get("type", "speech")
+        
+        # 绘制气泡背景
+        if bubble_type == "speech":
+            # 圆角矩形
+            draw.rounded_rectangle(
+                [x, y, x + width, y + height],
+                radius=10,
+                fill="white",
+                outline="black",
+                width=2,
+            )
+        elif bubble_type == "thought":
+            # 云朵形状（简化为椭圆）
+            draw.ellipse(
+                [x, y, x + width, y + height],
+                fill="white",
+                outline="black",
+                width=2,
+            )
+        elif bubble_type == "narration":
+            # 矩形
+            draw.rectangle(
+                [x, y, x + width, y + height],
+                fill="lightyellow",
+                outline="black",
+                width=1,
+            )
+        elif bubble_type == "sfx":
+            # 拟声词，直接绘制文字
+            pass
+        
+        # 绘制文字
+        if not text:
+            return
+        layout = layout_text(
+            text,
+            width - self.bubble_padding * 2,
+            height - self.bubble_padding * 2,
+            self.default_font_size,
+        )
+        face = get_font(layout.size, layout.font_path)
+        text_y = y + max(self.bubble_padding, (height - layout.height) // 2)
+        for line in layout.lines:
+            text_x = x + (width - face.measure(line)) / 2
+            draw.text((text_x, text_y), line, fill="black", font=face.font)
+            text_y += layout.line_height
+    
     def add_text_bubbles(
         self,
         image_base64: str,
@@ -128,56 +352,9 @@ class LayoutService:
         img = Image.open(BytesIO(img_data))
         draw = ImageDraw.Draw(img)
         
-        # 尝试加载字体
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", self.default_font_size)
-        except:
-            font = ImageFont.load_default()
-        
         # 绘制气泡
-        for panel_text in text_layer.get("panels", []):
-            for bubble in panel_text.get("bubbles", []):
-                x = bubble.get("x", 0)
-                y = bubble.get("y", 0)
-                width = bubble.get("width", 100)
-                height = bubble.get("height", 50)
-                text = bubble.get("text", "")
-                bubble_type = bubble.get("type", "speech")
-                
-                # 绘制气泡背景
-                if bubble_type == "speech":
-                    # 圆角矩形
-                    draw.rounded_rectangle(
-                        [x, y, x + width, y + height],
-                        radius=10,
-                        fill="white",
-                        outline="black",
-                        width=2,
-                    )
-                elif bubble_type == "thought":
-                    # 云朵形状（简化为椭圆）
-                    draw.ellipse(
-                        [x, y, x + width, y + height],
-                        fill="white",
-                        outline="black",
-                        width=2,
-                    )
-                elif bubble_type == "narration":
-                    # 矩形
-                    draw.rectangle(
-                        [x, y, x + width, y + height],
-                        fill="lightyellow",
-                        outline="black",
-                        width=1,
-                    )
-                elif bubble_type == "sfx":
-                    # 拟声词，直接绘制文字
-                    pass
-                
-                # 绘制文字
-                text_x = x + self.bubble_padding
-                text_y = y + self.bubble_padding
-                draw.text((text_x, text_y), text, fill="black", font=font)
+        for bubble in self._collect_bubbles(text_layer):
+            self._draw_bubble(draw, bubble)
         
         # 转为base64
         buffer = BytesIO()
@@ -186,26 +363,79 @@ class LayoutService:
     
     def export_to_pdf(
         self,
-        pages: List[str],  # base64 images
+        page_paths: List[str],
         output_path: str,
     ) -> None:
-        """导出为PDF"""
-        images = []
-        
-        for page_base64 in pages:
-            img_data = base64.b64decode(page_base64)
-            img = Image.open(BytesIO(img_data))
-            if img.mode == "RGBA":
-                img = img.convert("RGB")
-            images.append(img)
-        
-        if images:
-            images[0].save(
-                output_path,
-                save_all=True,
-                append_images=images[1:],
-                format="PDF",
-            )
+        """导出为PDF：逐页从磁盘读取并写出，JPEG 页面不重新编码"""
+        if not page_paths:
+            return
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            write_pdf(page_paths, f)
+        os.replace(tmp_path, output_path)
+
+
+def export_to_cbz(page_paths: List[str], output_path: str) -> None:
+    """把页面文件按顺序打包为 CBZ（图像已压缩，不再压缩）"""
+    with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for index, path in enumerate(page_paths):
+            extension = os.path.splitext(path)[1]
+            archive.write(path, f"{index + 1:03d}{extension}")
+
+
+def _write_panel_sources(panel_images: List[dict], directory: str) -> Dict[str, str]:
+    """各分镜图像的文件路径 {panel_id: 路径}，base64 图像解码后写入目录"""
+    sources = {}
+    for index, panel in enumerate(panel_images):
+        panel_id = panel.get("panel_id")
+        if not panel_id or not panel.get("image") or panel_id in sources:
+            continue
+        if is_artifact(panel["image"]):
+            sources[panel_id] = get_artifact_store().path(panel["image"])
+            continue
+        path = os.path.join(directory, f"panel_{index}")
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(panel["image"]))
+        sources[panel_id] = path
+    return sources
+
+
+def _page_executor(jobs: int) -> Executor:
+    """页面渲染执行器
+
+    Celery prefork 的工作进程是守护进程，不能再创建子进程，此时退回线程池（PIL 缩放时释放 GIL）。
+    """
+    workers = max(1, min(jobs, settings.LAYOUT_PAGE_WORKERS or os.cpu_count() or 1))
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _render_page(job: dict) -> str:
+    """渲染一页并写入文件（在进程池中执行）"""
+    service = LayoutService()
+    page = Image.new("RGB", (job["width"], job["height"]), color="white")
+    draw = None
+    
+    for placement in job["placements"]:
+        panel_id = placement["panel_id"]
+        path = job["sources"].get(panel_id)
+        if path:
+            try:
+                img = service._open_panel(path, (placement["width"], placement["height"]))
+                page.paste(img, (placement["x"], placement["y"]))
+            except Exception as e:
+                print(f"Failed to process panel {panel_id}: {e}")
+        
+        for bubble in job["bubbles"].get(panel_id, []):
+            if draw is None:
+                draw = ImageDraw.Draw(page)
+            service._draw_bubble(draw, bubble, offset_x=placement["x"], offset_y=placement["y"])
+    
+    tmp_path = f"{job['output']}.tmp"
+    page.save(tmp_path, format=job["format"].upper(), **({"quality": 92} if job["format"] == "jpeg" else {}))
+    os.replace(tmp_path, job["output"])
+    return job["output"]
 
 
 @shared_task(bind=True)
@@ -218,24 +448,40 @@ def composite_chapter_task(
     format: Literal["webtoon", "page"] = "webtoon",
     text_layer: Optional[dict] = None,
 ):
-    """Celery任务：合成章节"""
+    """Celery任务：合成章节
+    
+    panel_images 的 image 为产物引用（generate_panels_batch_task 的结果），分镜图像在合成时按需从存储读取；
+    也兼容 base64。
+    条漫按条带流式写入 {DATA_DIR}/projects/{project_id}/chapters/{chapter_id}/webtoon.png，
+    文字气泡在对应条带上绘制，返回文件路径而不是 base64；
+    页漫每页并行渲染为 pages/page_NNN.png，返回页面列表，可用于导出 PDF / CBZ。
+    """
     service = LayoutService()
     
     if format == "webtoon":
         layout = service.calculate_webtoon_layout(panels)
-        result = service.composite_webtoon(panel_images, layout)
-    else:
-        # 页漫需要额外处理
-        pages_layout = service.calculate_page_layout(panels)
-        # TODO: 实现页漫合成
-        result = None
-    
-    # 添加文字气泡
-    if text_layer and result:
-        result = service.add_text_bubbles(result, text_layer)
+        path = chapter_output_path(project_id, chapter_id, "webtoon.png")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            width, height = service.render_webtoon(panel_images, layout, f, text_layer=text_layer)
+        os.replace(tmp_path, path)
+        return {
+            "chapter_id": chapter_id,
+            "format": format,
+            "path": path,
+            "width": width,
+            "height": height,
+        }
     
+    pages_layout = service.calculate_page_layout(panels)
+    pages = service.render_pages(
+        panel_images,
+        pages_layout,
+        chapter_output_path(project_id, chapter_id, "pages"),
+        text_layer=text_layer,
+    )
     return {
         "chapter_id": chapter_id,
-        "image": result,
         "format": format,
+        "pages": pages,
     }
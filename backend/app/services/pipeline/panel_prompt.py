@@ -0,0 +1,163 @@
+"""分镜出图提示词的预编译上下文
+
+同一项目（故事圣经版本）的所有分镜共用的部分只计算一次：风格关键词、角色ID索引和角色描述片段、
+镜头类型映射，构建单个分镜提示词时只需查表拼接。
+角色描述片段优先使用 Character.prompt_fragments，保存故事圣经时为空或已过期的片段按外貌重新生成并写回。
+编译结果按 项目ID + 内容哈希 缓存，故事圣经变化后自动重新编译。缓存在 Celery worker 进程内，
+故事圣经在 API 进程中修改后，下一个任务的内容哈希随之变化，无需跨进程通知。
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+PANEL_PROMPT_TEMPLATE = """{style_keywords},
+{scene_description},
+{character_descriptions},
+{action_description},
+{camera_type} shot,
+{composition},
+{mood},
+masterpiece, best quality"""
+
+# 镜头类型映射
+CAMERA_MAP = {
+    "wide": "wide angle",
+    "medium": "medium shot",
+    "close_up": "close-up",
+    "extreme_close_up": "extreme close-up",
+    "bird_eye": "bird's eye view",
+    "worm_eye": "worm's eye view",
+}
+
+MAX_CACHED_CONTEXTS = 64
+
+
+def character_descriptor(character: dict) -> str:
+    """按外貌生成角色描述片段"""
+    appearance = character.get("appearance") or {}
+    char_desc = f"{character.get('name')}, "
+    char_desc += f"{appearance.get('hair', '')}, "
+    char_desc += ", ".join((appearance.get("clothing") or [])[:2])
+    return char_desc
+
+
+def style_keywords(style_guide: dict) -> str:
+    """风格关键词"""
+    return (
+        f"{style_guide.get('art_style', 'manga')}, "
+        f"{style_guide.get('line_style', 'clean lines')}, "
+        f"{style_guide.get('coloring', 'flat colors')}"
+    )
+
+
+class PanelPromptContext:
+    """编译后的分镜提示词上下文"""
+
+    __slots__ = ("style_keywords", "descriptors")
+
+    def __init__(self, characters: Sequence[dict], style_guide: dict):
+        self.style_keywords = style_keywords(style_guide)
+        # 角色ID -> 描述片段；同一ID出现多次时以第一个为准
+        self.descriptors: Dict[str, str] = {}
+        for char in characters:
+            char_id = char.get("id")
+            if char_id is None or char_id in self.descriptors:
+                continue
+            fragments = char.get("prompt_fragments")
+            self.descriptors[char_id] = ", ".join(fragments) if fragments else character_descriptor(char)
+
+    def build(self, panel: dict) -> str:
+        """构建分镜提示词"""
+        descriptors = self.descriptors
+        return PANEL_PROMPT_TEMPLATE.format(
+            style_keywords=self.style_keywords,
+            scene_description=f"{panel.get('location', '')}, {panel.get('time', '')}",
+            character_descriptions=", ".join(
+                descriptors[c] for c in panel.get("characters", []) if c in descriptors
+            ),
+            action_description=f"{panel.get('action', '')}, {panel.get('expression', '')}",
+            camera_type=CAMERA_MAP.get(panel.get("camera", "medium"), "medium shot"),
+            composition=panel.get("composition", ""),
+            mood=panel.get("mood", ""),
+        )
+
+
+def context_version(characters: Sequence[dict], style_guide: dict) -> str:
+    """故事圣经中影响出图提示词的内容的哈希"""
+    raw = json.dumps(
+        [
+            [
+                [c.get("id"), c.get("name"), c.get("appearance"), c.get("prompt_fragments")]
+                for c in characters
+            ],
+            style_guide,
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+_contexts: "OrderedDict[str, tuple]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_panel_prompt_context(
+    characters: Sequence[dict],
+    style_guide: dict,
+    project_id: Optional[str] = None,
+) -> PanelPromptContext:
+    """获取编译后的上下文
+
+    Args:
+        characters: 角色列表
+        style_guide: 风格指南
+        project_id: 项目ID，指定时按项目缓存，内容变化后重新编译
+    """
+    if project_id is None:
+        return PanelPromptContext(characters, style_guide)
+
+    version = context_version(characters, style_guide)
+    with _lock:
+        entry = _contexts.get(project_id)
+        if entry and entry[0] == version:
+            _contexts.move_to_end(project_id)
+            return entry[1]
+
+    context = PanelPromptContext(characters, style_guide)
+    with _lock:
+        _contexts[project_id] = (version, context)
+        _contexts.move_to_end(project_id)
+        while len(_contexts) > MAX_CACHED_CONTEXTS:
+            _contexts.popitem(last=False)
+    return context
+
+
+def generated_fragments(characters: Sequence) -> set:
+    """角色当前按外貌生成的描述片段集合（Character 模型列表）"""
+    return {
+        character_descriptor({"name": c.name, "appearance": c.appearance}) for c in characters
+    }
+
+
+def refresh_prompt_fragments(characters: Sequence, generated: Optional[set] = None) -> None:
+    """为角色写入描述片段（Character.prompt_fragments）
+
+    片段为空，或片段是保存前按外貌生成的（名称/外貌修改后已过期）时重新生成；
+    用户或预设提供的片段保持不变。
+
+    Args:
+        characters: Character 模型列表
+        generated: 保存前各角色的 generated_fragments()
+    """
+    generated = generated or set()
+    for char in characters:
+        fragments = char.prompt_fragments or []
+        if not fragments or (len(fragments) == 1 and fragments[0] in generated):
+            char.prompt_fragments = [
+                character_descriptor({"name": char.name, "appearance": char.appearance})
+            ]
@@ -1,10 +1,14 @@
 """Step 4: 分镜脚本生成"""
 
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from celery import shared_task
+from pydantic import ValidationError
 
-from app.services.ai import OpenAIAdapter, ClaudeAdapter
+from app.services.ai import BaseAIAdapter, OpenAIAdapter, ClaudeAdapter
+from app.services.ai.response_cache import discard_cached_response, parse_or_discard, with_response_cache
+from app.core.json_stream import JSONStreamParser, iter_json_objects, match_path
 from app.schemas.storyboard import Scene, Panel, StoryboardResponse
+from app.services.pipeline.prompt_context import PromptContextBuilder, compact_json, prune
 
 
 PANEL_SCRIPT_SYSTEM_PROMPT = """你是一个专业的漫画分镜师。
@@ -12,16 +16,11 @@ PANEL_SCRIPT_SYSTEM_PROMPT = """你是一个专业的漫画分镜师。
 
 输出必须是有效的JSON格式。每个分镜(Panel)都要包含完整的视觉描述。"""
 
-PANEL_SCRIPT_PROMPT_TEMPLATE = """章节信息：
-{chapter_info}
+# 分镜需要的角色字段
+PANEL_SCRIPT_CHARACTER_FIELDS = ("id", "name", "appearance", "personality")
 
-角色设定：
-{characters}
-
-世界观：
-{world}
-
-请为这一章生成分镜脚本，要求：
+# 每章变化的部分（章节信息、格数）放在最后
+PANEL_SCRIPT_PROMPT_TEMPLATE = """请为下面的章节生成分镜脚本，要求：
 
 1. **场景拆分**（Scene）：
    - 切换地点/时间就算一个新场景
@@ -43,8 +42,6 @@ PANEL_SCRIPT_PROMPT_TEMPLATE = """章节信息：
    - composition: 构图说明（主体位置、视觉重点）
    - continuity_notes: 一致性备注
 
-预计格数：{estimated_panels}
-
 请用JSON格式输出：
 {{
     "scenes": [
@@ -58,17 +55,52 @@ PANEL_SCRIPT_PROMPT_TEMPLATE = """章节信息：
             "panels": [...]
         }}
     ]
-}}"""
+}}
+
+预计格数：{estimated_panels}
+
+章节信息：
+{chapter_info}"""
+
+
+# 流式解析时提取的对象路径
+PANEL_PATH = ("scenes", "*", "panels", "*")
+SCENE_PATH = ("scenes", "*")
 
 
 class PanelScriptService:
     """分镜脚本服务"""
     
-    def __init__(self, use_claude: bool = False):
-        if use_claude:
-            self.ai = ClaudeAdapter()
+    def __init__(self, use_claude: bool = False, ai: Optional[BaseAIAdapter] = None):
+        if ai:
+            self.ai = ai
+        elif use_claude:
+            self.ai = with_response_cache(ClaudeAdapter())
         else:
-            self.ai = OpenAIAdapter()
+            self.ai = with_response_cache(OpenAIAdapter())
+    
+    def _build_prompt(
+        self,
+        chapter_info: dict,
+        characters: List[dict],
+        world: dict,
+        estimated_panels: int,
+    ) -> Tuple[str, str]:
+        """构建分镜提示词，返回 (固定上下文, 提示词)
+
+        固定上下文（角色、世界观）同一项目的所有章节相同，放在前面以命中提示词缓存。
+        """
+        context = (
+            PromptContextBuilder("panel_script", getattr(self.ai, "model_name", None))
+            .add("角色设定", characters, PANEL_SCRIPT_CHARACTER_FIELDS, priority=1)
+            .add("世界观", world)
+            .build()
+        )
+        prompt = PANEL_SCRIPT_PROMPT_TEMPLATE.format(
+            chapter_info=compact_json(prune(chapter_info)),
+            estimated_panels=estimated_panels,
+        )
+        return context, prompt
     
     async def generate_panels(
         self,
@@ -78,23 +110,82 @@ class PanelScriptService:
         estimated_panels: int = 12,
     ) -> StoryboardResponse:
         """生成分镜脚本"""
-        import json
+        context, prompt = self._build_prompt(chapter_info, characters, world, estimated_panels)
         
-        prompt = PANEL_SCRIPT_PROMPT_TEMPLATE.format(
-            chapter_info=json.dumps(chapter_info, ensure_ascii=False, indent=2),
-            characters=json.dumps(characters, ensure_ascii=False, indent=2),
-            world=json.dumps(world, ensure_ascii=False, indent=2),
-            estimated_panels=estimated_panels,
+        response = await self.ai.generate_text(
+            prompt=prompt,
+            system_prompt=PANEL_SCRIPT_SYSTEM_PROMPT,
+            max_tokens=8192,
+            temperature=0.7,
+            context=context,
         )
         
-        response = await self.ai.generate_text(
+        return await parse_or_discard(
+            self.ai,
+            response,
+            self.parse_response,
+            prompt,
+            PANEL_SCRIPT_SYSTEM_PROMPT,
+            max_tokens=8192,
+            temperature=0.7,
+            context=context,
+        )
+    
+    async def stream_panels(
+        self,
+        chapter_info: dict,
+        characters: List[dict],
+        world: dict,
+        estimated_panels: int = 12,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """流式生成分镜脚本，每个分镜的 JSON 对象闭合时立即产出，下游可提前开始出图
+
+        产出 (事件, 数据)：
+        - ("panel", Panel)：一个分镜
+        - ("invalid", {"path", "error"})：不符合 Panel 结构的分镜，已跳过
+        - ("scene", Scene)：一个场景（只包含有效分镜）
+        - ("storyboard", StoryboardResponse)：完整分镜脚本，最后产出
+        """
+        context, prompt = self._build_prompt(chapter_info, characters, world, estimated_panels)
+        chunks = self.ai.generate_text_stream(
             prompt=prompt,
             system_prompt=PANEL_SCRIPT_SYSTEM_PROMPT,
             max_tokens=8192,
             temperature=0.7,
+            context=context,
         )
         
-        # 解析JSON响应
+        parser = JSONStreamParser([PANEL_PATH, SCENE_PATH])
+        panels: Dict[int, List[Panel]] = {}
+        scenes: List[Scene] = []
+        async for path, value in iter_json_objects(chunks, parser.patterns, parser):
+            scene_index = path[1]
+            try:
+                if match_path(path, PANEL_PATH):
+                    panel = Panel(**value)
+                    panels.setdefault(scene_index, []).append(panel)
+                    yield "panel", panel
+                else:
+                    scene = Scene(**{**value, "panels": panels.pop(scene_index, [])})
+                    scenes.append(scene)
+                    yield "scene", scene
+            except ValidationError as e:
+                yield "invalid", {"path": list(path), "error": str(e)}
+        
+        if not parser.finished:
+            # 输出被截断或不是 JSON，不保留在缓存中
+            await discard_cached_response(
+                self.ai, prompt, PANEL_SCRIPT_SYSTEM_PROMPT, max_tokens=8192, temperature=0.7,
+                context=context,
+            )
+            raise ValueError("Incomplete JSON in panel script response")
+        
+        yield "storyboard", StoryboardResponse(scenes=scenes)
+    
+    def parse_response(self, response: str) -> StoryboardResponse:
+        """解析模型输出"""
+        import json
+        
         try:
             json_start = response.find('{')
             json_end = response.rfind('}') + 1
@@ -134,3 +225,93 @@ def generate_panel_script_task(
     )
     
     return result.model_dump()
+
+
+async def generate_panels_with_roughs(
+    service: PanelScriptService,
+    image_service: Any,
+    chapter_info: dict,
+    characters: List[dict],
+    world: dict,
+    style_guide: dict,
+    estimated_panels: int = 12,
+) -> dict:
+    """边生成分镜脚本边出草图：每个分镜解析完成后立即提交草图生成
+    
+    同时执行的草图请求数不超过后端的并发上限（与 ImageGenService.stream_batch 相同）。
+
+    Returns:
+        {"storyboard": 分镜脚本, "rough_images": {panel_id: 草图或 None}}
+    """
+    import asyncio
+    from app.core.config import settings
+    
+    semaphore = asyncio.Semaphore(
+        getattr(image_service.image_ai, "max_concurrency", None) or settings.IMAGE_MAX_CONCURRENCY
+    )
+    
+    async def rough(panel: dict) -> Optional[str]:
+        async with semaphore:
+            return await image_service.generate_rough(panel, characters, style_guide)
+    
+    pending: Dict[str, asyncio.Future] = {}
+    storyboard: Optional[StoryboardResponse] = None
+    try:
+        async for event, value in service.stream_panels(
+            chapter_info, characters, world, estimated_panels
+        ):
+            if event == "panel":
+                pending[value.id] = asyncio.ensure_future(rough(value.model_dump()))
+            elif event == "storyboard":
+                storyboard = value
+    except BaseException:
+        for task in pending.values():
+            task.cancel()
+        raise
+    
+    results = await asyncio.gather(*pending.values(), return_exceptions=True)
+    rough_images = {}
+    for panel_id, result in zip(pending.keys(), results):
+        if isinstance(result, BaseException):
+            print(f"Failed to generate rough image for panel {panel_id}: {result}")
+            result = None
+        rough_images[panel_id] = result
+    
+    return {"storyboard": storyboard.model_dump(), "rough_images": rough_images}
+
+
+@shared_task(bind=True)
+def generate_panel_script_with_roughs_task(
+    self,
+    project_id: str,
+    chapter_id: str,
+    chapter_info: dict,
+    characters: List[dict],
+    world: dict,
+    style_guide: dict,
+    estimated_panels: int,
+):
+    """Celery任务：生成分镜脚本，同时为已解析出的分镜生成草图（草图为产物引用）"""
+    import asyncio
+    from app.services.ai.factory import AIAdapterFactory
+    from app.services.pipeline.image_gen import ImageGenService
+    
+    service = PanelScriptService()
+    image_service = ImageGenService(
+        image_ai=AIAdapterFactory.get_default_image_backend(),
+        project_id=project_id,
+        store_artifacts=True,
+    )
+    loop = asyncio.get_event_loop()
+    
+    return loop.run_until_complete(
+        generate_panels_with_roughs(
+            service,
+            image_service,
+            chapter_info=chapter_info,
+            characters=characters,
+            world=world,
+            style_guide=style_guide,
+            estimated_panels=estimated_panels,
+        )
+    )
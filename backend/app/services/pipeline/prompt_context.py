@@ -0,0 +1,196 @@
+"""提示词上下文构建
+
+把故事圣经、大纲等结构化数据以紧凑形式写入提示词：
+- 去掉 null / 空字符串 / 空数组 / 空对象，只保留当前步骤需要的字段
+- JSON 不缩进、不加多余空格
+- 按模型计算 token（安装了 tiktoken 时精确计算，否则估算），超出步骤预算时按固定顺序截断
+- 记录与原先缩进 JSON 相比节省的 token 数
+"""
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.config import settings
+from app.services.ai.rate_limit import estimate_tokens
+
+
+def prune(value: Any) -> Any:
+    """递归去掉空值"""
+    if isinstance(value, dict):
+        result = {}
+        for k, v in value.items():
+            v = prune(v)
+            if v not in (None, "", [], {}):
+                result[k] = v
+        return result
+    if isinstance(value, (list, tuple)):
+        return [v for v in (prune(item) for item in value) if v not in (None, "", [], {})]
+    return value
+
+
+def select_fields(value: Any, fields: Optional[Sequence[str]]) -> Any:
+    """只保留指定字段；value 为列表时作用于每一项"""
+    if not fields:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, fields) for item in value]
+    if isinstance(value, dict):
+        return {k: value[k] for k in fields if k in value}
+    return value
+
+
+def compact_json(value: Any) -> str:
+    """紧凑 JSON"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+@lru_cache(maxsize=16)
+def _get_encoding(model_name: str):
+    """获取模型对应的 tiktoken 编码，未安装或不支持时返回 None"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # OpenAI 兼容模型多数使用相近的 BPE，按 cl100k_base 计算
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """计算 token 数：OpenAI 系模型且安装了 tiktoken 时精确计算，其余估算"""
+    if not text:
+        return 0
+    if model_name and not model_name.startswith("claude"):
+        encoding = _get_encoding(model_name)
+        if encoding is not None:
+            return len(encoding.encode(text))
+    return estimate_tokens(text)
+
+
+class _Section:
+    __slots__ = ("title", "value", "original", "priority")
+
+    def __init__(self, title: str, value: Any, original: Any, priority: int):
+        self.title = title
+        self.value = value
+        self.original = original
+        self.priority = priority
+
+    def render(self) -> str:
+        text = self.value if isinstance(self.value, str) else compact_json(self.value)
+        return f"{self.title}：\n{text}"
+
+    def render_original(self) -> str:
+        text = self.original if isinstance(self.original, str) else json.dumps(
+            self.original, ensure_ascii=False, indent=2
+        )
+        return f"{self.title}：\n{text}"
+
+    def shrink(self, over_tokens: int, total_tokens: int) -> bool:
+        """缩减一步，无法再缩减时返回 False
+
+        列表去掉最后一项，对象去掉最后一个字段，文本按超出比例截掉末尾。
+        """
+        if isinstance(self.value, list) and self.value:
+            self.value = self.value[:-1]
+            return True
+        if isinstance(self.value, dict) and self.value:
+            self.value = dict(list(self.value.items())[:-1])
+            return True
+        if isinstance(self.value, str) and self.value:
+            keep = int(len(self.value) * (1 - over_tokens / max(total_tokens, 1))) - 1
+            self.value = self.value[:max(keep, 0)]
+            return True
+        return False
+
+    @property
+    def empty(self) -> bool:
+        return self.value in (None, "", [], {})
+
+
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+class PromptContextBuilder:
+    """按步骤构建紧凑的提示词上下文"""
+
+    def __init__(self, step: str, model_name: Optional[str] = None, budget: Optional[int] = None):
+        """初始化
+
+        Args:
+            step: 步骤名称，用于预算配置和统计
+            model_name: 模型名称，用于计算 token
+            budget: token 预算，不指定时取 PROMPT_CONTEXT_BUDGETS[step]
+        """
+        self.step = step
+        self.model_name = model_name
+        self.budget = budget if budget is not None else settings.PROMPT_CONTEXT_BUDGETS.get(step)
+        self._sections: List[_Section] = []
+
+    def add(
+        self,
+        title: str,
+        value: Any,
+        fields: Optional[Sequence[str]] = None,
+        priority: int = 0,
+    ) -> "PromptContextBuilder":
+        """添加一段上下文
+
+        Args:
+            title: 段落标题
+            value: 数据（dict / list / str）
+            fields: 只保留的字段，value 为列表时作用于每一项
+            priority: 超出预算时优先级低的段落先截断
+        """
+        self._sections.append(_Section(title, prune(select_fields(value, fields)), value, priority))
+        return self
+
+    def _render(self) -> str:
+        return "\n\n".join(s.render() for s in self._sections if not s.empty)
+
+    def build(self) -> str:
+        """生成上下文文本"""
+        text = self._render()
+        tokens = count_tokens(text, self.model_name)
+
+        truncated = False
+        if self.budget:
+            # 优先级低的先截断，同优先级后添加的先截断
+            order = sorted(
+                range(len(self._sections)),
+                key=lambda i: (self._sections[i].priority, -i),
+            )
+            for index in order:
+                section = self._sections[index]
+                while tokens > self.budget and section.shrink(tokens - self.budget, tokens):
+                    truncated = True
+                    text = self._render()
+                    tokens = count_tokens(text, self.model_name)
+                if tokens <= self.budget:
+                    break
+
+        baseline = count_tokens(
+            "\n\n".join(s.render_original() for s in self._sections), self.model_name
+        )
+        self._record(tokens, baseline - tokens, truncated)
+        return text
+
+    def _record(self, tokens: int, saved: int, truncated: bool) -> None:
+        """记录统计并输出日志"""
+        stats = _stats.setdefault(self.step, {"calls": 0, "tokens": 0, "tokens_saved": 0, "truncated": 0})
+        stats["calls"] += 1
+        stats["tokens"] += tokens
+        stats["tokens_saved"] += saved
+        stats["truncated"] += int(truncated)
+        print(
+            f"Prompt context {self.step}: {tokens} tokens, saved {saved}"
+            + (f", truncated to budget {self.budget}" if truncated else "")
+        )
+
+
+def get_prompt_context_stats() -> Dict[str, Dict[str, int]]:
+    """当前进程中各步骤的上下文 token 统计"""
+    return {step: dict(stats) for step, stats in _stats.items()}
@@ -3,7 +3,13 @@
 from typing import Optional
 from celery import shared_task
 
-from app.services.ai import OpenAIAdapter, ClaudeAdapter
+from app.services.ai import BaseAIAdapter, OpenAIAdapter, ClaudeAdapter
+from app.services.ai.response_cache import (
+    DiscardableStream,
+    discardable_stream,
+    parse_or_discard,
+    with_response_cache,
+)
 from app.schemas.story_bible import StoryBibleResponse, Character, WorldSetting, StyleGuide
 
 
@@ -54,34 +60,31 @@ STORY_BIBLE_PROMPT_TEMPLATE = """故事梗概：{story_input}
 class StoryBibleService:
     """世界观建档服务"""
     
-    def __init__(self, use_claude: bool = False):
-        if use_claude:
-            self.ai = ClaudeAdapter()
+    def __init__(self, use_claude: bool = False, ai: Optional[BaseAIAdapter] = None):
+        if ai:
+            self.ai = ai
+        elif use_claude:
+            self.ai = with_response_cache(ClaudeAdapter())
         else:
-            self.ai = OpenAIAdapter()
+            self.ai = with_response_cache(OpenAIAdapter())
     
-    async def generate(
+    def _build_prompt(
         self,
         story_input: str,
-        style: str = "manga",
-        tone: str = "comedy",
-        max_characters: int = 5,
-    ) -> StoryBibleResponse:
-        """生成Story Bible"""
-        prompt = STORY_BIBLE_PROMPT_TEMPLATE.format(
+        style: str,
+        tone: str,
+        max_characters: int,
+    ) -> str:
+        """构建生成提示词"""
+        return STORY_BIBLE_PROMPT_TEMPLATE.format(
             story_input=story_input,
             style=style,
             tone=tone,
             max_characters=max_characters,
         )
-        
-        response = await self.ai.generate_text(
-            prompt=prompt,
-            system_prompt=STORY_BIBLE_SYSTEM_PROMPT,
-            temperature=0.8,
-        )
-        
-        # 解析JSON响应
+    
+    def parse_response(self, response: str) -> StoryBibleResponse:
+        """解析模型输出"""
         import json
         try:
             # 提取JSON部分
@@ -95,6 +98,43 @@ class StoryBibleService:
             raise ValueError(f"Failed to parse Story Bible response: {e}")
         
         raise ValueError("No valid JSON found in response")
+    
+    async def generate(
+        self,
+        story_input: str,
+        style: str = "manga",
+        tone: str = "comedy",
+        max_characters: int = 5,
+    ) -> StoryBibleResponse:
+        """生成Story Bible"""
+        prompt = self._build_prompt(story_input, style, tone, max_characters)
+        
+        response = await self.ai.generate_text(
+            prompt=prompt,
+            system_prompt=STORY_BIBLE_SYSTEM_PROMPT,
+            temperature=0.8,
+        )
+        
+        return await parse_or_discard(
+            self.ai, response, self.parse_response, prompt, STORY_BIBLE_SYSTEM_PROMPT, temperature=0.8
+        )
+    
+    def generate_stream(
+        self,
+        story_input: str,
+        style: str = "manga",
+        tone: str = "comedy",
+        max_characters: int = 5,
+    ) -> DiscardableStream:
+        """流式生成Story Bible，返回增量文本，完整结果用 parse_response 解析，解析失败时调用 discard"""
+        prompt = self._build_prompt(story_input, style, tone, max_characters)
+        
+        return discardable_stream(
+            self.ai,
+            prompt=prompt,
+            system_prompt=STORY_BIBLE_SYSTEM_PROMPT,
+            temperature=0.8,
+        )
 
 
 @shared_task(bind=True)
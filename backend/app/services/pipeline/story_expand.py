@@ -1,10 +1,17 @@
 """Step 2: 故事扩写"""
 
-from typing import Literal
+from typing import Literal, Optional, Tuple
 from celery import shared_task
 
-from app.services.ai import OpenAIAdapter, ClaudeAdapter
+from app.services.ai import BaseAIAdapter, OpenAIAdapter, ClaudeAdapter
+from app.services.ai.response_cache import (
+    DiscardableStream,
+    discardable_stream,
+    parse_or_discard,
+    with_response_cache,
+)
 from app.schemas.story import StoryOutlineResponse, Beat
+from app.services.pipeline.prompt_context import PromptContextBuilder
 
 
 STORY_EXPAND_SYSTEM_PROMPT = """你是一个专业的故事编剧。
@@ -18,12 +25,10 @@ STORY_EXPAND_SYSTEM_PROMPT = """你是一个专业的故事编剧。
     "outline": [结构化大纲数组]
 }"""
 
-STORY_EXPAND_PROMPT_TEMPLATE = """故事梗概：{story_input}
+# 扩写需要的角色字段（外貌等视觉字段在出图阶段使用）
+STORY_EXPAND_CHARACTER_FIELDS = ("id", "name", "personality", "motivation", "relationships")
 
-世界观设定：
-{story_bible}
-
-请将这个故事扩写为{length}版本，并生成结构化大纲。
+STORY_EXPAND_PROMPT_TEMPLATE = """请将下面的故事梗概扩写为{length}版本，并生成结构化大纲。
 
 要求：
 1. **故事版本**：
@@ -43,52 +48,107 @@ STORY_EXPAND_PROMPT_TEMPLATE = """故事梗概：{story_input}
    - Beat 4: 高潮对抗
    - Beat 5: 结局/钩子
 
-请用JSON格式输出。"""
+请用JSON格式输出。
+
+故事梗概：{story_input}"""
 
 
 class StoryExpandService:
     """故事扩写服务"""
     
-    def __init__(self, use_claude: bool = False):
-        if use_claude:
-            self.ai = ClaudeAdapter()
+    def __init__(self, use_claude: bool = False, ai: Optional[BaseAIAdapter] = None):
+        if ai:
+            self.ai = ai
+        elif use_claude:
+            self.ai = with_response_cache(ClaudeAdapter())
         else:
-            self.ai = OpenAIAdapter()
+            self.ai = with_response_cache(OpenAIAdapter())
     
-    async def expand(
+    def _build_prompt(
         self,
         story_input: str,
         story_bible: dict,
-        length: Literal["short", "mid", "long"] = "short",
-    ) -> StoryOutlineResponse:
-        """扩写故事"""
-        import json
-        
+        length: str,
+    ) -> Tuple[str, str]:
+        """构建扩写提示词，返回 (固定上下文, 提示词)
+
+        固定上下文（故事圣经）同一项目的多次扩写相同，放在前面以命中提示词缓存。
+        """
+        context = (
+            PromptContextBuilder("story_expand", getattr(self.ai, "model_name", None))
+            .add("角色", story_bible.get("characters", []), STORY_EXPAND_CHARACTER_FIELDS, priority=2)
+            .add("世界观", story_bible.get("world", {}), priority=1)
+            .add("连续性规则", story_bible.get("continuity_rules", []))
+            .build()
+        )
         prompt = STORY_EXPAND_PROMPT_TEMPLATE.format(
             story_input=story_input,
-            story_bible=json.dumps(story_bible, ensure_ascii=False, indent=2),
             length=length,
         )
+        return context, prompt
+    
+    def parse_response(self, response: str, project_id: str = "") -> StoryOutlineResponse:
+        """解析模型输出"""
+        import json
         
-        response = await self.ai.generate_text(
-            prompt=prompt,
-            system_prompt=STORY_EXPAND_SYSTEM_PROMPT,
-            max_tokens=8192,
-            temperature=0.7,
-        )
-        
-        # 解析JSON响应
         try:
             json_start = response.find('{')
             json_end = response.rfind('}') + 1
             if json_start != -1 and json_end > json_start:
                 json_str = response[json_start:json_end]
                 data = json.loads(json_str)
-                return StoryOutlineResponse(**data)
+                return StoryOutlineResponse(**{"id": "", "project_id": project_id, **data})
         except (json.JSONDecodeError, ValueError) as e:
             raise ValueError(f"Failed to parse story response: {e}")
         
         raise ValueError("No valid JSON found in response")
+    
+    async def expand(
+        self,
+        story_input: str,
+        story_bible: dict,
+        length: Literal["short", "mid", "long"] = "short",
+        project_id: str = "",
+    ) -> StoryOutlineResponse:
+        """扩写故事"""
+        context, prompt = self._build_prompt(story_input, story_bible, length)
+        
+        response = await self.ai.generate_text(
+            prompt=prompt,
+            system_prompt=STORY_EXPAND_SYSTEM_PROMPT,
+            max_tokens=8192,
+            temperature=0.7,
+            context=context,
+        )
+        
+        return await parse_or_discard(
+            self.ai,
+            response,
+            lambda text: self.parse_response(text, project_id),
+            prompt,
+            STORY_EXPAND_SYSTEM_PROMPT,
+            max_tokens=8192,
+            temperature=0.7,
+            context=context,
+        )
+    
+    def expand_stream(
+        self,
+        story_input: str,
+        story_bible: dict,
+        length: Literal["short", "mid", "long"] = "short",
+    ) -> DiscardableStream:
+        """流式扩写故事，返回增量文本，完整结果用 parse_response 解析，解析失败时调用 discard"""
+        context, prompt = self._build_prompt(story_input, story_bible, length)
+        
+        return discardable_stream(
+            self.ai,
+            prompt=prompt,
+            system_prompt=STORY_EXPAND_SYSTEM_PROMPT,
+            max_tokens=8192,
+            temperature=0.7,
+            context=context,
+        )
 
 
 @shared_task(bind=True)
@@ -104,6 +164,7 @@ def expand_story_task(self, project_id: str, story_input: str, story_bible: dict
             story_input=story_input,
             story_bible=story_bible,
             length=length,
+            project_id=project_id,
         )
     )
     
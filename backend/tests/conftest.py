@@ -0,0 +1,10 @@
+"""测试环境：导入 app 之前设置配置，不连接真实的数据库和 Redis，数据写入临时目录"""
+
+import os
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="man-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_data_dir, 'test.db')}")
+os.environ.setdefault("DATA_DIR", _data_dir)
+os.environ.setdefault("IMAGE_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
@@ -0,0 +1,47 @@
+"""角色表情网格切分测试"""
+
+import base64
+from io import BytesIO
+
+from PIL import Image
+
+from app.services.pipeline.consistency import slice_grid
+
+
+COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255), (255, 0, 255)]
+
+
+def _atlas(cols: int, rows: int, cell: int) -> str:
+    atlas = Image.new("RGB", (cols * cell, rows * cell))
+    for index, color in enumerate(COLORS[:cols * rows]):
+        row, col = divmod(index, cols)
+        atlas.paste(color, (col * cell, row * cell, (col + 1) * cell, (row + 1) * cell))
+    buffer = BytesIO()
+    atlas.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _decode(image_base64: str) -> Image.Image:
+    return Image.open(BytesIO(base64.b64decode(image_base64)))
+
+
+def test_row_major_order():
+    crops = slice_grid(_atlas(3, 2, 16), cols=3, rows=2, count=6)
+    assert len(crops) == 6
+    for crop, color in zip(crops, COLORS):
+        image = _decode(crop)
+        assert image.size == (16, 16)
+        assert image.getcolors() == [(256, color)]
+
+
+def test_partial_last_row():
+    crops = slice_grid(_atlas(3, 2, 8), cols=3, rows=2, count=4)
+    assert [_decode(c).getpixel((4, 4)) for c in crops] == COLORS[:4]
+
+
+def test_uneven_atlas_size_drops_remainder():
+    atlas = Image.new("RGB", (33, 17), (10, 20, 30))
+    buffer = BytesIO()
+    atlas.save(buffer, format="PNG")
+    crops = slice_grid(base64.b64encode(buffer.getvalue()).decode(), cols=2, rows=2, count=4)
+    assert all(_decode(c).size == (16, 8) for c in crops)
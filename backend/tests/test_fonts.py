@@ -0,0 +1,75 @@
+"""气泡文字排版测试"""
+
+from app.core.fonts import FontFace, get_font, layout_text, wrap_text
+
+
+class _FixedFont:
+    """等宽测试字体：CJK 字符宽 20，其他字符宽 10"""
+
+    def getlength(self, text: str) -> float:
+        return sum(10 if c.isascii() else 20 for c in text)
+
+    def getmetrics(self):
+        return 16, 4
+
+
+FACE = FontFace(_FixedFont(), 20)
+
+
+def test_font_face_metrics():
+    assert FACE.line_height == 20
+    assert FACE.measure("ab中") == 40
+
+
+def test_cjk_wraps_between_characters():
+    assert wrap_text("一二三四五六七", FACE, 60) == ["一二三", "四五六", "七"]
+
+
+def test_words_not_split():
+    assert wrap_text("hello world again", FACE, 120) == ["hello world", "again"]
+
+
+def test_long_word_split_by_character():
+    assert wrap_text("abcdefghij", FACE, 40) == ["abcd", "efgh", "ij"]
+
+
+def test_no_line_start_punctuation_hangs():
+    """行首禁则标点悬挂在上一行末尾"""
+    assert wrap_text("一二三，四五", FACE, 60) == ["一二三，", "四五"]
+    assert wrap_text("一二三」。四", FACE, 60) == ["一二三」。", "四"]
+
+
+def test_leading_spaces_dropped_after_wrap():
+    assert wrap_text("abc   def", FACE, 40) == ["abc", "def"]
+
+
+def test_keeps_explicit_newlines():
+    assert wrap_text("一\n\n二", FACE, 100) == ["一", "", "二"]
+
+
+def test_get_font_shared():
+    assert get_font(18) is get_font(18)
+    assert get_font(18) is not get_font(20)
+
+
+def test_layout_fits_and_shrinks():
+    text = "这是一段比较长的对白，需要在气泡里换行显示。" * 3
+    roomy = layout_text(text, 400, 400, max_size=24, min_size=10)
+    tight = layout_text(text, 120, 90, max_size=24, min_size=10)
+    assert roomy.fits and roomy.size == 24
+    assert tight.size < roomy.size
+    assert tight.height == len(tight.lines) * tight.line_height
+    if tight.fits:
+        assert tight.height <= 90
+    face = get_font(tight.size, tight.font_path)
+    assert all(face.measure(line) <= 120 for line in tight.lines)
+
+
+def test_layout_stops_at_min_size():
+    layout = layout_text("字" * 200, 40, 20, max_size=24, min_size=12)
+    assert layout.size == 12
+    assert not layout.fits
+
+
+def test_layout_cached():
+    assert layout_text("你好", 100, 50, 20) is layout_text("你好", 100, 50, 20)
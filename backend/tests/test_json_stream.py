@@ -0,0 +1,104 @@
+"""增量JSON解析测试"""
+
+import asyncio
+import json
+
+from app.core.json_stream import JSONStreamParser, iter_json_objects, match_path
+
+
+PANEL_PATH = ("scenes", "*", "panels", "*")
+SCENE_PATH = ("scenes", "*")
+
+DOCUMENT = {
+    "scenes": [
+        {
+            "location": "教室 {门口}",
+            "panels": [
+                {"id": 1, "dialogue": "他说：\"}]不是结束\"", "tags": ["a", "b"]},
+                {"id": 2, "dialogue": "反斜杠 \\ 和 \\\" 转义", "nested": {"x": [1, {"y": 2}]}},
+            ],
+        },
+        {"location": "走廊", "panels": [{"id": 3, "dialogue": ""}]},
+    ],
+}
+TEXT = "```json\n" + json.dumps(DOCUMENT, ensure_ascii=False, indent=2) + "\n```\n后续说明 {忽略}"
+
+
+def _feed_all(chunks):
+    parser = JSONStreamParser([PANEL_PATH, SCENE_PATH])
+    results = []
+    for chunk in chunks:
+        results.extend(parser.feed(chunk))
+    return parser, results
+
+
+def _expected():
+    items = []
+    for i, scene in enumerate(DOCUMENT["scenes"]):
+        for j, panel in enumerate(scene["panels"]):
+            items.append((("scenes", i, "panels", j), panel))
+        items.append((("scenes", i), scene))
+    return items
+
+
+def test_match_path():
+    assert match_path(("scenes", 0, "panels", 3), PANEL_PATH)
+    assert not match_path(("scenes", 0), PANEL_PATH)
+    assert not match_path(("chapters", 0, "panels", 3), PANEL_PATH)
+
+
+def test_whole_text():
+    parser, results = _feed_all([TEXT])
+    assert results == _expected()
+    assert parser.finished
+
+
+def test_every_split_point():
+    """在任意位置切成两段（包括字符串、转义符和键名中间）结果都相同"""
+    expected = _expected()
+    for split in range(len(TEXT) + 1):
+        parser, results = _feed_all([TEXT[:split], TEXT[split:]])
+        assert results == expected, split
+        assert parser.finished
+
+
+def test_single_character_chunks():
+    parser, results = _feed_all(list(TEXT))
+    assert results == _expected()
+    assert parser.finished
+
+
+def test_objects_emitted_when_closed():
+    """分镜对象闭合后立即产出，不等待整个响应"""
+    first_panel_end = TEXT.index("}", TEXT.index('"tags"')) + 1
+    parser = JSONStreamParser([PANEL_PATH])
+    results = parser.feed(TEXT[:first_panel_end])
+    assert results == [(("scenes", 0, "panels", 0), DOCUMENT["scenes"][0]["panels"][0])]
+    assert not parser.finished
+
+
+def test_truncated_response_not_finished():
+    parser, results = _feed_all([TEXT[:TEXT.index("走廊")]])
+    assert [path for path, _ in results] == [
+        ("scenes", 0, "panels", 0),
+        ("scenes", 0, "panels", 1),
+        ("scenes", 0),
+    ]
+    assert not parser.finished
+
+
+def test_text_keeps_full_input():
+    parser, _ = _feed_all([TEXT[:10], TEXT[10:]])
+    assert parser.text == TEXT
+
+
+def test_iter_json_objects():
+    async def chunks():
+        for start in range(0, len(TEXT), 7):
+            yield TEXT[start:start + 7]
+
+    async def collect():
+        return [item async for item in iter_json_objects(chunks(), [PANEL_PATH])]
+
+    results = asyncio.run(collect())
+    assert [value["id"] for _, value in results] == [1, 2, 3]
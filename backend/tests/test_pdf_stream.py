@@ -0,0 +1,156 @@
+"""流式PDF写入测试"""
+
+import random
+import re
+import struct
+import zlib
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from app.core.pdf_stream import PDFStreamWriter, iter_pdf, write_pdf
+from app.core.png_stream import _chunk
+
+
+def _noise(mode: str, width: int, height: int, seed: int = 0) -> Image.Image:
+    rng = random.Random(seed)
+    return Image.frombytes(
+        mode, (width, height), bytes(rng.randrange(256) for _ in range(width * height * len(mode)))
+    )
+
+
+def _save(image: Image.Image, fmt: str, path) -> str:
+    image.save(path, format=fmt)
+    return str(path)
+
+
+class _PDF:
+    """按交叉引用表读取对象（只支持 PDFStreamWriter 的输出）"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        xref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", data).group(1))
+        lines = data[xref:].split(b"\n")
+        assert lines[0] == b"xref"
+        count = int(lines[1].split()[1])
+        self.offsets = {n: int(lines[2 + n][:10]) for n in range(1, count)}
+        for number, offset in self.offsets.items():
+            assert data.startswith(f"{number} 0 obj\n".encode(), offset), number
+
+    def body(self, number: int) -> bytes:
+        start = self.offsets[number] + len(f"{number} 0 obj\n")
+        return self.data[start:self.data.index(b"endobj", start)]
+
+    def stream(self, number: int):
+        body = self.body(number)
+        header, _, _ = body.partition(b"\nstream\n")
+        length_ref = int(re.search(rb"/Length (\d+) 0 R", header).group(1))
+        length = int(self.body(length_ref).strip())
+        start = self.offsets[number] + len(f"{number} 0 obj\n") + len(header) + len(b"\nstream\n")
+        return header.decode("latin-1"), self.data[start:start + length]
+
+    def images(self):
+        """按页面顺序返回各页的 (图像字典, 图像数据)"""
+        catalog = self.body(1).decode()
+        pages = int(re.search(r"/Pages (\d+) 0 R", catalog).group(1))
+        kids = re.findall(r"(\d+) 0 R", re.search(r"/Kids \[(.*?)\]", self.body(pages).decode()).group(1))
+        result = []
+        for kid in kids:
+            page = self.body(int(kid)).decode()
+            image = int(re.search(r"/Im0 (\d+) 0 R", page).group(1))
+            result.append(self.stream(image))
+        return result
+
+
+def _png_from_stream(header: str, data: bytes) -> Image.Image:
+    """用 PDF 中的 Flate + PNG 预测器数据重建 PNG"""
+    width = int(re.search(r"/Width (\d+)", header).group(1))
+    height = int(re.search(r"/Height (\d+)", header).group(1))
+    color_type = 2 if "DeviceRGB" in header else 0
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        + _chunk(b"IDAT", data)
+        + _chunk(b"IEND", b"")
+    )
+    return Image.open(BytesIO(png))
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB"])
+def test_png_passthrough(tmp_path, mode):
+    image = _noise(mode, 31, 17)
+    path = _save(image, "PNG", tmp_path / "page.png")
+    buffer = BytesIO()
+    assert write_pdf([path], buffer) == 1
+
+    [(header, data)] = _PDF(buffer.getvalue()).images()
+    assert "/Predictor 15" in header
+    assert _png_from_stream(header, data).tobytes() == image.tobytes()
+
+
+def test_png_with_multiple_idat_chunks(tmp_path):
+    image = _noise("RGB", 300, 300)
+    path = _save(image, "PNG", tmp_path / "page.png")
+    with open(path, "rb") as f:
+        assert f.read().count(b"IDAT") > 1
+    buffer = BytesIO()
+    write_pdf([path], buffer)
+
+    [(header, data)] = _PDF(buffer.getvalue()).images()
+    assert _png_from_stream(header, data).tobytes() == image.tobytes()
+
+
+def test_jpeg_passthrough(tmp_path):
+    path = _save(_noise("RGB", 20, 12), "JPEG", tmp_path / "page.jpg")
+    buffer = BytesIO()
+    write_pdf([path], buffer)
+
+    [(header, data)] = _PDF(buffer.getvalue()).images()
+    assert "/DCTDecode" in header and "/DeviceRGB" in header
+    with open(path, "rb") as f:
+        assert data == f.read()
+
+
+def test_transparent_png_composited_on_white(tmp_path):
+    image = _noise("RGBA", 9, 300)  # 超过一个编码行块
+    path = _save(image, "PNG", tmp_path / "page.png")
+    buffer = BytesIO()
+    write_pdf([path], buffer)
+
+    [(header, data)] = _PDF(buffer.getvalue()).images()
+    assert "/Predictor" not in header
+    decoded = Image.frombytes("RGB", image.size, zlib.decompress(data))
+    expected = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image).convert("RGB")
+    assert decoded.tobytes() == expected.tobytes()
+
+
+def test_pages_in_order_with_file_objects(tmp_path):
+    images = [_noise("RGB", 10 + i, 8, seed=i) for i in range(3)]
+    sources = [_save(images[0], "PNG", tmp_path / "0.png")]
+    with open(_save(images[1], "PNG", tmp_path / "1.png"), "rb") as fp:
+        sources.append(BytesIO(fp.read()))
+    sources.append(_save(images[2], "PNG", tmp_path / "2.png"))
+
+    buffer = BytesIO()
+    assert write_pdf(sources, buffer, resolution=144.0) == 3
+    pdf = _PDF(buffer.getvalue())
+    assert b"/Count 3" in buffer.getvalue()
+    for (header, data), image in zip(pdf.images(), images):
+        assert _png_from_stream(header, data).tobytes() == image.tobytes()
+    # 144 DPI 时页面尺寸为像素的一半
+    assert b"/MediaBox [0 0 5.0000 4.0000]" in buffer.getvalue()
+
+
+def test_iter_pdf_matches_write_pdf(tmp_path):
+    paths = [_save(_noise("RGB", 6, 6, seed=i), "PNG", tmp_path / f"{i}.png") for i in range(2)]
+    buffer = BytesIO()
+    write_pdf(paths, buffer)
+    chunks = list(iter_pdf(paths))
+    assert len(chunks) == 3  # 每页一段 + 文件尾
+    assert b"".join(chunks) == buffer.getvalue()
+
+
+def test_empty_pdf_rejected():
+    with pytest.raises(ValueError):
+        PDFStreamWriter(BytesIO()).close()
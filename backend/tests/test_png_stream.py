@@ -0,0 +1,73 @@
+"""流式PNG编码测试"""
+
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from app.core.png_stream import PNGStreamWriter
+
+
+def _noise(mode: str, width: int, height: int, seed: int = 0) -> Image.Image:
+    rng = random.Random(seed)
+    channels = len(mode)
+    return Image.frombytes(
+        mode, (width, height), bytes(rng.randrange(256) for _ in range(width * height * channels))
+    )
+
+
+def _encode(image: Image.Image, strip_heights) -> bytes:
+    buffer = BytesIO()
+    writer = PNGStreamWriter(buffer, image.width, image.height, image.mode)
+    top = 0
+    for height in strip_heights:
+        writer.write(image.crop((0, top, image.width, top + height)))
+        top += height
+    writer.close()
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+@pytest.mark.parametrize("strips", [[23], [1] * 23, [5, 1, 10, 7]])
+def test_round_trip(mode, strips):
+    image = _noise(mode, 17, 23)
+    with Image.open(BytesIO(_encode(image, strips))) as decoded:
+        assert decoded.mode == mode
+        assert decoded.size == image.size
+        assert decoded.tobytes() == image.tobytes()
+
+
+def test_converts_strip_mode():
+    image = _noise("RGB", 8, 6)
+    buffer = BytesIO()
+    writer = PNGStreamWriter(buffer, 8, 6, "L")
+    writer.write(image)
+    writer.close()
+    with Image.open(BytesIO(buffer.getvalue())) as decoded:
+        assert decoded.tobytes() == image.convert("L").tobytes()
+
+
+def test_rejects_wrong_width():
+    writer = PNGStreamWriter(BytesIO(), 8, 4)
+    with pytest.raises(ValueError):
+        writer.write(Image.new("RGB", (7, 4)))
+
+
+def test_rejects_too_many_rows():
+    writer = PNGStreamWriter(BytesIO(), 8, 4)
+    writer.write(Image.new("RGB", (8, 3)))
+    with pytest.raises(ValueError):
+        writer.write(Image.new("RGB", (8, 2)))
+
+
+def test_close_requires_all_rows():
+    writer = PNGStreamWriter(BytesIO(), 8, 4)
+    writer.write(Image.new("RGB", (8, 3)))
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_unsupported_mode():
+    with pytest.raises(ValueError):
+        PNGStreamWriter(BytesIO(), 8, 4, "CMYK")
@@ -0,0 +1,157 @@
+"""LLM请求重试与对冲测试"""
+
+import asyncio
+import itertools
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services.ai.base import BaseAIAdapter
+from app.services.ai.resilience import HEDGE_MIN_SAMPLES, ResilientTextAdapter, is_retryable
+
+
+_names = itertools.count()
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeAdapter(BaseAIAdapter):
+    """按脚本依次返回结果的适配器：每一步为 (等待秒数, 返回值或异常)"""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def generate_text(self, **kwargs) -> str:
+        delay, outcome = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def generate_text_stream(self, **kwargs):
+        yield await self.generate_text(**kwargs)
+
+    async def generate_image(self, *args, **kwargs):
+        return []
+
+    async def analyze_image(self, *args, **kwargs):
+        return ""
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_DELAY", 0.02)
+    monkeypatch.setattr(settings, "LLM_RETRY_BACKOFF", 0.001)
+    monkeypatch.setattr(settings, "LLM_RETRY_BACKOFF_MAX", 0.002)
+
+
+def _adapter(primary, secondary=None, hedge=True, max_retries=0, samples=0.02):
+    adapter = ResilientTextAdapter(
+        primary,
+        f"test-{next(_names)}",
+        secondary=secondary,
+        hedge=hedge,
+        max_retries=max_retries,
+    )
+    for _ in range(HEDGE_MIN_SAMPLES):
+        adapter.latency.record(samples)
+    return adapter
+
+
+def test_is_retryable():
+    assert is_retryable(StatusError(429))
+    assert is_retryable(StatusError(503))
+    assert is_retryable(StatusError(408))
+    assert not is_retryable(StatusError(400))
+    assert not is_retryable(StatusError(401))
+    assert is_retryable(httpx.ConnectError("refused"))
+    assert not is_retryable(ValueError("bad"))
+
+
+def test_no_hedge_without_samples():
+    adapter = ResilientTextAdapter(FakeAdapter((0, "ok")), f"test-{next(_names)}", hedge=True)
+    assert adapter.hedge_delay() is None
+    assert _adapter(FakeAdapter((0, "ok")), hedge=False).hedge_delay() is None
+
+
+def test_hedge_delay_floor():
+    adapter = _adapter(FakeAdapter((0, "ok")), samples=0.001)
+    assert adapter.hedge_delay() == settings.LLM_HEDGE_MIN_DELAY
+
+
+def test_fast_primary_not_hedged():
+    secondary = FakeAdapter((0, "backup"))
+    adapter = _adapter(FakeAdapter((0, "primary")), secondary)
+    assert asyncio.run(adapter.generate_text("hi")) == "primary"
+    assert secondary.calls == 0
+    assert adapter.stats["hedges_fired"] == 0
+
+
+def test_slow_primary_hedged_and_sampled():
+    """对冲胜出时，被取消的慢请求按已等待时间计入延迟样本"""
+    secondary = FakeAdapter((0, "backup"))
+    adapter = _adapter(FakeAdapter((1.0, "primary")), secondary)
+    before = len(adapter.latency._samples)
+
+    assert asyncio.run(adapter.generate_text("hi")) == "backup"
+    assert adapter.stats["hedges_fired"] == 1
+    assert adapter.stats["hedges_won"] == 1
+    assert len(adapter.latency._samples) == before + 1
+    assert adapter.latency._samples[-1] >= settings.LLM_HEDGE_MIN_DELAY
+
+
+def test_primary_wins_after_hedge():
+    adapter = _adapter(FakeAdapter((0.05, "primary")), FakeAdapter((1.0, "backup")))
+    assert asyncio.run(adapter.generate_text("hi")) == "primary"
+    assert adapter.stats["hedges_fired"] == 1
+    assert adapter.stats["hedges_won"] == 0
+
+
+def test_hedges_to_primary_without_secondary():
+    primary = FakeAdapter((1.0, "slow"), (0, "fast"))
+    adapter = _adapter(primary)
+    assert asyncio.run(adapter.generate_text("hi")) == "fast"
+    assert primary.calls == 2
+
+
+def test_backup_used_when_primary_fails_after_hedge():
+    adapter = _adapter(FakeAdapter((0.05, StatusError(400))), FakeAdapter((0.1, "backup")))
+    assert asyncio.run(adapter.generate_text("hi")) == "backup"
+
+
+def test_both_fail():
+    adapter = _adapter(FakeAdapter((0.05, StatusError(400))), FakeAdapter((0.06, StatusError(401))))
+    with pytest.raises(StatusError):
+        asyncio.run(adapter.generate_text("hi"))
+    assert adapter.stats["failures"] == 1
+
+
+def test_retries_retryable_errors():
+    primary = FakeAdapter((0, StatusError(503)), (0, StatusError(429)), (0, "ok"))
+    adapter = _adapter(primary, hedge=False, max_retries=3)
+    assert asyncio.run(adapter.generate_text("hi")) == "ok"
+    assert primary.calls == 3
+    assert adapter.stats["retries"] == 2
+
+
+def test_does_not_retry_client_errors():
+    primary = FakeAdapter((0, StatusError(400)), (0, "ok"))
+    adapter = _adapter(primary, hedge=False, max_retries=3)
+    with pytest.raises(StatusError):
+        asyncio.run(adapter.generate_text("hi"))
+    assert primary.calls == 1
+
+
+def test_retry_budget():
+    primary = FakeAdapter((0, StatusError(503)))
+    adapter = _adapter(primary, hedge=False, max_retries=2)
+    with pytest.raises(StatusError):
+        asyncio.run(adapter.generate_text("hi"))
+    assert primary.calls == 3
@@ -0,0 +1,121 @@
+"""SD WebUI 批量文生图的提示词-图像映射测试"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services.ai import sd_adapter
+from app.services.ai.sd_adapter import PROMPT_BATCH_SCRIPT, SDAdapter
+
+
+class FakeWebUI:
+    """模拟 /sdapi/v1/txt2img：图像内容为 "img:<提示词>"，批量脚本可打乱顺序或出错"""
+
+    def __init__(self, reverse: bool = False, script_error: int = 0, drop_last: bool = False):
+        self.reverse = reverse
+        self.script_error = script_error
+        self.drop_last = drop_last
+        self.payloads = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.payloads.append(payload)
+        if payload.get("script_name") == PROMPT_BATCH_SCRIPT:
+            if self.script_error:
+                return httpx.Response(self.script_error, json={"detail": "error"})
+            prompts = payload["script_args"][3].split("\n")
+            if self.reverse:
+                prompts = prompts[::-1]
+        else:
+            prompts = [payload["prompt"]] * payload.get("batch_size", 1)
+        images = [f"img:{p}" for p in prompts]
+        if self.drop_last:
+            images = images[:-1]
+        # 多张图像时 WebUI 在最前面附带网格图
+        first = 1 if len(prompts) > 1 else 0
+        info = {"all_prompts": prompts, "index_of_first_image": first}
+        return httpx.Response(200, json={"images": ["grid"] * first + images, "info": json.dumps(info)})
+
+
+@pytest.fixture
+def webui(monkeypatch):
+    def install(**kwargs):
+        server = FakeWebUI(**kwargs)
+        transport = httpx.MockTransport(server.handle)
+        monkeypatch.setattr(
+            sd_adapter,
+            "get_http_client",
+            lambda base_url: httpx.AsyncClient(transport=transport, base_url=base_url),
+        )
+        return server
+
+    return install
+
+
+def _scripted(server):
+    return [p for p in server.payloads if p.get("script_name") == PROMPT_BATCH_SCRIPT]
+
+
+def test_script_results_mapped_by_prompt(webui):
+    """脚本执行顺序与输入不同时，按 info.all_prompts 映射回输入顺序"""
+    server = webui(reverse=True)
+    adapter = SDAdapter(base_url="http://sd", max_batch_size=4)
+    prompts = ["a girl", "a boy\nrunning", "a cat"]
+
+    images = asyncio.run(adapter.txt2img_batch(prompts))
+
+    assert images == ["img:a girl", "img:a boy running", "img:a cat"]
+    assert len(_scripted(server)) == 1
+
+
+def test_repeated_prompts_use_batch_size(webui):
+    server = webui()
+    adapter = SDAdapter(base_url="http://sd", max_batch_size=4)
+
+    images = asyncio.run(adapter.txt2img_batch(["same", "other", "same"]))
+
+    assert images == ["img:same", "img:other", "img:same"]
+    assert [p.get("batch_size", 1) for p in server.payloads] == [2, 1]
+    assert not _scripted(server)
+
+
+def test_chunks_by_max_batch_size(webui):
+    server = webui()
+    adapter = SDAdapter(base_url="http://sd", max_batch_size=2)
+    prompts = [f"p{i}" for i in range(5)]
+
+    images = asyncio.run(adapter.txt2img_batch(prompts))
+
+    assert images == [f"img:p{i}" for i in range(5)]
+    assert [len(p["script_args"][3].split("\n")) for p in _scripted(server)] == [2, 2]
+
+
+def test_count_mismatch_not_mapped_by_position(webui):
+    """图像数与提示词数不一致时不按位置分配"""
+    webui(drop_last=True)
+    adapter = SDAdapter(base_url="http://sd", max_batch_size=4)
+
+    assert asyncio.run(adapter.txt2img_batch(["a", "b", "c"])) == [None, None, None]
+
+
+def test_unsupported_script_falls_back(webui):
+    server = webui(script_error=422)
+    adapter = SDAdapter(base_url="http://sd", max_batch_size=4)
+
+    assert asyncio.run(adapter.txt2img_batch(["a", "b"])) == ["img:a", "img:b"]
+    assert adapter._prompt_script_supported is False
+
+    server.payloads.clear()
+    assert asyncio.run(adapter.txt2img_batch(["c", "d"])) == ["img:c", "img:d"]
+    assert not _scripted(server)
+
+
+def test_transient_error_keeps_script(webui):
+    webui(script_error=500)
+    adapter = SDAdapter(base_url="http://sd", max_batch_size=4)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(adapter.txt2img_batch(["a", "b"]))
+    assert adapter._prompt_script_supported is True